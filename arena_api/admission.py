@@ -0,0 +1,288 @@
+"""
+arena_api/admission.py
+Admission control in front of the judge.
+
+Every request that is about to execute code takes a lease first:
+  - at most MAX_PER_USER judge calls in flight per user; going over is
+    refused straight away (it is the same student clicking Run again)
+  - at most MAX_PER_CLASSROOM per classroom and MAX_INFLIGHT in total;
+    going over waits, in a wait queue of at most MAX_WAITING requests, for
+    up to WAIT_SECONDS
+A refused request raises Rejected, which the views turn into a 429 with a
+Retry-After header, instead of piling another job onto a saturated box.
+
+With REDIS_URL set the counters are shared by every web worker: each limit is
+a sorted set of lease tokens scored by expiry, so leases held by a process
+that died disappear after LEASE_SECONDS. Without Redis (or while it is
+unreachable) the counters are kept per process.
+"""
+import contextlib
+import math
+import os
+import threading
+import time
+import uuid
+
+ENABLED           = os.environ.get('JUDGE_ADMISSION', 'True') == 'True'
+MAX_INFLIGHT      = int(os.environ.get('JUDGE_ADMIT_MAX_INFLIGHT', 32))
+MAX_PER_USER      = int(os.environ.get('JUDGE_ADMIT_PER_USER', 2))
+MAX_PER_CLASSROOM = int(os.environ.get('JUDGE_ADMIT_PER_CLASSROOM', 16))
+MAX_WAITING       = int(os.environ.get('JUDGE_ADMIT_QUEUE', 64))
+WAIT_SECONDS      = float(os.environ.get('JUDGE_ADMIT_WAIT', 10))
+RETRY_AFTER       = int(os.environ.get('JUDGE_ADMIT_RETRY_AFTER', 2))   # seconds, sent to clients
+LEASE_SECONDS     = 300   # longest a crashed holder can keep a slot
+REDIS_RETRY       = 30    # seconds on the in-process counters after a Redis error
+REDIS_URL         = os.environ.get('REDIS_URL', '')
+POLL              = 0.05
+
+_counts = {'admitted': 0, 'waited': 0, 'rejected_user': 0, 'rejected_busy': 0}
+_counts_lock = threading.Lock()
+
+
+class Rejected(Exception):
+    """The judge is saturated for this caller; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _count(name):
+    with _counts_lock:
+        _counts[name] += 1
+
+
+# ── Backends ──────────────────────────────────────────────────────────────────
+# try_acquire(token, scopes) takes a lease on every (key, limit) scope, or on
+# none of them, and returns the first key whose limit is reached (None on
+# success). Scopes are listed user first, so a user over their own limit is
+# told so rather than queued.
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self):
+        self._cond    = threading.Condition()
+        self._active  = {}
+        self._waiting = 0
+
+    def try_acquire(self, token, scopes):
+        with self._cond:
+            for key, limit in scopes:
+                if self._active.get(key, 0) >= limit:
+                    return key
+            for key, _ in scopes:
+                self._active[key] = self._active.get(key, 0) + 1
+            return None
+
+    def release(self, token, scopes):
+        with self._cond:
+            for key, _ in scopes:
+                self._active[key] -= 1
+                if not self._active[key]:
+                    del self._active[key]
+            self._cond.notify_all()
+
+    def enter_queue(self, token):
+        with self._cond:
+            if self._waiting >= MAX_WAITING:
+                return False
+            self._waiting += 1
+            return True
+
+    def leave_queue(self, token):
+        with self._cond:
+            self._waiting -= 1
+
+    def wait(self, seconds):
+        with self._cond:
+            self._cond.wait(seconds)   # woken early by release()
+
+    def stats(self):
+        with self._cond:
+            return {'inflight': self._active.get('global', 0), 'waiting': self._waiting}
+
+
+# KEYS: lease sets; ARGV: now, lease expiry, token, then one limit per key
+_ACQUIRE = """
+for i, key in ipairs(KEYS) do
+  redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[1])
+end
+for i, key in ipairs(KEYS) do
+  if redis.call('ZCARD', key) >= tonumber(ARGV[3 + i]) then return i end
+end
+for i, key in ipairs(KEYS) do
+  redis.call('ZADD', key, ARGV[2], ARGV[3])
+  redis.call('EXPIRE', key, math.ceil(ARGV[2] - ARGV[1]))
+end
+return 0
+"""
+
+
+class RedisBackend:
+    name = 'redis'
+
+    def __init__(self, url):
+        import redis as redis_lib
+        self.r = redis_lib.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+        self._acquire = self.r.register_script(_ACQUIRE)
+
+    @staticmethod
+    def _key(scope):
+        return f'judge:admit:{scope}'
+
+    def try_acquire(self, token, scopes):
+        now = time.time()
+        keys = [self._key(key) for key, _ in scopes]
+        hit = self._acquire(keys=keys, args=[now, now + LEASE_SECONDS, token] + [limit for _, limit in scopes])
+        return scopes[int(hit) - 1][0] if int(hit) else None
+
+    def release(self, token, scopes):
+        pipe = self.r.pipeline()
+        for key, _ in scopes:
+            pipe.zrem(self._key(key), token)
+        pipe.execute()
+
+    def enter_queue(self, token):
+        now = time.time()
+        hit = self._acquire(keys=[self._key('waiting')],
+                            args=[now, now + WAIT_SECONDS + 5, token, MAX_WAITING])
+        return not int(hit)
+
+    def leave_queue(self, token):
+        self.r.zrem(self._key('waiting'), token)
+
+    def wait(self, seconds):
+        time.sleep(min(seconds, POLL))
+
+    def stats(self):
+        now = time.time()
+        return {
+            'inflight': self.r.zcount(self._key('global'), now, '+inf'),
+            'waiting':  self.r.zcount(self._key('waiting'), now, '+inf'),
+        }
+
+
+_memory = MemoryBackend()
+_redis = None
+_redis_lock = threading.Lock()
+_redis_down_until = 0.0
+
+
+def _backends():
+    """Backends to try in order: Redis when configured, then the in-process fallback."""
+    global _redis
+    if REDIS_URL and _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                try:
+                    _redis = RedisBackend(REDIS_URL)
+                except ImportError:
+                    _redis = False
+    if _redis and time.monotonic() >= _redis_down_until:
+        return [_redis, _memory]
+    return [_memory]
+
+
+# ── API ───────────────────────────────────────────────────────────────────────
+
+def _scopes(user_id, classroom_id):
+    scopes = [(f'user:{user_id}', MAX_PER_USER)]
+    if classroom_id:
+        scopes.append((f'classroom:{classroom_id}', MAX_PER_CLASSROOM))
+    scopes.append(('global', MAX_INFLIGHT))
+    return scopes
+
+
+def _acquire(backend, token, scopes):
+    full = backend.try_acquire(token, scopes)
+    if full is None:
+        return
+    if full == scopes[0][0]:
+        _count('rejected_user')
+        raise Rejected('You already have code running. Wait for it to finish and try again.')
+    if not backend.enter_queue(token):
+        _count('rejected_busy')
+        raise Rejected('The judge is busy right now. Please try again in a moment.')
+    _count('waited')
+    deadline = time.monotonic() + WAIT_SECONDS
+    try:
+        while full is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _count('rejected_busy')
+                raise Rejected('The judge is busy right now. Please try again in a moment.',
+                               retry_after=max(RETRY_AFTER, math.ceil(WAIT_SECONDS / 2)))
+            backend.wait(min(remaining, POLL))
+            full = backend.try_acquire(token, scopes)
+            if full == scopes[0][0]:
+                _count('rejected_user')
+                raise Rejected('You already have code running. Wait for it to finish and try again.')
+    finally:
+        backend.leave_queue(token)
+
+
+@contextlib.contextmanager
+def admit(user_id, classroom_id=None):
+    """
+    Hold an execution lease for the duration of the block. Raises Rejected
+    when the user is over their limit, or the judge stays saturated past the
+    wait deadline or its wait queue is full.
+    """
+    global _redis_down_until
+    if not ENABLED:
+        yield
+        return
+    token  = uuid.uuid4().hex
+    scopes = _scopes(user_id, classroom_id)
+    for backend in _backends():
+        try:
+            _acquire(backend, token, scopes)
+            break
+        except Rejected:
+            raise
+        except Exception:
+            # Redis unreachable: use this process's counters for a while
+            _redis_down_until = time.monotonic() + REDIS_RETRY
+    _count('admitted')
+    try:
+        yield
+    finally:
+        try:
+            backend.release(token, scopes)
+        except Exception:
+            pass   # the lease expires on its own
+
+
+@contextlib.asynccontextmanager
+async def admit_async(user_id, classroom_id=None):
+    """admit() for the WebSocket consumers; any wait for a lease happens in a worker thread."""
+    import asyncio
+    lease = admit(user_id, classroom_id)
+    entering = asyncio.ensure_future(asyncio.to_thread(lease.__enter__))
+    try:
+        await asyncio.shield(entering)
+    except asyncio.CancelledError:
+        # The thread may still get the lease; hand it straight back when it does
+        entering.add_done_callback(
+            lambda f: f.cancelled() or f.exception() is not None or lease.__exit__(None, None, None))
+        raise
+    try:
+        yield
+    finally:
+        lease.__exit__(None, None, None)   # a set update or one Redis round trip
+
+
+def stats() -> dict:
+    backend = _backends()[0]
+    try:
+        current = backend.stats()
+    except Exception as e:
+        backend, current = _memory, {**_memory.stats(), 'redis_error': str(e)}
+    with _counts_lock:
+        counts = dict(_counts)
+    return {
+        'enabled': ENABLED, 'backend': backend.name, **current, **counts,
+        'limits': {'inflight': MAX_INFLIGHT, 'per_user': MAX_PER_USER,
+                   'per_classroom': MAX_PER_CLASSROOM, 'queue': MAX_WAITING, 'wait_s': WAIT_SECONDS},
+    }
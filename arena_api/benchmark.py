@@ -0,0 +1,266 @@
+"""
+arena_api/benchmark.py
+Throughput and latency benchmark for runner.py.
+
+Every supported language has a small corpus of submissions for one problem
+(sum the integers on a line): an accepted solution, a wrong answer, a time
+limit exceeded, a compile (or syntax) error and an output flood. The corpus is
+judged through runner.run_test_cases at a fixed concurrency and the report
+(jobs/s, latency percentiles, per-phase breakdown from metrics.py, verdicts
+that did not match the program's kind) is returned as JSON-ready data, so runs
+on the same host can be diffed over time. Languages whose toolchain is
+missing are listed under 'skipped' instead of being run.
+
+  python manage.py judge_bench --concurrency 4 --repeat 5 --output bench.json
+  python -m arena_api.benchmark --languages python,cpp --kinds ac,wa
+
+The module only needs the runner, so the second form works without Django.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+KINDS = ('ac', 'wa', 'tle', 'ce', 'flood')
+
+CASES = [
+    {'input_data': '1 2 3\n',  'output_data': '6'},
+    {'input_data': '10 20\n',  'output_data': '30'},
+    {'input_data': '-5 5 7\n', 'output_data': '7'},
+]
+_SQL_SETUP = 'CREATE TABLE t (x INTEGER);\nINSERT INTO t VALUES {};'
+SQL_CASES = [
+    {'input_data': _SQL_SETUP.format('(1), (2), (3)'),  'output_data': '6'},
+    {'input_data': _SQL_SETUP.format('(10), (20)'),     'output_data': '30'},
+    {'input_data': _SQL_SETUP.format('(-5), (5), (7)'), 'output_data': '7'},
+]
+
+_JS_SUM = ("const nums = require('fs').readFileSync(0, 'utf8').trim().split(/\\s+/).map(Number);\n"
+           "console.log(nums.reduce((a, b) => a + b, 0){});\n")
+_TS_SUM = ("const nums: number[] = require('fs').readFileSync(0, 'utf8').trim().split(/\\s+/).map(Number);\n"
+           "console.log(nums.reduce((a: number, b: number) => a + b, 0){});\n")
+_CPP_SUM = ('#include <iostream>\n'
+            'int main() {{\n    long long x, s = 0;\n    while (std::cin >> x) s += x;\n'
+            '    std::cout << s{} << "\\n";\n}}\n')
+_JAVA_MAIN = 'import java.util.*;\n\npublic class Main {{\n    public static void main(String[] args) {{\n{}    }}\n}}\n'
+_JAVA_SUM = ('        Scanner sc = new Scanner(System.in);\n        long s = 0;\n'
+             '        while (sc.hasNextLong()) s += sc.nextLong();\n        System.out.println(s{});\n')
+_GO_MAIN = 'package main\n\nimport "fmt"\n\nfunc main() {{\n{}}}\n'
+_GO_SUM = ('\tvar s, x int64\n\tfor {{\n\t\tif _, err := fmt.Scan(&x); err != nil {{\n\t\t\tbreak\n\t\t}}\n'
+           '\t\ts += x\n\t}}\n\tfmt.Println(s{})\n')
+
+# language → kind → source. HTML is a substring check with nothing to execute
+# and is left out.
+CORPUS = {
+    'python': {
+        'ac':    'print(sum(map(int, input().split())))\n',
+        'wa':    'print(sum(map(int, input().split())) + 1)\n',
+        'tle':   'while True:\n    pass\n',
+        'ce':    'print(sum(map(int, input().split()))\n',
+        'flood': "while True:\n    print('x' * 100)\n",
+    },
+    'javascript': {
+        'ac':    _JS_SUM.format(''),
+        'wa':    _JS_SUM.format(' + 1'),
+        'tle':   'while (true) {}\n',
+        'ce':    'const nums = ;\n',
+        'flood': "const line = 'x'.repeat(100);\nwhile (true) console.log(line);\n",
+    },
+    'typescript': {
+        'ac':    _TS_SUM.format(''),
+        'wa':    _TS_SUM.format(' + 1'),
+        'tle':   'while (true) {}\n',
+        'ce':    'const nums: number[] = ;\n',
+        'flood': "const line: string = 'x'.repeat(100);\nwhile (true) console.log(line);\n",
+    },
+    'cpp': {
+        'ac':    _CPP_SUM.format(''),
+        'wa':    _CPP_SUM.format(' + 1'),
+        'tle':   'int main() {\n    volatile unsigned long i = 0;\n    for (;;) ++i;\n}\n',
+        'ce':    'int main() {\n    return x;\n}\n',
+        'flood': '#include <cstdio>\nint main() {\n    for (;;) std::puts("' + 'x' * 100 + '");\n}\n',
+    },
+    'java': {
+        'ac':    _JAVA_MAIN.format(_JAVA_SUM.format('')),
+        'wa':    _JAVA_MAIN.format(_JAVA_SUM.format(' + 1')),
+        'tle':   _JAVA_MAIN.format('        while (true) {}\n'),
+        'ce':    _JAVA_MAIN.format('        long s = 0\n'),
+        'flood': _JAVA_MAIN.format('        String line = "x".repeat(100);\n'
+                                   '        while (true) System.out.println(line);\n'),
+    },
+    'go': {
+        'ac':    _GO_MAIN.format(_GO_SUM.format('')),
+        'wa':    _GO_MAIN.format(_GO_SUM.format(' + 1')),
+        'tle':   _GO_MAIN.format('\tfmt.Print("")\n\tfor {\n\t}\n'),
+        'ce':    _GO_MAIN.format('\tfmt.Println(x)\n'),
+        'flood': _GO_MAIN.format('\tfor {\n\t\tfmt.Println("' + 'x' * 100 + '")\n\t}\n'),
+    },
+    'sql': {
+        'ac':    'SELECT SUM(x) FROM t',
+        'wa':    'SELECT SUM(x) + 1 FROM t',
+        # Counts an endless recursive CTE; run_sql interrupts it at the time limit
+        'tle':   'WITH RECURSIVE c(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM c) SELECT COUNT(*) FROM c',
+        'ce':    'SELEC SUM(x) FROM t',
+        'flood': ('WITH RECURSIVE c(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM c LIMIT 1000000) '
+                  'SELECT i FROM c'),
+    },
+}
+
+# Line comment per language, used to make every submission distinct with --unique
+_COMMENTS = {'python': '#', 'sql': '--'}
+
+
+def _percentiles(samples: list) -> dict:
+    """Nearest-rank p50/p95/p99 plus mean and max of raw samples."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    rank = lambda q: ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+    return {
+        'count': len(ordered),
+        'mean':  round(sum(ordered) / len(ordered), 3),
+        'p50':   round(rank(0.50), 3),
+        'p95':   round(rank(0.95), 3),
+        'p99':   round(rank(0.99), 3),
+        'max':   round(ordered[-1], 3),
+    }
+
+
+def _config(concurrency: int, repeat: int, kinds: list, unique: bool, warmup: bool) -> dict:
+    from . import build_cache, runner
+    return {
+        'concurrency': concurrency, 'repeat': repeat, 'kinds': list(kinds),
+        'unique': unique, 'warmup': warmup, 'cases_per_job': len(CASES),
+        'runner': {
+            'max_workers': runner.MAX_WORKERS, 'parallel': runner.PARALLEL,
+            'py_pool': runner.PY_POOL, 'streaming': runner.STREAMING,
+            'harness': runner.HARNESS,
+            'build_cache': build_cache.ENABLED, 'timeout_s': runner.TIMEOUT,
+        },
+    }
+
+
+def _job(language: str, kind: str, code: str) -> dict:
+    from . import runner
+    cases = SQL_CASES if language == 'sql' else CASES
+    started = time.perf_counter()
+    result = runner.run_test_cases(code, language, cases, timings=True)
+    latency = (time.perf_counter() - started) * 1000
+    return {
+        'language': language, 'kind': kind, 'latency_ms': latency,
+        # Only an accepted program should pass; anything else means the corpus
+        # or the runner is off (e.g. no TypeScript type stripping)
+        'expected': result['all_passed'] == (kind == 'ac'),
+        'timings': [result.get('timings', {})] + [r.get('timings', {}) for r in result['results']],
+    }
+
+
+def run(languages=None, kinds=KINDS, concurrency: int = 1, repeat: int = 3,
+        unique: bool = False, warmup: bool = True) -> dict:
+    """
+    Judge the corpus `repeat` times with `concurrency` jobs in flight and
+    return the report. `unique` appends a counter comment to each submission so
+    nothing is served from the build cache; `warmup` runs every program once,
+    unmeasured, first (starting pools and filling the cache).
+    """
+    from . import toolchains
+    report = {
+        'started':  time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host':     {'cpus': os.cpu_count(), 'python': platform.python_version(), 'platform': platform.platform()},
+        'config':   _config(concurrency, repeat, kinds, unique, warmup),
+        'skipped':  {},
+        'toolchains': {name: tool['version'] for name, tool in toolchains.tools().items() if tool['available']},
+    }
+
+    plan = []
+    for language in languages or CORPUS:
+        spec = toolchains.language(language)
+        if language not in CORPUS:
+            report['skipped'][language] = 'no benchmark corpus for this language'
+        elif spec is None or not spec['available']:
+            report['skipped'][language] = spec['missing'] if spec else 'unsupported'
+        else:
+            plan += [(language, kind) for kind in kinds if kind in CORPUS[language]]
+
+    def source(language, kind, n):
+        code = CORPUS[language][kind]
+        if unique:
+            code += f'\n{_COMMENTS.get(language, "//")} bench {os.getpid()}-{n}\n'
+        return code
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='bench') as pool:
+        if warmup:
+            list(pool.map(lambda job: _job(*job, source(*job, -1)), plan))
+        jobs = [(language, kind, source(language, kind, n))
+                for n in range(repeat) for language, kind in plan]
+        started = time.perf_counter()
+        done = list(pool.map(lambda job: _job(*job), jobs))
+        elapsed = time.perf_counter() - started
+
+    report['overall'] = {
+        'jobs': len(done), 'seconds': round(elapsed, 3),
+        'jobs_per_s': round(len(done) / elapsed, 3) if elapsed else None,
+        'latency_ms': _percentiles([d['latency_ms'] for d in done]),
+        'unexpected': sum(not d['expected'] for d in done),
+    }
+    report['languages'] = {}
+    for language in dict.fromkeys(d['language'] for d in done):
+        mine = [d for d in done if d['language'] == language]
+        phases = {}
+        for d in mine:
+            for record in d['timings']:
+                for key, value in record.items():
+                    if key.endswith('_ms') or key == 'peak_rss_kb':
+                        phases.setdefault(key, []).append(value)
+        report['languages'][language] = {
+            'jobs': len(mine),
+            'latency_ms': _percentiles([d['latency_ms'] for d in mine]),
+            'kinds': {kind: _percentiles([d['latency_ms'] for d in mine if d['kind'] == kind])
+                      for kind in dict.fromkeys(d['kind'] for d in mine)},
+            'phases': {key: _percentiles(values) for key, values in sorted(phases.items())},
+            'unexpected': sorted({d['kind'] for d in mine if not d['expected']}),
+        }
+    return report
+
+
+def add_arguments(parser) -> None:
+    """Options shared by `manage.py judge_bench` and `python -m arena_api.benchmark`."""
+    from . import runner
+    parser.add_argument('--languages', default='',
+                        help=f'Comma-separated languages (default: {",".join(CORPUS)}).')
+    parser.add_argument('--kinds', default=','.join(KINDS),
+                        help=f'Comma-separated program kinds (default: {",".join(KINDS)}).')
+    parser.add_argument('--concurrency', type=int, default=runner.MAX_WORKERS,
+                        help='Jobs in flight at once (default: JUDGE_MAX_WORKERS).')
+    parser.add_argument('--repeat', type=int, default=3, help='Measured passes over the corpus.')
+    parser.add_argument('--unique', action='store_true',
+                        help='Make every submission distinct, so every compiled job is a cache miss.')
+    parser.add_argument('--no-warmup', action='store_true', help='Skip the unmeasured first pass.')
+    parser.add_argument('--output', default='', help='Write the JSON report here instead of stdout.')
+
+
+def run_from_options(options: dict) -> str:
+    """Run with parsed add_arguments() options; returns the report as JSON."""
+    split = lambda value: [v.strip().lower() for v in value.split(',') if v.strip()]
+    report = run(
+        languages=split(options['languages']) or None, kinds=split(options['kinds']),
+        concurrency=options['concurrency'], repeat=options['repeat'],
+        unique=options['unique'], warmup=not options['no_warmup'],
+    )
+    text = json.dumps(report, indent=2)
+    if options['output']:
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark arena_api/runner.py.')
+    add_arguments(parser)
+    options = vars(parser.parse_args())
+    text = run_from_options(options)
+    if not options['output']:
+        sys.stdout.write(text + '\n')
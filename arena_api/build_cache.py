@@ -0,0 +1,219 @@
+"""
+arena_api/build_cache.py
+Content-addressed, size-bounded LRU cache of compiled artifacts.
+
+Entries live under CACHE_DIR/<key>/ where key = sha256(language, toolchain
+version, source). An entry is built in a private staging directory and then
+published with an atomic rename, so concurrent builds of the same source (or
+several Daphne workers sharing the directory) never see a half-written entry.
+Recency is tracked through the directory mtime, which is bumped on every hit.
+
+The artifacts are executed, so the cache must only hold what the judge built:
+CACHE_DIR defaults to the judge user's own cache directory rather than the
+shared temp dir, is created with mode 0700, and is refused (Untrusted) unless
+it is a real directory owned by the judge user. An entry that is not owned by
+the judge user, or is writable by anyone else, is discarded and rebuilt.
+"""
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+
+ENABLED   = os.environ.get('JUDGE_BUILD_CACHE', 'True') == 'True'
+CACHE_DIR = (os.environ.get('JUDGE_BUILD_CACHE_DIR')
+             or os.path.join(os.path.expanduser('~'), '.cache', 'bytebit', 'builds'))
+MAX_BYTES = int(os.environ.get('JUDGE_BUILD_CACHE_MAX_MB', 512)) * 1024 * 1024
+# Entries used this recently are never evicted: a running test case may still need them
+PIN_SECONDS = 120
+
+logger = logging.getLogger('arena_api.judge')
+
+_counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'untrusted': 0}
+_lock   = threading.Lock()
+
+
+class Untrusted(OSError):
+    """CACHE_DIR, or an entry in it, may hold files the judge did not build."""
+
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version(*cmd) -> str:
+    """First line of `<tool> --version` (or equivalent); '' if the tool is missing."""
+    try:
+        r = subprocess.run(list(cmd), capture_output=True, text=True, timeout=10)
+    except Exception:
+        return ''
+    out = (r.stdout or r.stderr).strip()
+    return out.splitlines()[0] if out else ''
+
+
+def cache_key(language: str, version: str, source: str) -> str:
+    h = hashlib.sha256()
+    for part in (language, version, source):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _count(name):
+    with _lock:
+        _counts[name] += 1
+
+
+def owned(path: str) -> bool:
+    """Whether `path` is a directory (not a symlink) of the judge user that nobody else can write to."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.geteuid() and not st.st_mode & 0o022
+
+
+def private_dir(path: str) -> str:
+    """
+    `path`, created with mode 0700 if missing and tightened to it otherwise.
+    Raises Untrusted unless it is a real directory owned by the judge user.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError as e:
+        raise Untrusted(f'directory {path} unavailable: {e}') from e
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid():
+        raise Untrusted(f'{path} is not a directory owned by the judge user')
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def _untrusted(message: str) -> Untrusted:
+    _count('untrusted')
+    logger.warning('%s; building outside the cache', message)
+    return Untrusted(message)
+
+
+def _root() -> str:
+    """CACHE_DIR, see private_dir. Raises Untrusted."""
+    try:
+        return private_dir(CACHE_DIR)
+    except Untrusted as e:
+        raise _untrusted(f'build cache: {e}') from e
+
+
+def _discard(entry: str) -> None:
+    """Move an untrusted entry out of the way (CACHE_DIR is ours, even if the entry is not)."""
+    _count('untrusted')
+    logger.warning('build cache entry %s is not owned by the judge user or writable by others; rebuilding it', entry)
+    aside = tempfile.mkdtemp(dir=CACHE_DIR, prefix='.untrusted-')
+    try:
+        os.rename(entry, os.path.join(aside, 'entry'))
+    except OSError as e:
+        raise _untrusted(f'could not discard build cache entry {entry}: {e}') from e
+    finally:
+        shutil.rmtree(aside, ignore_errors=True)
+
+
+def get_or_build(key: str, build_fn) -> str:
+    """
+    Return the directory holding the artifact for `key`, calling
+    build_fn(staging_dir) to produce it on a miss. Exceptions from build_fn
+    propagate and nothing is cached. Raises Untrusted when CACHE_DIR can't
+    be trusted; the caller then builds outside the cache.
+    """
+    root = _root()
+    entry = os.path.join(root, key)
+    if owned(entry):
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        _count('hits')
+        return entry
+    if os.path.lexists(entry):
+        _discard(entry)
+
+    _count('misses')
+    staging = tempfile.mkdtemp(dir=root, prefix='.staging-')
+    try:
+        build_fn(staging)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another request published the same key first; use theirs
+            shutil.rmtree(staging, ignore_errors=True)
+            if not owned(entry):
+                raise _untrusted(f'build cache entry {entry} is not owned by the judge user')
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _evict(keep=entry)
+    return entry
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _entries():
+    """[(mtime, size, path)] for every published entry."""
+    out = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return out
+    for name in names:
+        if name.startswith('.'):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            out.append((os.stat(path).st_mtime, _dir_size(path), path))
+        except OSError:
+            pass
+    return out
+
+
+def _evict(keep=None):
+    """Drop least-recently-used entries (never `keep`) until the cache fits in MAX_BYTES."""
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    pinned_after = time.time() - PIN_SECONDS
+    for mtime, size, path in entries:
+        if total <= MAX_BYTES:
+            break
+        if mtime >= pinned_after:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        _count('evictions')
+
+
+def stats() -> dict:
+    entries = _entries()
+    with _lock:
+        counts = dict(_counts)
+    lookups = counts['hits'] + counts['misses']
+    return {
+        'enabled':   ENABLED,
+        'dir':       CACHE_DIR,
+        'entries':   len(entries),
+        'bytes':     sum(size for _, size, _ in entries),
+        'max_bytes': MAX_BYTES,
+        'hit_rate':  round(counts['hits'] / lookups, 3) if lookups else 0.0,
+        **counts,
+    }
@@ -1,6 +1,8 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from . import tasks
 from .models import CoderProfile, CodingTask, Submission, Tournament
 
 
@@ -47,11 +49,20 @@ class BattleConsumer(AsyncWebsocketConsumer):
     # ── Handlers ──────────────────────────────────────────────────────────────
 
     async def handle_code_submit(self, data):
+        from . import admission, judge_queue
         code     = data.get('code', '')
         task_id  = data.get('task_id')
-        language = data.get('language', 'Python')
+        language = data.get('language') or 'Python'
 
-        passed, output = await self.run_code(code, task_id)
+        try:
+            passed, output = await self.run_code(code, task_id, language)
+        except admission.Rejected as e:
+            await self.send(text_data=json.dumps({
+                'type': 'error', 'message': str(e), 'retry_after': e.retry_after}))
+            return
+        except judge_queue.JudgeUnavailable as e:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': str(e)}))
+            return
 
         username = self.user.username if (self.user and self.user.is_authenticated) else 'Anonymous'
         user_id  = self.user.id       if (self.user and self.user.is_authenticated) else 0
@@ -86,6 +97,43 @@ class BattleConsumer(AsyncWebsocketConsumer):
             }
         )
 
+    async def run_code(self, code, task_id, language):
+        """
+        Judge the code against all of the task's test cases, in `language`,
+        until one fails; returns (passed, output message).
+        """
+        from . import admission, judge_queue, streamcmp
+
+        task = await self.get_task(task_id, language)
+        if task is None:
+            return False, 'Task not found'
+        test_cases = task['test_cases']
+        if not test_cases:
+            return False, 'No test cases defined for this task'
+
+        if self.user and self.user.is_authenticated:
+            lease_id = str(self.user.id)
+        else:
+            lease_id = f'anonymous:{self.channel_name}'
+        # In student processes (or on a queue worker), never in this one. Only
+        # all_passed decides the battle, so the first failing case ends the run
+        async with admission.admit_async(lease_id, task['classroom_id']):
+            result = await judge_queue.judge_async(code, language, test_cases, priority='tournament',
+                                                   mode='fail_fast', **task['limits'])
+        if result['all_passed']:
+            return True, '✅ All test cases passed!'
+
+        failed = next((r for r in result['results'] if not r['passed'] and r.get('stop_reason') != 'skipped'), None)
+        if failed is None:
+            return False, '❌  Some test cases did not pass'
+        if failed.get('is_hidden', False):
+            return False, f'❌  Hidden test case {failed["index"]} failed'
+        if failed.get('stop_reason') in (streamcmp.TIMEOUT, streamcmp.OUTPUT_LIMIT):
+            return False, f'❌  {failed["stderr"]}'
+        if failed['stderr'] and not failed['actual']:
+            return False, f'Runtime Error: {failed["stderr"]}'
+        return False, f"❌  Expected: {failed['expected']!r}\n   Got:      {failed['actual']!r}"
+
     # ── Group message event handlers ──────────────────────────────────────────
 
     async def player_joined(self, event):
@@ -103,33 +151,18 @@ class BattleConsumer(AsyncWebsocketConsumer):
     # ── DB helpers ────────────────────────────────────────────────────────────
 
     @database_sync_to_async
-    def run_code(self, code, task_id):
-        """Execute user code against all visible + hidden test cases."""
-        import sys, io, textwrap
+    def get_task(self, task_id, language):
+        """Runner test cases, judge limits in `language` and classroom of a task; None if there is no such task."""
+        from . import limits
         try:
             task = CodingTask.objects.get(id=task_id)
-        except Exception as e:
-            return False, f'Task not found: {e}'
-
-        for tc in task.test_cases:
-            old_stdout = sys.stdout
-            sys.stdout = buf = io.StringIO()
-            try:
-                cleaned    = textwrap.dedent(code)
-                exec_code  = f"input_data = '{tc.input_data}'\n{cleaned}"
-                exec(exec_code, {})
-                got        = buf.getvalue().strip()
-                expected   = tc.output_data.strip()
-                if got != expected:
-                    sys.stdout = old_stdout
-                    return False, f"❌  Expected: {expected!r}\n   Got:      {got!r}"
-            except Exception as e:
-                sys.stdout = old_stdout
-                return False, f'Runtime Error: {e}'
-            finally:
-                sys.stdout = old_stdout
-
-        return True, '✅ All test cases passed!'
+        except Exception:
+            return None
+        return {
+            'classroom_id': task.classroom_id,
+            'test_cases':   tasks.test_cases(task),
+            'limits':       limits.for_task(task, language),
+        }
 
     @database_sync_to_async
     def save_submission(self, task_id, user_id, username, code, passed, output, language):
@@ -170,6 +203,164 @@ class BattleConsumer(AsyncWebsocketConsumer):
             print(f'Error updating stats: {e}')
 
 
+# ── Run Consumer ──────────────────────────────────────────────────────────────
+
+class RunConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket handler for practice runs, streamed case by case.
+    URL pattern: ws/run/<task_id>/?token=<access_token>
+
+    Events accepted (client → server):
+      { type: "run", code: "...", language: "python" }
+      { type: "cancel" }
+
+    Events sent (server → client):
+      { type: "run_started", total: 3 }                  (cases that will run)
+      { type: "case_result", result: {...} }             (each visible case, as it finishes)
+      { type: "run_complete", all_passed, results, mode, total, passed_count, hidden_count }
+                                                         (the body of POST /api/tasks/<id>/run/)
+      { type: "run_cancelled" }
+      { type: "error", message: "...", retry_after: 2 }  (retry_after when the judge is busy)
+
+    A new "run" replaces one still in progress. "cancel", or closing the
+    socket, stops the run and kills the cases still executing.
+    """
+
+    async def connect(self):
+        self.task_id     = self.scope['url_route']['kwargs']['task_id']
+        self.user        = self.scope.get('user')
+        self.current_run = None
+        await self.accept()
+
+        if not self.user or not self.user.is_authenticated:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Authentication failed. Please refresh or login again.'
+            }))
+            await self.close()
+
+    async def disconnect(self, close_code):
+        await self.stop_run()
+
+    async def receive(self, text_data):
+        try:
+            data     = json.loads(text_data)
+            msg_type = data.get('type')
+
+            if msg_type == 'run':
+                await self.stop_run()
+                # In the background: messages (and the disconnect) are handled one at a time
+                self.current_run = asyncio.ensure_future(self.handle_run(data))
+            elif msg_type == 'cancel':
+                if await self.stop_run():
+                    await self.send(text_data=json.dumps({'type': 'run_cancelled'}))
+        except Exception as e:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': str(e)}))
+
+    async def stop_run(self):
+        """Cancel the run in progress, if any; True if there was one."""
+        run, self.current_run = self.current_run, None
+        if run is None or run.done():
+            return False
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        return True
+
+    # ── Handlers ──────────────────────────────────────────────────────────────
+
+    async def handle_run(self, data):
+        from . import admission, judge_queue, runner, verdicts
+
+        if not self.user or not self.user.is_authenticated:
+            return
+        task = await self.get_task(data.get('language'))
+        if task is None:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Task not found'}))
+            return
+        test_cases = task['test_cases']
+        if not test_cases:
+            await self.send(text_data=json.dumps({
+                'type': 'error', 'message': 'No test cases defined for this task'}))
+            return
+        code     = data.get('code', '')
+        language = task['language']
+
+        # Same selection as POST /run/: the visible cases, or all of them if none are visible
+        visible = sum(1 for tc in test_cases if not tc.get('is_hidden', False))
+        await self.send(text_data=json.dumps({'type': 'run_started', 'total': visible or len(test_cases)}))
+
+        # Results are sent in the order they finish, by one sender so they never interleave
+        outbox = asyncio.Queue()
+        sent   = set()
+
+        def stream(entry):
+            if entry['index'] not in sent:
+                sent.add(entry['index'])
+                if not entry.get('is_hidden', False):
+                    outbox.put_nowait({'type': 'case_result', 'result': entry})
+
+        async def deliver():
+            while True:
+                message = await outbox.get()
+                if message is None:
+                    return
+                await self.send(text_data=json.dumps(message))
+
+        sender = asyncio.ensure_future(deliver())
+        try:
+            async with admission.admit_async(str(self.user.id), task['classroom_id']):
+                if judge_queue.QUEUE:
+                    # A queue worker only hands back the finished run
+                    result = await judge_queue.judge_async(code, language, test_cases, priority=task['priority'],
+                                                           mode='visible', **task['limits'])
+                else:
+                    result = await runner.run_test_cases_async(code, language, test_cases, mode='visible',
+                                                               on_result=stream, **task['limits'])
+        except BaseException as e:
+            sender.cancel()
+            if isinstance(e, admission.Rejected):
+                await self.send(text_data=json.dumps({
+                    'type': 'error', 'message': str(e), 'retry_after': e.retry_after}))
+            elif isinstance(e, judge_queue.JudgeUnavailable):
+                await self.send(text_data=json.dumps({'type': 'error', 'message': str(e)}))
+            else:
+                raise
+            return
+
+        for entry in result['results']:
+            stream(entry)
+        outbox.put_nowait(None)
+        await sender
+
+        # Keep the verdict for /submit/, which then only runs the cases this run skipped
+        await asyncio.to_thread(verdicts.remember, self.task_id, test_cases, language, code, result,
+                                task['limits'])
+        await self.send(text_data=json.dumps({
+            'type': 'run_complete', **verdicts.practice_summary(result, test_cases)}))
+
+    # ── DB helpers ────────────────────────────────────────────────────────────
+
+    @database_sync_to_async
+    def get_task(self, language):
+        """
+        What a run in `language` (default: the task's) needs: the language, the
+        classroom, runner test cases, judge limits and priority; None if there is no such task.
+        """
+        from . import limits
+        try:
+            task = CodingTask.objects.get(id=self.task_id)
+        except Exception:
+            return None
+        language = language or task.tech_stack or 'Python'
+        return {
+            'language':     language,
+            'classroom_id': task.classroom_id,
+            'test_cases':   tasks.test_cases(task),
+            'limits':       limits.for_task(task, language),
+            'priority':     tasks.judge_priority(str(self.user.id), self.task_id, 'practice'),
+        }
+
+
 # ── Tournament Consumer ────────────────────────────────────────────────────────
 
 class TournamentConsumer(AsyncWebsocketConsumer):
@@ -333,75 +524,32 @@ class TournamentConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_match_context(self):
         """Return (question_dict, players_list) for this match."""
-        try:
-            t = Tournament.objects.get(id=self.tournament_id)
-        except Exception:
-            return None, []
-
-        match = next((m for m in t.matches if m.match_id == self.match_id), None)
-        if not match:
+        from . import matchstate
+        state = matchstate.get(self.tournament_id, self.match_id)
+        if not state:
             print(f"Match {self.match_id} not found in tournament {self.tournament_id}")
             return None, []
+        return state['question'], state['players']
 
-        question = None
-        if t.questions and match.question_index < len(t.questions):
-            q = t.questions[match.question_index]
-            question = {
-                'title':       q.title,
-                'description': q.description,
-                'difficulty':  q.difficulty,
-                'testCases': [
-                    {'input': tc.input_data, 'expected_output': tc.output_data}
-                    for tc in q.test_cases
-                ],
-                'techStack':          getattr(t, 'tech_stack', 'General'),
-                'allowCopyPaste':     getattr(t, 'allow_copy_paste', True),
-                'allowTabCompletion': getattr(t, 'allow_tab_completion', True),
-            }
-        else:
-            print(f"Debug: Match {self.match_id} q_idx={match.question_index} out of range (len={len(t.questions)})")
-
-        players = []
-        usernames = dict(t.participant_usernames)
-        for pid in [match.player1_id, match.player2_id]:
-            if pid:
-                players.append({'id': pid, 'username': usernames.get(pid, pid)})
-
-        return question, players
-
-    @database_sync_to_async
-    def run_code_against_match(self, code, language):
+    async def run_code_against_match(self, code, language):
         """Run code against the match question's test cases; return (results, all_passed)."""
-        import subprocess, tempfile, os
-        from .runner import run_test_cases  # Use shared runner
-
-        try:
-            t = Tournament.objects.get(id=self.tournament_id)
-        except Exception:
-            return [], False
+        from . import judge_queue  # Use shared runner
 
-        match = next((m for m in t.matches if m.match_id == self.match_id), None)
-        if not match or not t.questions:
+        question = await self.get_match_test_cases(language)
+        if question is None:
             return [], False
+        test_cases, limits = question
 
-        q = t.questions[match.question_index] if match.question_index < len(t.questions) else None
-        if not q:
-            return [], False
-
-        # Prepare test cases for runner
-        test_cases = [
-            {'input_data': tc.input_data, 'output_data': tc.output_data, 'is_hidden': tc.is_hidden}
-            for tc in q.test_cases
-        ]
-
-        # Use the shared runner
-        runner_result = run_test_cases(code, language, test_cases)
+        # Judged on the event loop (or by a queue worker), so the DB executor stays free.
+        # Only all_passed decides the match, so the first failing case ends the run
+        runner_result = await judge_queue.judge_async(code, language, test_cases, priority='tournament',
+                                                      mode='fail_fast', **limits)
         results = []
 
         # Map runner results back to format expected by frontend
-        for i, r in enumerate(runner_result['results']):
+        for r in runner_result['results']:
             # Get original input (runner doesn't return it)
-            original_input = test_cases[i]['input_data']
+            original_input = test_cases[r['index'] - 1]['input_data']
             
             results.append({
                 'input':    original_input,
@@ -414,28 +562,46 @@ class TournamentConsumer(AsyncWebsocketConsumer):
 
         return results, runner_result['all_passed']
 
+    @database_sync_to_async
+    def get_match_test_cases(self, language):
+        """
+        (test cases in runner form, judge limits in `language`) for this match's
+        question, or None if unavailable.
+        """
+        from . import matchstate
+        state = matchstate.get(self.tournament_id, self.match_id)
+        if not state or state['test_cases'] is None:
+            return None
+        return state['test_cases'], matchstate.judge_limits(state, language)
+
     @database_sync_to_async
     def mark_match_winner(self, user_id):
         """Set the match winner if not already set. Returns (winner_id, winner_username)."""
+        from bson import ObjectId
+        from . import matchstate
+        state = matchstate.get(self.tournament_id, self.match_id)
+        # Verify this player is actually in the match, and that it is still open
+        if not state or state['winner_id'] or user_id not in state['usernames']:
+            return None, ''
+        winner_username = state['usernames'][user_id]
+        # Only the first player to pass gets through: the update matches an undecided match only
         try:
-            t = Tournament.objects.get(id=self.tournament_id)
+            won = Tournament._get_collection().update_one(
+                {'_id': ObjectId(self.tournament_id),
+                 'matches': {'$elemMatch': {'match_id': self.match_id, 'winner_id': {'$in': ['', None]}}}},
+                {'$set': {'matches.$.winner_id': user_id,
+                          'matches.$.winner_username': winner_username,
+                          'matches.$.status': 'done'}},
+            ).modified_count
         except Exception:
             return None, ''
-
-        for m in t.matches:
-            if m.match_id == self.match_id:
-                if m.winner_id:
-                    return None, ''   # already decided
-                # Verify this player is actually in the match
-                if user_id not in (m.player1_id, m.player2_id):
-                    return None, ''
-                m.winner_id = user_id
-                m.winner_username = dict(t.participant_usernames).get(user_id, '')
-                m.status = 'done'
-                t.save()
-                return m.winner_id, m.winner_username
-
-        return None, ''
+        if not won:
+            matchstate.invalidate(self.tournament_id, [self.match_id])   # decided elsewhere
+            return None, ''
+        matchstate.put(self.tournament_id, self.match_id, {
+            **state, 'status': 'done', 'winner_id': user_id, 'winner_username': winner_username,
+        })
+        return user_id, winner_username
 
     @database_sync_to_async
     def update_stats(self, user_id, won: bool):
@@ -462,6 +628,7 @@ class TournamentConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def force_match_winner(self, winner_id):
         """Teacher-forced winner. Returns (winner_id, winner_username)."""
+        from . import matchstate
         try:
             t = Tournament.objects.get(id=self.tournament_id)
         except Exception:
@@ -475,6 +642,7 @@ class TournamentConsumer(AsyncWebsocketConsumer):
                 m.winner_username = dict(t.participant_usernames).get(winner_id, '')
                 m.status = 'done'
                 t.save()
+                matchstate.put(self.tournament_id, self.match_id, matchstate.build(t, self.match_id))
                 return m.winner_id, m.winner_username
 
         return None, ''
@@ -482,6 +650,11 @@ class TournamentConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def check_tournament_completion(self, winner_id):
         """If this was the final match, end the tournament and award prizes based on configured XP."""
+        from . import matchstate
+        # Any match but the last one of its round ends here, without loading the tournament
+        state = matchstate.get(self.tournament_id, self.match_id)
+        if state and (state['round_num'] != state['current_round'] or state['round_matches'] != 1):
+            return
         try:
             t = Tournament.objects.get(id=self.tournament_id)
             current_matches = [m for m in t.matches if m.round_num == t.current_round]
@@ -525,6 +698,7 @@ class TournamentConsumer(AsyncWebsocketConsumer):
                     _award(tid, xp3)
 
                 # 2. Delete the tournament immediately as requested
+                matchstate.invalidate_tournament(t)
                 t.delete()
                     
         except Exception as e:
@@ -0,0 +1,128 @@
+'use strict';
+/*
+ * arena_api/harness.js
+ * JavaScript side of the multi-test harness; see harness.py for the protocol.
+ *
+ * Every case runs in a fresh worker_threads Worker (its own V8 context and
+ * module registry) inside this one node process. process.stdin and
+ * fs.readFileSync(0 | '/dev/stdin') are both answered from the case's input,
+ * so the usual ways of reading input all work. The work directory is emptied
+ * before every case, so a case never sees files an earlier one wrote.
+ */
+const fs = require('fs');
+const path = require('path');
+const { Worker } = require('worker_threads');
+
+const PRELUDE = `
+const { workerData, parentPort } = require('worker_threads');
+const { Readable } = require('stream');
+const fs = require('fs');
+const path = require('path');
+const Module = require('module');
+const input = Buffer.from(workerData.input, 'utf8');
+const readFileSync = fs.readFileSync;
+fs.readFileSync = function (file, options) {
+  if (file === 0 || file === '/dev/stdin') {
+    const encoding = typeof options === 'string' ? options : options && options.encoding;
+    return encoding ? input.toString(encoding) : Buffer.from(input);
+  }
+  return readFileSync.apply(this, arguments);
+};
+// Replace the worker's stdin with the case input; an unread stdin: true
+// stream would keep the worker alive after the program is done
+const stdin = new Readable({ read() {} });
+stdin.push(input);
+stdin.push(null);
+stdin.fd = 0;
+Object.defineProperty(process, 'stdin', { value: stdin, configurable: true });
+// A synchronous print loop never yields to flush, so the limit is enforced here
+let written = 0;
+const write = process.stdout.write;
+process.stdout.write = function (chunk, encoding, callback) {
+  written += Buffer.byteLength(chunk, typeof encoding === 'string' ? encoding : 'utf8');
+  if (written > workerData.limit) {
+    parentPort.postMessage('output_limit');
+    process.exit(1);
+  }
+  return write.apply(this, arguments);
+};
+const main = new Module(workerData.filename, null);
+main.filename = workerData.filename;
+main.paths = Module._nodeModulePaths(path.dirname(workerData.filename));
+process.mainModule = main;
+main._compile(workerData.code, workerData.filename);
+`;
+
+function runCase(code, filename, input, timeout, limit) {
+  return new Promise((resolve) => {
+    const worker = new Worker(PRELUDE, {
+      eval: true,
+      workerData: { code, filename, input, limit },
+      stdout: true,
+      stderr: true,
+    });
+    const out = [];
+    const err = [];
+    let outSize = 0;
+    let errSize = 0;
+    let reason = null;
+    let pending = 3; // exit + both streams ended
+
+    const stop = (why) => {
+      if (!reason) reason = why;
+      worker.terminate();
+    };
+    const started = process.hrtime.bigint();
+    const timer = setTimeout(() => stop('timeout'), timeout * 1000);
+    const done = () => {
+      if (--pending > 0) return;
+      clearTimeout(timer);
+      resolve({
+        stdout: Buffer.concat(out).subarray(0, limit).toString('utf8'),
+        stderr: Buffer.concat(err).toString('utf8'),
+        stop_reason: reason,
+        elapsed_ms: Number(process.hrtime.bigint() - started) / 1e6,
+      });
+    };
+
+    worker.stdout.on('data', (chunk) => {
+      outSize += chunk.length;
+      out.push(chunk);
+      if (outSize > limit) stop('output_limit');
+    });
+    worker.stderr.on('data', (chunk) => {
+      if (errSize < 65536) err.push(chunk);
+      errSize += chunk.length;
+    });
+    worker.stdout.on('end', done);
+    worker.stderr.on('end', done);
+    worker.on('error', (e) => {
+      err.push(Buffer.from(String((e && e.stack) || e) + '\n'));
+    });
+    worker.on('exit', done);
+
+    worker.on('message', (msg) => {
+      if (msg === 'output_limit') stop('output_limit');
+    });
+  });
+}
+
+function clear(dir) {
+  for (const name of fs.readdirSync(dir)) {
+    fs.rmSync(path.join(dir, name), { recursive: true, force: true });
+  }
+}
+
+async function serve() {
+  const job = JSON.parse(fs.readFileSync(0, 'utf8'));
+  const filename = path.join(job.workdir, 'solution.js');
+  for (const input of job.inputs) {
+    clear(job.workdir);
+    const reply = await runCase(job.code, filename, input, Number(job.timeout), Number(job.output_limit));
+    fs.writeSync(1, job.delimiter + JSON.stringify(reply) + '\n');
+  }
+  clear(job.workdir);
+  process.exit(0);
+}
+
+serve();
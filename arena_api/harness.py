@@ -0,0 +1,239 @@
+"""
+arena_api/harness.py
+Single-process multi-test harness for Python and JavaScript.
+
+Instead of one interpreter start per test case, one harness process is started
+per submission and runs every case's stdin through the student program in turn:
+  python     — this file, run by path: each case is exec'd in a fresh __main__
+               with fds 0/1/2 pointed at per-case files (so input(), open(0) and
+               os.write(1, ...) all behave as in a normal run)
+  javascript — harness.js: each case runs in a fresh worker_threads Worker
+
+Protocol: the driver writes { "code", "inputs", "timeout", "output_limit",
+"delimiter", "workdir" } as JSON to the harness's stdin and closes it; the
+harness answers with one line per finished case, framed by the delimiter:
+  <delimiter> { "stdout": str, "stderr": str, "stop_reason": null | "timeout" | "output_limit",
+                "elapsed_ms": float }
+
+Only the current case's files are on disk while it runs: its input is written
+just before it starts, and the work directory is emptied after every case, so
+a case can't read (or print in its diagnostics) another case's input, output
+or anything an earlier case left behind. Module-level state outside __main__
+(sys.modules, imported modules' globals) does carry over between cases, which
+is why the mode is opt-in (JUDGE_HARNESS).
+"""
+import json
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Extra time allowed per case before the driver gives up on the harness
+GRACE = 1.0
+
+COMMANDS = {
+    'python':     lambda: [sys.executable, '-I', os.path.join(HERE, 'harness.py')],
+    'javascript': lambda: ['node', os.path.join(HERE, 'harness.js')],
+}
+
+
+# ── Harness side (runs as a standalone script) ────────────────────────────────
+
+class _CaseTimeout(BaseException):
+    """Raised by SIGALRM in the middle of a case that ran out of time."""
+
+
+def _on_alarm(signum, frame):
+    raise _CaseTimeout()
+
+
+def _exec_case(code, timeout):
+    """Run `code` once against the current fds 0/1/2; returns True on timeout."""
+    import io, traceback, types
+
+    sys.stdin  = io.TextIOWrapper(io.BufferedReader(io.FileIO(0, 'r', closefd=False)), encoding='utf-8')
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(io.FileIO(1, 'w', closefd=False)), encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(io.BufferedWriter(io.FileIO(2, 'w', closefd=False)), encoding='utf-8')
+    sys.argv   = ['solution.py']
+
+    main = types.ModuleType('__main__')
+    main.__file__ = 'solution.py'
+    sys.modules['__main__'] = main
+
+    timed_out = False
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        exec(compile(code, 'solution.py', 'exec'), main.__dict__)
+    except _CaseTimeout:
+        timed_out = True
+    except SystemExit as e:
+        if e.code is not None and not isinstance(e.code, int):
+            print(e.code, file=sys.stderr)
+    except BaseException as e:
+        # Drop the harness's own frame so the traceback looks like a normal run
+        tb = e.__traceback__.tb_next if e.__traceback__ else None
+        traceback.print_exception(type(e), e, tb)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        for stream in (sys.stdout, sys.stderr):
+            try: stream.flush()
+            except BaseException: pass   # EFBIG past the output limit, or a late alarm
+    return timed_out
+
+
+def _clear(workdir):
+    """Remove everything in `workdir`, e.g. files the last case created."""
+    import shutil
+    for name in os.listdir(workdir):
+        path = os.path.join(workdir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try: os.unlink(path)
+            except OSError: pass
+
+
+def _serve():
+    import resource
+
+    job = json.loads(sys.stdin.buffer.read())
+    code, inputs = job['code'], job['inputs']
+    timeout = float(job.get('timeout', 5))
+    limit   = int(job['output_limit'])
+    delim   = job['delimiter'].encode('ascii')
+
+    proto_out = os.fdopen(os.dup(1), 'wb')
+    workdir = job['workdir']
+    in_path, out_path, err_path = (os.path.join(workdir, name) for name in ('in', 'out', 'err'))
+
+    # Cap the per-case output files; writes past it fail with EFBIG instead of
+    # filling the disk. Lifted only while the harness writes a case's input
+    capped = (limit + 1, resource.RLIM_INFINITY)
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    recursion_limit = sys.getrecursionlimit()
+
+    for data in inputs:
+        os.chdir(workdir)
+        _clear(workdir)
+        resource.setrlimit(resource.RLIMIT_FSIZE, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+        with open(in_path, 'wb') as f:
+            f.write(data.encode('utf-8'))
+        resource.setrlimit(resource.RLIMIT_FSIZE, capped)
+        for fd, path, flags in ((0, in_path, os.O_RDONLY),
+                                (1, out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC),
+                                (2, err_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)):
+            tmp = os.open(path, flags, 0o600)
+            if tmp != fd:   # the program may have closed fd 0-2 in an earlier case
+                os.dup2(tmp, fd)
+                os.close(tmp)
+
+        started = time.perf_counter()
+        timed_out = _exec_case(code, timeout)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        sys.setrecursionlimit(recursion_limit)
+
+        with open(out_path, 'rb') as f:
+            out = f.read(limit + 1)
+        with open(err_path, 'rb') as f:
+            err = f.read(65536)
+        reason = 'timeout' if timed_out else 'output_limit' if len(out) > limit else None
+        reply = {
+            'stdout':      out[:limit].decode('utf-8', 'replace'),
+            'stderr':      err.decode('utf-8', 'replace'),
+            'stop_reason': reason,
+            'elapsed_ms':  elapsed_ms,
+        }
+        proto_out.write(delim + json.dumps(reply).encode('utf-8') + b'\n')
+        proto_out.flush()
+    _clear(workdir)
+
+
+# ── Driver side (imported by runner.py) ───────────────────────────────────────
+
+def run(language: str, code: str, inputs: list, timeout: float, output_limit: int,
+        stop=None) -> list:
+    """
+    Run every input through one harness process. Returns one reply dict per
+    input, in order; None for cases the harness did not finish (it crashed,
+    hung past timeout + GRACE, or the student program killed it), which the
+    caller should re-run in isolation. If stop(index, reply) returns True the
+    harness is killed after that case and the rest are None as well. Raises
+    FileNotFoundError if the interpreter is missing.
+    """
+    delimiter = f'\x1e{uuid.uuid4().hex}\x1e'
+    from . import limits, workspace
+    workdir = workspace.acquire()
+    payload = json.dumps({
+        'code': code, 'inputs': inputs, 'timeout': timeout,
+        'output_limit': output_limit, 'delimiter': delimiter, 'workdir': workdir,
+    }).encode('utf-8')
+
+    try:
+        proc = subprocess.Popen(
+            COMMANDS[language](), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, cwd=workdir, start_new_session=True,
+            # The memory limit covers all cases together; no CPU rlimit for a multi-case process
+            preexec_fn=limits.preexec(cpu=False),
+        )
+    except BaseException:
+        workspace.release(workdir)
+        raise
+    # A selector rather than select.select, which refuses fds >= FD_SETSIZE (1024)
+    sel = selectors.DefaultSelector()
+    sel.register(proc.stdout, selectors.EVENT_READ)
+    replies = []
+    try:
+        try:
+            proc.stdin.write(payload)
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            return [None] * len(inputs)
+
+        fd = proc.stdout.fileno()
+        buf = b''
+        marker = delimiter.encode('ascii')
+        # The first case also pays for the interpreter start
+        deadline = time.monotonic() + timeout + GRACE * 2
+        while len(replies) < len(inputs):
+            line, sep, rest = buf.partition(b'\n')
+            if sep:
+                buf = rest
+                at = line.rfind(marker)
+                if at < 0:
+                    continue   # stray output from the program itself
+                try:
+                    replies.append(json.loads(line[at + len(marker):]))
+                except ValueError:
+                    break
+                if stop is not None and stop(len(replies) - 1, replies[-1]):
+                    break
+                deadline = time.monotonic() + timeout + GRACE
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Hung past the harness's own timer: count it as a timeout
+                replies.append({'stdout': '', 'stderr': '', 'stop_reason': 'timeout'})
+                break
+            if sel.select(remaining):
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                buf += chunk
+    finally:
+        sel.close()
+        try: os.killpg(proc.pid, signal.SIGKILL)
+        except OSError: pass
+        proc.wait()
+        proc.stdout.close()
+        workspace.release(workdir)
+
+    return replies + [None] * (len(inputs) - len(replies))
+
+
+if __name__ == '__main__':
+    _serve()
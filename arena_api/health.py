@@ -5,6 +5,33 @@ from rest_framework.response import Response
 import django
 import os
 
+# Judge internals for the admin judge-metrics view (views.judge_metrics); not
+# public, since they show toolchain versions, paths and load
+_JUDGE_STATS = (
+    ('toolchains', 'toolchains', 'summary'),
+    ('build_cache', 'build_cache', 'stats'),
+    ('admission', 'admission', 'stats'),
+    ('singleflight', 'singleflight', 'stats'),
+    ('precheck', 'precheck', 'stats'),
+    ('daemon', 'judged', 'stats'),
+    ('workspace', 'workspace', 'stats'),
+    ('sql_fixtures', 'sqlfixtures', 'stats'),
+    ('tournament_state', 'matchstate', 'stats'),
+)
+
+
+def judge_status() -> dict:
+    """Each judge component's stats, or {'error': ...} for one that failed."""
+    import importlib
+    judge = {}
+    for key, module, attr in _JUDGE_STATS:
+        try:
+            judge[key] = getattr(importlib.import_module(f'arena_api.{module}'), attr)()
+        except Exception as e:
+            judge[key] = {'error': str(e)}
+    return judge
+
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 @renderer_classes([TemplateHTMLRenderer, JSONRenderer])
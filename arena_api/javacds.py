@@ -0,0 +1,139 @@
+"""
+arena_api/javacds.py
+AppCDS archive for Java submissions.
+
+JVM startup dominates a `java -cp <build> Main` run. Most of it is loading and
+verifying the same JDK classes every time, so those are dumped once into a
+class-data sharing archive, recorded from jvm/Warmup.java (a representative
+student-style program), and every Java run maps it instead.
+
+Compiling Warmup and dumping the archive takes up to a few minutes, so it
+happens on a background thread: start() is called when the judge daemon or a
+judge worker starts, and on the first Java job otherwise. Until it is ready,
+or if it fails, Java runs without the archive.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+SOURCE_DIR  = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jvm')
+HOME_DIR    = os.environ.get('JUDGE_JVM_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'bytebit', 'jvm')
+ENABLED     = os.environ.get('JUDGE_JVM_CDS', 'True') == 'True'
+SETUP_RETRY = 300   # seconds before a failed setup is tried again
+
+logger = logging.getLogger('arena_api.judge')
+
+# Classes kept in the archive: the JDK's own, never Warmup's or a submission's
+_JDK_PREFIXES = ('java/', 'javax/', 'jdk/', 'sun/', 'com/sun/')
+
+_setup_lock = threading.Lock()
+_archive = None        # path once ready
+_setup_thread = None
+_setup_failed_at = None
+
+
+# ── One-time setup ────────────────────────────────────────────────────────────
+
+def _toolchain_dir() -> str:
+    from .build_cache import toolchain_version
+    digest = hashlib.sha256(toolchain_version('javac', '-version').encode('utf-8'))
+    with open(os.path.join(SOURCE_DIR, 'Warmup.java'), 'rb') as f:
+        digest.update(f.read())
+    return os.path.join(HOME_DIR, digest.hexdigest()[:16])
+
+
+def _dump_archive(classes_dir: str, archive: str) -> None:
+    """Record the classes Warmup loads and dump the JDK ones into `archive`."""
+    work = tempfile.mkdtemp(dir=os.path.dirname(archive))
+    try:
+        loaded = os.path.join(work, 'loaded.lst')
+        subprocess.run(
+            ['java', '-Xshare:off', f'-XX:DumpLoadedClassList={loaded}', '-cp', classes_dir, 'Warmup'],
+            input=b'3\n1 2 3\nhello world\n', capture_output=True, timeout=60, check=True,
+        )
+        # Only JDK classes: the archive then stays valid for any -cp at run time
+        classlist = os.path.join(work, 'jdk.lst')
+        with open(loaded, encoding='utf-8') as src, open(classlist, 'w', encoding='utf-8') as dst:
+            for line in src:
+                if line.startswith(_JDK_PREFIXES):
+                    dst.write(line)
+        staged = os.path.join(work, 'jdk.jsa')
+        subprocess.run(
+            ['java', '-Xshare:dump', f'-XX:SharedClassListFile={classlist}', f'-XX:SharedArchiveFile={staged}'],
+            capture_output=True, timeout=180, check=True,
+        )
+        os.replace(staged, archive)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _build() -> str:
+    """
+    Compile Warmup and dump the archive, once per javac version; returns its
+    path. The archive is mapped into every Java run, so HOME_DIR must be the
+    judge user's own (see build_cache.private_dir). Raises FileNotFoundError
+    without a JDK, OSError or subprocess errors otherwise.
+    """
+    from .build_cache import owned, private_dir
+    private_dir(HOME_DIR)
+    classes_dir = _toolchain_dir()
+    if os.path.lexists(classes_dir) and not owned(classes_dir):
+        raise OSError(f'{classes_dir} is not owned by the judge user')
+    if not os.path.exists(os.path.join(classes_dir, 'Warmup.class')):
+        staging = tempfile.mkdtemp(dir=HOME_DIR)
+        try:
+            subprocess.run(['javac', '-d', staging, os.path.join(SOURCE_DIR, 'Warmup.java')],
+                           capture_output=True, timeout=60, check=True)
+            try:
+                os.rename(staging, classes_dir)
+            except OSError:
+                pass   # another process published it first
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    archive = os.path.join(classes_dir, 'jdk.jsa')
+    if not os.path.exists(archive):
+        _dump_archive(classes_dir, archive)
+    return archive
+
+
+def _prepare():
+    global _archive, _setup_thread, _setup_failed_at
+    try:
+        archive = _build()
+    except Exception as e:
+        logger.warning('Java CDS archive setup failed; Java runs without it: %s', e)
+        with _setup_lock:
+            _setup_failed_at = time.monotonic()
+            _setup_thread = None
+        return
+    with _setup_lock:
+        _archive = archive
+        _setup_thread = None
+
+
+def start() -> None:
+    """Begin setup on a background thread, unless it is off, done, running or recently failed."""
+    global _setup_thread
+    with _setup_lock:
+        if not ENABLED or _archive is not None or _setup_thread is not None:
+            return
+        if _setup_failed_at is not None and time.monotonic() - _setup_failed_at < SETUP_RETRY:
+            return
+        _setup_thread = threading.Thread(target=_prepare, name='jvm-cds-setup', daemon=True)
+        _setup_thread.start()
+
+
+def java_flags() -> list:
+    """Extra `java` options: the shared archive once it is ready (setup starts if needed)."""
+    if _archive is None:
+        start()
+        return []
+    # -Xshare:auto silently falls back if the archive doesn't fit this JVM;
+    # JVM warnings go to stderr so they can never end up in the program's stdout
+    return ['-Xshare:auto', f'-XX:SharedArchiveFile={_archive}', '-Xlog:disable', '-Xlog:all=warning:stderr']
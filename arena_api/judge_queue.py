@@ -0,0 +1,272 @@
+"""
+arena_api/judge_queue.py
+Prioritised judge job queue.
+
+With JUDGE_QUEUE set, the web tier stops executing code itself: judge() puts a
+job on the queue and waits for a worker (`python manage.py judge_worker`) to
+run it through arena_api/runner.py and publish the result back. Without it,
+judge() simply calls the runner in-process.
+
+Jobs are served strictly by priority class, so exam traffic is never stuck
+behind a queue of practice runs:
+    exam > tournament > submit > practice > regrade
+(regrade: background re-judging after a task's test cases change, regrade.py)
+
+Backends:
+  redis  — one list per class on REDIS_URL; workers BRPOP them in priority order
+  sqlite — a jobs table in JUDGE_QUEUE_SQLITE (a file shared with the workers,
+           or "file::memory:?cache=shared" for an in-process stand-in)
+"""
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+PRIORITIES = ('exam', 'tournament', 'submit', 'practice', 'regrade')   # highest first
+
+QUEUE       = os.environ.get('JUDGE_QUEUE', '').strip().lower()   # '' | 'redis' | 'sqlite'
+REDIS_URL   = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1')
+SQLITE_PATH = os.environ.get('JUDGE_QUEUE_SQLITE') or os.path.join(tempfile.gettempdir(), 'bytebit-judge-queue.sqlite3')
+# How long the web tier waits for a worker before giving up on a job
+WAIT_SECONDS = float(os.environ.get('JUDGE_QUEUE_WAIT', 120))
+RESULT_TTL   = 300
+
+
+class JudgeUnavailable(Exception):
+    """No worker produced a result in time; the caller should report a 503."""
+
+
+# ── Backends ──────────────────────────────────────────────────────────────────
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis as redis_lib
+        self.r = redis_lib.from_url(url)
+
+    @staticmethod
+    def _queue_key(priority):
+        return f'judge:queue:{priority}'
+
+    def push(self, job):
+        self.r.lpush(self._queue_key(job['priority']), json.dumps(job))
+
+    def pop(self, timeout):
+        # BRPOP serves the first non-empty key, so listing them highest-first is the scheduler
+        item = self.r.brpop([self._queue_key(p) for p in PRIORITIES], timeout=max(1, math.ceil(timeout)))
+        return json.loads(item[1]) if item else None
+
+    def publish(self, job_id, result):
+        key = f'judge:result:{job_id}'
+        pipe = self.r.pipeline()
+        pipe.lpush(key, json.dumps(result))
+        pipe.expire(key, RESULT_TTL)
+        pipe.execute()
+
+    def wait_result(self, job_id, timeout):
+        item = self.r.brpop(f'judge:result:{job_id}', timeout=max(1, math.ceil(timeout)))
+        return json.loads(item[1]) if item else None
+
+    def depth(self):
+        return {p: self.r.llen(self._queue_key(p)) for p in PRIORITIES}
+
+
+class SQLiteBackend:
+    POLL = 0.05
+
+    def __init__(self, path):
+        self.path   = path
+        self._local = threading.local()
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS judge_jobs ('
+            ' id TEXT PRIMARY KEY, priority INTEGER, payload TEXT,'
+            ' state TEXT, enqueued_at REAL, result TEXT)'
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   uri=self.path.startswith('file:'))
+            self._local.conn = conn
+        return conn
+
+    def push(self, job):
+        self._conn().execute(
+            "INSERT INTO judge_jobs (id, priority, payload, state, enqueued_at) VALUES (?, ?, ?, 'queued', ?)",
+            (job['id'], PRIORITIES.index(job['priority']), json.dumps(job), job['enqueued_at']),
+        )
+
+    def pop(self, timeout):
+        conn = self._conn()
+        deadline = time.monotonic() + timeout
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT id, payload FROM judge_jobs WHERE state = 'queued'"
+                    " ORDER BY priority, enqueued_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE judge_jobs SET state = 'running' WHERE id = ?", (row[0],))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if row:
+                return json.loads(row[1])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL)
+
+    def publish(self, job_id, result):
+        conn = self._conn()
+        conn.execute(
+            "UPDATE judge_jobs SET state = 'done', result = ? WHERE id = ?",
+            (json.dumps(result), job_id),
+        )
+        # Results nobody collected (the waiter gave up) are dropped after RESULT_TTL
+        conn.execute(
+            "DELETE FROM judge_jobs WHERE state = 'done' AND enqueued_at < ?",
+            (time.time() - RESULT_TTL,),
+        )
+
+    def wait_result(self, job_id, timeout):
+        conn = self._conn()
+        deadline = time.monotonic() + timeout
+        while True:
+            row = conn.execute(
+                "SELECT result FROM judge_jobs WHERE id = ? AND state = 'done'", (job_id,)
+            ).fetchone()
+            if row:
+                conn.execute('DELETE FROM judge_jobs WHERE id = ?', (job_id,))
+                return json.loads(row[0])
+            if time.monotonic() >= deadline:
+                conn.execute("DELETE FROM judge_jobs WHERE id = ? AND state = 'queued'", (job_id,))
+                return None
+            time.sleep(self.POLL)
+
+    def depth(self):
+        rows = self._conn().execute(
+            "SELECT priority, COUNT(*) FROM judge_jobs WHERE state = 'queued' GROUP BY priority"
+        ).fetchall()
+        counts = dict(rows)
+        return {p: counts.get(i, 0) for i, p in enumerate(PRIORITIES)}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, or None when judging runs in-process."""
+    global _backend
+    if not QUEUE:
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if QUEUE == 'redis':
+                    _backend = RedisBackend(REDIS_URL)
+                elif QUEUE == 'sqlite':
+                    _backend = SQLiteBackend(SQLITE_PATH)
+                else:
+                    raise ValueError(f'Unknown JUDGE_QUEUE backend: {QUEUE!r}')
+    return _backend
+
+
+# ── Web-tier API ──────────────────────────────────────────────────────────────
+
+def error_result(test_cases: list, message: str, mode: str = 'full') -> dict:
+    """
+    Result for a run the judge itself failed: every case `mode` selects fails
+    with `message`. Flagged 'judge_error', so it is shown but never stored as
+    a verdict.
+    """
+    selected = list(enumerate(test_cases))
+    if mode == 'visible':   # as runner._plan picks them
+        visible = [(i, tc) for i, tc in selected if not tc.get('is_hidden', False)]
+        if visible:
+            selected = visible
+        else:
+            mode = 'full'
+    return {
+        'all_passed': False,
+        'results': [
+            {'index': i + 1, 'is_hidden': tc.get('is_hidden', False), 'passed': False,
+             'actual': '', 'expected': tc.get('output_data', ''), 'stderr': message}
+            for i, tc in selected
+        ],
+        'mode': mode,
+        'judge_error': True,
+    }
+
+
+def judge(code: str, language: str, test_cases: list, priority: str = 'practice', **options) -> dict:
+    """
+    Judge code and return the runner's result dict. Queued when a backend is
+    configured (raises JudgeUnavailable if no worker answers in time),
+    in-process otherwise. `options` are passed through to run_test_cases.
+    """
+    backend = get_backend()
+    if backend is None:
+        from .runner import run_test_cases
+        return run_test_cases(code, language, test_cases, **options)
+
+    if priority not in PRIORITIES:
+        raise ValueError(f'Unknown judge priority: {priority!r}')
+    now = time.time()
+    job = {
+        'id':          uuid.uuid4().hex,
+        'priority':    priority,
+        'code':        code,
+        'language':    language,
+        'test_cases':  test_cases,
+        'options':     options,
+        'enqueued_at': now,
+        'deadline':    now + WAIT_SECONDS,
+    }
+    backend.push(job)
+    result = backend.wait_result(job['id'], WAIT_SECONDS)
+    if result is None or result.get('expired'):
+        raise JudgeUnavailable('The judge is busy right now. Please try again in a moment.')
+    return result
+
+
+async def judge_async(code: str, language: str, test_cases: list, priority: str = 'practice', **options) -> dict:
+    """judge() for the WebSocket consumers; never blocks the event loop."""
+    import asyncio
+    if get_backend() is None:
+        from .runner import run_test_cases_async
+        return await run_test_cases_async(code, language, test_cases, **options)
+    return await asyncio.to_thread(judge, code, language, test_cases, priority, **options)
+
+
+# ── Worker side ───────────────────────────────────────────────────────────────
+
+def work(backend, stop_event, log=print):
+    """Pop and run jobs until stop_event is set. Run one of these per worker thread."""
+    from .runner import run_test_cases
+    while not stop_event.is_set():
+        try:
+            job = backend.pop(timeout=2)
+        except Exception as e:
+            log(f'judge worker: queue error: {e}')
+            time.sleep(1)
+            continue
+        if job is None:
+            continue
+        if time.time() > job.get('deadline', float('inf')):
+            # Nobody is waiting for this result any more; publishing it lets the backend drop the job
+            backend.publish(job['id'], {'expired': True})
+            continue
+        options = job.get('options', {})
+        try:
+            result = run_test_cases(job['code'], job['language'], job['test_cases'], **options)
+        except Exception as e:
+            log(f'judge worker: job {job["id"]} failed: {e}')
+            result = error_result(job['test_cases'], f'Judge error: {e}', options.get('mode', 'full'))
+        backend.publish(job['id'], result)
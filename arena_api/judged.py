@@ -0,0 +1,373 @@
+"""
+arena_api/judged.py
+Judge daemon: student code runs from a small process of its own.
+
+Every process the runner starts is forked from the process that calls it.
+From Daphne that copies a large Django/Twisted address space, page tables
+and all, for each compiler, test case and warm pool. The daemon imports the
+runner and its helpers but never Django, so it stays a lean parent for all
+of them (measure with `ps -o rss`: ~20 MB against a few hundred).
+
+    python -m arena_api.judged            (deploy/bytebit-judged.service)
+    python manage.py judge_daemon         (execs the above)
+
+It listens on the Unix socket JUDGE_DAEMON_SOCKET. With the same variable set
+on the web tier, runner.run_test_cases and run_test_cases_async hand every
+call to the daemon, so JUDGE_MAX_WORKERS caps the processes of all web
+workers together. Without it, or while the daemon cannot be reached, they run
+the code in-process as before; after a failed connect the daemon is skipped
+for RETRY seconds. A run the daemon took but failed (an error reply, a lost
+connection, no reply within TIMEOUT) is not run again here: the caller gets a
+judge-error result instead (judge_queue.error_result).
+
+Protocol: one JSON object per line each way; a connection carries any number
+of requests, one at a time.
+    {"op": "run", "args": {run_test_cases arguments}, "stream": bool}
+        → {"case": entry} per finished case when streaming, then
+          {"result": summary} or {"error": message}
+    {"op": "ping"}            → {"result": {"pid": int, "languages": [...]}}
+    {"op": "metrics"}         → {"result": metrics.snapshot()}
+    {"op": "reset_metrics"}   → the same, after metrics.reset()
+Streamed runs go through run_test_cases_async, and the client closing the
+connection cancels one (killing its processes). Other runs go through
+run_test_cases on a daemon thread. Synchronous clients keep up to POOL_SIZE
+idle connections; async ones connect per call, since hanging up is how they
+cancel.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+SOCKET          = os.environ.get('JUDGE_DAEMON_SOCKET', '')   # '' = run in-process
+POOL_SIZE       = int(os.environ.get('JUDGE_DAEMON_POOL', 8))
+THREADS         = int(os.environ.get('JUDGE_DAEMON_THREADS', 64))   # synchronous runs at once
+TIMEOUT         = float(os.environ.get('JUDGE_DAEMON_TIMEOUT', 600))  # longest wait for a reply
+CONNECT_TIMEOUT = 1
+RETRY           = 10
+MAX_MESSAGE     = 64 * 1024 * 1024
+
+logger = logging.getLogger('arena_api.judge')
+
+_serving = False   # True inside the daemon, which must not call itself
+_down_until = 0.0
+_idle = []
+_idle_lock = threading.Lock()
+_counts = {'remote': 0, 'fallbacks': 0, 'reconnects': 0, 'failures': 0}
+
+
+class DaemonUnavailable(Exception):
+    """The daemon could not be reached; run the code in-process."""
+
+
+class DaemonFailed(Exception):
+    """The daemon took the request but gave no result; don't run it again."""
+
+
+def _count(name):
+    with _idle_lock:
+        _counts[name] += 1
+
+
+def _unavailable(e):
+    global _down_until
+    _down_until = time.monotonic() + RETRY
+    logger.warning('judge daemon unavailable: %s', e)
+    return DaemonUnavailable(str(e))
+
+
+def _failed(e):
+    logger.warning('judge daemon failed a request: %s', e)
+    return DaemonFailed(str(e) or type(e).__name__)
+
+
+def _encode(message) -> bytes:
+    return json.dumps(message).encode('utf-8') + b'\n'
+
+
+def enabled() -> bool:
+    """Whether runner calls should go to the daemon right now."""
+    return bool(SOCKET) and not _serving and time.monotonic() >= _down_until
+
+
+# ── Client (synchronous, pooled) ──────────────────────────────────────────────
+
+class _Connection:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(CONNECT_TIMEOUT)
+            self.sock.connect(SOCKET)
+            self.sock.settimeout(TIMEOUT)
+        except OSError:
+            self.sock.close()
+            raise
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, message) -> dict:
+        self.sock.sendall(_encode(message))
+        line = self.rfile.readline(MAX_MESSAGE + 1)
+        if not line.endswith(b'\n'):
+            raise ConnectionError('the daemon closed the connection')
+        return json.loads(line)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def _call(message) -> dict:
+    """Send one request on a pooled connection and return the reply."""
+    for _ in range(2):
+        with _idle_lock:
+            conn = _idle.pop() if _idle else None
+        reused = conn is not None
+        if conn is None:
+            try:
+                conn = _Connection()
+            except OSError as e:
+                raise _unavailable(e)
+        try:
+            reply = conn.request(message)
+        except (OSError, ValueError) as e:
+            conn.close()
+            if reused and not isinstance(e, socket.timeout):
+                _count('reconnects')   # the daemon restarted since this one was pooled
+                continue
+            raise _failed(e)
+        with _idle_lock:
+            if len(_idle) < POOL_SIZE:
+                _idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+        return reply
+    raise _unavailable('no connection')
+
+
+def _result(reply: dict) -> dict:
+    if 'error' in reply:
+        raise _failed(f'daemon error: {reply["error"]}')
+    return reply['result']
+
+
+def run(args: dict) -> dict:
+    """run_test_cases(**args) in the daemon. Raises DaemonUnavailable or DaemonFailed."""
+    try:
+        result = _result(_call({'op': 'run', 'args': args}))
+    except DaemonUnavailable:
+        _count('fallbacks')
+        raise
+    except DaemonFailed:
+        _count('failures')
+        raise
+    _count('remote')
+    return result
+
+
+async def run_async(args: dict, on_result=None) -> dict:
+    """
+    run_test_cases_async(**args) in the daemon, passing each streamed entry to
+    on_result. Cancelling the call cancels the run. Raises DaemonUnavailable
+    or DaemonFailed.
+    """
+    import asyncio
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(SOCKET, limit=MAX_MESSAGE), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError) as e:
+        _count('fallbacks')
+        raise _unavailable(e)
+    try:
+        writer.write(_encode({'op': 'run', 'args': args, 'stream': on_result is not None}))
+        await writer.drain()
+        while True:
+            line = await asyncio.wait_for(reader.readline(), TIMEOUT)
+            if not line.endswith(b'\n'):
+                raise ConnectionError('the daemon closed the connection')
+            reply = json.loads(line)
+            if 'case' not in reply:
+                result = _result(reply)
+                break
+            on_result(reply['case'])
+    except DaemonFailed:
+        _count('failures')
+        raise
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        _count('failures')
+        raise _failed(e)
+    finally:
+        writer.close()
+    _count('remote')
+    return result
+
+
+def metrics(reset: bool = False):
+    """The daemon's metrics snapshot, or None when it cannot be reached."""
+    try:
+        return _result(_call({'op': 'reset_metrics' if reset else 'metrics'}))
+    except (DaemonUnavailable, DaemonFailed):
+        return None
+
+
+def stats() -> dict:
+    data = {'socket': SOCKET or None, 'serving': _serving}
+    if SOCKET and not _serving:
+        try:
+            data['daemon'] = _result(_call({'op': 'ping'}))
+        except (DaemonUnavailable, DaemonFailed) as e:
+            data['daemon'] = {'error': str(e)}
+    with _idle_lock:
+        data.update(pooled=len(_idle), **_counts)
+    return data
+
+
+# ── Daemon ────────────────────────────────────────────────────────────────────
+
+async def _run(message, reader, writer, executor) -> dict:
+    import asyncio
+    import functools
+    from . import runner
+    args = message.get('args') or {}
+    if not message.get('stream'):
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(runner.run_test_cases, **args))
+
+    def on_result(entry):
+        writer.write(_encode({'case': entry}))
+
+    task = asyncio.ensure_future(runner.run_test_cases_async(**args, on_result=on_result))
+    # The client sends nothing until the reply, so any read returning is a hang-up
+    hangup = asyncio.ensure_future(reader.read(1))
+    try:
+        await asyncio.wait({task, hangup}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hangup.cancel()
+        if not task.done():
+            task.cancel()   # kills the processes of the cases still running
+        await asyncio.gather(task, hangup, return_exceptions=True)
+    if task.cancelled():
+        raise ConnectionError('client went away')
+    return task.result()
+
+
+async def _handle(reader, writer, executor):
+    import asyncio
+    from . import metrics as judge_metrics, toolchains
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            op = message.get('op')
+            try:
+                if op == 'run':
+                    result = await _run(message, reader, writer, executor)
+                elif op == 'ping':
+                    result = {'pid': os.getpid(), 'languages': sorted(
+                        lang for lang, spec in toolchains.languages().items() if spec['available'])}
+                elif op in ('metrics', 'reset_metrics'):
+                    if op == 'reset_metrics':
+                        judge_metrics.reset()
+                    result = judge_metrics.snapshot()
+                else:
+                    raise ValueError(f'unknown op {op!r}')
+                reply = {'result': result}
+            except ConnectionError:
+                raise
+            except Exception as e:
+                logger.exception('judge daemon: %s request failed', op)
+                reply = {'error': f'{type(e).__name__}: {e}'}
+            writer.write(_encode(reply))
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        pass   # hung up, or sent something that is not a request line
+    except asyncio.CancelledError:
+        pass   # the daemon is stopping; a streamed run was cancelled with it
+    finally:
+        writer.close()
+
+
+def _claim(path: str) -> None:
+    """Remove a stale socket file; refuse to start if a daemon answers on it."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise SystemExit(f'A judge daemon is already listening on {path}')
+
+
+async def _serve(path: str) -> None:
+    import asyncio
+    import signal
+    from concurrent.futures import ThreadPoolExecutor
+    from . import toolchains
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    # Probe the toolchains now rather than on the first job
+    ready = sorted(lang for lang, spec in toolchains.languages().items() if spec['available'])
+    if 'java' in ready:
+        from . import javacds
+        javacds.start()   # the CDS archive, in the background
+    executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='judged')
+    _claim(path)
+    server = await asyncio.start_unix_server(
+        lambda r, w: _handle(r, w, executor), path, limit=MAX_MESSAGE)
+    os.chmod(path, 0o660)
+    logger.info('Judge daemon %d listening on %s; languages available: %s',
+                os.getpid(), path, ', '.join(ready))
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    logger.info('Judge daemon stopped.')
+
+
+def serve(path: str = None) -> None:
+    """Run the daemon on `path` (default JUDGE_DAEMON_SOCKET) until SIGTERM."""
+    import asyncio
+    global _serving
+    path = path or SOCKET
+    if not path:
+        raise SystemExit('JUDGE_DAEMON_SOCKET is not set and no --socket was given.')
+    _serving = True
+    asyncio.run(_serve(path))
+
+
+def main(argv=None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description='ByteBit judge daemon')
+    parser.add_argument('--socket', default=SOCKET, help='Unix socket path (default: JUDGE_DAEMON_SOCKET).')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    serve(args.socket)
+
+
+if __name__ == '__main__':
+    try:
+        # The project .env, as backend/settings.py loads it, before any setting is read
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'),
+                    override=True)
+    except ImportError:
+        pass
+    # Run through the package module, so the runner sees this process as the daemon
+    from arena_api import judged
+    judged.main()
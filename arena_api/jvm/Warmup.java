@@ -0,0 +1,54 @@
+/*
+ * arena_api/jvm/Warmup.java
+ * Representative student-style program. javacds.py runs it once with
+ * -XX:DumpLoadedClassList to decide which JDK classes go into the AppCDS
+ * archive shared by every Java run.
+ */
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintWriter;
+import java.util.ArrayDeque;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Collections;
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.List;
+import java.util.Map;
+import java.util.PriorityQueue;
+import java.util.Scanner;
+import java.util.StringTokenizer;
+import java.util.TreeMap;
+import java.util.stream.Collectors;
+
+public class Warmup {
+    public static void main(String[] args) throws Exception {
+        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in));
+        StringBuilder text = new StringBuilder();
+        String line;
+        while ((line = reader.readLine()) != null) text.append(line).append('\n');
+
+        Scanner scanner = new Scanner(text.toString());
+        List<Integer> numbers = new ArrayList<>();
+        while (scanner.hasNextInt()) numbers.add(scanner.nextInt());
+        StringTokenizer tokens = new StringTokenizer(text.toString());
+        Map<String, Integer> counts = new HashMap<>();
+        while (tokens.hasMoreTokens()) counts.merge(tokens.nextToken(), 1, Integer::sum);
+
+        int[] sorted = numbers.stream().mapToInt(Integer::intValue).sorted().toArray();
+        Collections.sort(numbers);
+        PriorityQueue<Long> heap = new PriorityQueue<>();
+        ArrayDeque<Integer> deque = new ArrayDeque<>(numbers);
+        for (int n : sorted) heap.add((long) n * n);
+        TreeMap<String, Integer> ordered = new TreeMap<>(counts);
+        HashSet<Integer> seen = new HashSet<>(deque);
+
+        PrintWriter out = new PrintWriter(System.out);
+        out.println(Arrays.toString(sorted) + " " + heap.peek() + " " + seen.size());
+        out.println(ordered.keySet().stream().collect(Collectors.joining(",")));
+        out.printf("%.3f %d %s%n", Math.sqrt(numbers.size()), Long.MAX_VALUE, String.join("-", "a", "b"));
+        out.println(String.format("%5s|%-5s|", "x", "y") + Integer.parseInt("42") + Double.parseDouble("1.5"));
+        out.flush();
+        System.out.println(text.toString().trim().toUpperCase());
+    }
+}
@@ -0,0 +1,101 @@
+"""
+arena_api/limits.py
+Time and memory limits for judged code.
+
+Every run has a time limit (wall clock per test case, TIME_LIMIT unless the
+task sets its own) and, when configured, a memory limit. Tasks and tournament
+questions set them with time_limit_ms / memory_limit_mb, and may override
+either per language (keys as runner languages, e.g. "cpp") in language_limits:
+    {"python": {"time_limit_ms": 4000}, "java": {"memory_limit_mb": 512}}
+0 (or absent) means the judge default. Teacher-set values are clamped to
+MAX_TIME_LIMIT and MAX_MEMORY_MB.
+
+The memory limit is RLIMIT_DATA on the student process (for Java the heap
+size, -Xmx): allocations past it fail, which the program reports the way its
+language does (MemoryError, std::bad_alloc, ...). Alongside it, a CPU-time
+rlimit one second past the time limit backs up the wall-clock deadline. SQL
+runs in-process: its queries are interrupted at the time limit instead.
+
+The limits of the current run travel in a ContextVar, set by
+runner.run_test_cases, so every spawn site reads them with current().
+"""
+import contextlib
+import contextvars
+import math
+import os
+from collections import namedtuple
+
+TIME_LIMIT     = float(os.environ.get('JUDGE_TIME_LIMIT', 5))           # seconds per test case
+MEMORY_LIMIT   = int(os.environ.get('JUDGE_MEMORY_LIMIT_MB', 0))        # 0 = no cap
+MAX_TIME_LIMIT = float(os.environ.get('JUDGE_MAX_TIME_LIMIT', 20))
+MAX_MEMORY_MB  = int(os.environ.get('JUDGE_MAX_MEMORY_MB', 2048))
+
+Limits = namedtuple('Limits', ['time_s', 'memory_mb'])
+DEFAULT = Limits(TIME_LIMIT, MEMORY_LIMIT)
+
+_current = contextvars.ContextVar('judge_limits', default=DEFAULT)
+
+
+def current() -> Limits:
+    return _current.get()
+
+
+def resolve(time_limit=None, memory_limit_mb=None) -> Limits:
+    """Limits for a run: the given values, clamped, falling back to the defaults."""
+    time_s = min(float(time_limit), MAX_TIME_LIMIT) if time_limit else TIME_LIMIT
+    memory = min(int(memory_limit_mb), MAX_MEMORY_MB) if memory_limit_mb else MEMORY_LIMIT
+    return Limits(time_s, memory)
+
+
+@contextlib.contextmanager
+def applied(limits: Limits):
+    token = _current.set(limits)
+    try:
+        yield limits
+    finally:
+        _current.reset(token)
+
+
+def for_task(task, language: str) -> dict:
+    """
+    run_test_cases options for a CodingTask or TournamentQuestion in `language`:
+    {'time_limit': seconds, 'memory_limit_mb': MB}, only the ones that are set.
+    """
+    from .runner import _lang_key
+    overrides = {_lang_key(k): v for k, v in (getattr(task, 'language_limits', None) or {}).items()}
+    override = overrides.get(_lang_key(language)) or {}
+    time_ms   = override.get('time_limit_ms') or getattr(task, 'time_limit_ms', 0)
+    memory_mb = override.get('memory_limit_mb') or getattr(task, 'memory_limit_mb', 0)
+    options = {}
+    if time_ms:
+        options['time_limit'] = time_ms / 1000
+    if memory_mb:
+        options['memory_limit_mb'] = memory_mb
+    return options
+
+
+def set_rlimits(limits: Limits, cpu: bool = True) -> None:
+    """Apply `limits` to the calling process; call it in the child, before the student code runs."""
+    import resource
+    if limits.memory_mb:
+        size = limits.memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (size, size))
+    if cpu:
+        seconds = math.ceil(limits.time_s) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+
+
+def preexec(memory: bool = True, cpu: bool = True):
+    """
+    preexec_fn for a student process under the current limits (the memory
+    limit unless `memory` is False, the CPU backstop unless `cpu` is False),
+    or None when there is nothing to set or no way to set it (not POSIX).
+    """
+    if os.name != 'posix':
+        return None
+    limits = current()
+    if not memory:
+        limits = limits._replace(memory_mb=0)
+    if not limits.memory_mb and not cpu:
+        return None
+    return lambda: set_rlimits(limits, cpu)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from arena_api import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark arena_api/runner.py on a fixed corpus and print a JSON report (see arena_api/benchmark.py).'
+
+    def add_arguments(self, parser):
+        benchmark.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        text = benchmark.run_from_options(options)
+        if options['output']:
+            self.stdout.write(f'Report written to {options["output"]}')
+        else:
+            self.stdout.write(text)
@@ -0,0 +1,27 @@
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from arena_api import judged
+
+
+class Command(BaseCommand):
+    help = 'Run the judge daemon (arena_api/judged.py) on JUDGE_DAEMON_SOCKET, without Django loaded.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket', default=judged.SOCKET,
+            help='Unix socket path (default: JUDGE_DAEMON_SOCKET).',
+        )
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError('JUDGE_DAEMON_SOCKET is not set and no --socket was given.')
+        self.stdout.write(f'Judge daemon: starting on {options["socket"]}')
+        self.stdout.flush()
+        # Replace this process, so the daemon's children are forked from an
+        # interpreter that never imported Django
+        os.chdir(settings.BASE_DIR)
+        os.execv(sys.executable, [sys.executable, '-m', 'arena_api.judged', '--socket', options['socket']])
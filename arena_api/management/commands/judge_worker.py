@@ -0,0 +1,49 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from arena_api import javacds, judge_queue, runner, toolchains
+
+
+class Command(BaseCommand):
+    help = 'Run queued judge jobs (JUDGE_QUEUE=redis|sqlite) through arena_api/runner.py.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=runner.MAX_WORKERS,
+            help='Jobs executed at once (default: JUDGE_MAX_WORKERS).',
+        )
+
+    def handle(self, *args, **options):
+        backend = judge_queue.get_backend()
+        if backend is None:
+            raise CommandError('JUDGE_QUEUE is not set; judging runs inside the web process.')
+
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        concurrency = max(1, options['concurrency'])
+        self.stdout.write(f'Judge worker: {judge_queue.QUEUE} queue, {concurrency} job(s) at a time')
+        # Probe the toolchains now rather than on the first job
+        ready = sorted(lang for lang, spec in toolchains.languages().items() if spec['available'])
+        self.stdout.write(f'Languages available: {", ".join(ready)}')
+        if 'java' in ready:
+            javacds.start()   # the CDS archive, in the background
+
+        threads = [
+            threading.Thread(
+                target=judge_queue.work, args=(backend, stop),
+                kwargs={'log': lambda msg: self.stderr.write(msg)},
+                name=f'judge-worker-{i}', daemon=True,
+            )
+            for i in range(concurrency)
+        ]
+        for t in threads:
+            t.start()
+        while not stop.is_set():
+            stop.wait(1)
+        for t in threads:
+            t.join(timeout=10)
+        self.stdout.write('Judge worker stopped.')
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from arena_api import regrade
+from arena_api.models import CodingTask, RegradeJob
+
+
+class Command(BaseCommand):
+    help = ('Regrade the active submissions of tasks against their current test cases '
+            '(see arena_api/regrade.py), or take over regrades whose process died.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('task_ids', nargs='*', help='Tasks to regrade, in the foreground.')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Run every regrade nobody is working on (queued, or past its lease) to completion.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['task_ids'] and not options['resume']:
+            raise CommandError('Give task ids to regrade, or --resume.')
+
+        for task_id in options['task_ids']:
+            try:
+                task = CodingTask.objects.get(id=task_id)
+            except Exception:
+                raise CommandError(f'Task {task_id} not found')
+            job = regrade.start(task, background=False)
+            if job is None:
+                self.stdout.write(f'{task_id}: up to date')
+            else:
+                self.stdout.write(f'{task_id}: {job.status}, {job.regraded}/{job.total} regraded, '
+                                  f'{job.failed} failed, {job.changed} changed')
+
+        if options['resume']:
+            jobs = list(RegradeJob.objects(status__in=regrade.ACTIVE))
+            for job in jobs:
+                regrade.run_job(job.id)   # returns at once for a job another process holds
+            self.stdout.write(f'Resume: {len(jobs)} job(s) checked.')
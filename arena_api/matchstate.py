@@ -0,0 +1,208 @@
+"""
+arena_api/matchstate.py
+Hot state of tournament matches, for TournamentConsumer.
+
+Every connect and every code_submit on a match socket used to load the whole
+Tournament document (every question with every test case, every match).
+What a match needs is small and changes only on a state transition, so it is
+built once per match and kept in the Django cache:
+    { 'question':   the question_data payload sent to clients (None if missing),
+      'test_cases': the question's cases in runner form,
+      'limits':     time_limit_ms / memory_limit_mb / language_limits of the question,
+      'players':    [{'id', 'username'}], 'usernames': {player id: username},
+      'status', 'winner_id', 'winner_username', 'round_num',
+      'current_round', 'round_matches': matches in the tournament's current round }
+
+With REDIS_URL set the cache is shared by every worker, and an entry lives for
+TTL seconds or until invalidate() is called by the views on every change to a
+tournament's questions or bracket. The consumer writes the matches it decides
+through to MongoDB and then put()s the new state. Without Redis (or while it
+is unreachable) entries are kept in this process for LOCAL_TTL seconds only,
+since another process can change the tournament without this one hearing of
+it.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+TTL         = int(os.environ.get('TOURNAMENT_STATE_TTL', 600))   # seconds, shared cache
+LOCAL_TTL   = 5            # seconds, per-process entries
+MAX_LOCAL   = 1024
+REDIS_RETRY = 30           # seconds on the per-process entries after a cache error
+SHARED      = bool(os.environ.get('REDIS_URL'))
+
+logger = logging.getLogger('arena_api.judge')
+
+_local = OrderedDict()    # key → (expiry, state)
+_lock = threading.Lock()
+_down_until = 0.0
+_counts = {'hits': 0, 'loads': 0, 'invalidations': 0, 'cache_errors': 0}
+
+
+def _count(name):
+    with _lock:
+        _counts[name] += 1
+
+
+def _key(tournament_id, match_id) -> str:
+    return f'tournament:match:{tournament_id}:{match_id}'
+
+
+def _shared() -> bool:
+    return SHARED and time.monotonic() >= _down_until
+
+
+def _cache_error(e):
+    global _down_until
+    _down_until = time.monotonic() + REDIS_RETRY
+    _count('cache_errors')
+    logger.warning('match state cache unavailable: %s', e)
+
+
+# ── Building ──────────────────────────────────────────────────────────────────
+
+def build(t, match_id):
+    """The state of match `match_id` of Tournament `t`, or None if it has no such match."""
+    match = next((m for m in t.matches if m.match_id == match_id), None)
+    if not match:
+        return None
+    usernames = dict(t.participant_usernames)
+    q = t.questions[match.question_index] if match.question_index < len(t.questions) else None
+    question = test_cases = None
+    if q:
+        question = {
+            'title':       q.title,
+            'description': q.description,
+            'difficulty':  q.difficulty,
+            'testCases': [
+                {'input': tc.input_data, 'expected_output': tc.output_data}
+                for tc in q.test_cases
+            ],
+            'techStack':          getattr(t, 'tech_stack', 'General'),
+            'timeLimitMs':        getattr(q, 'time_limit_ms', 0),
+            'memoryLimitMb':      getattr(q, 'memory_limit_mb', 0),
+            'allowCopyPaste':     getattr(t, 'allow_copy_paste', True),
+            'allowTabCompletion': getattr(t, 'allow_tab_completion', True),
+        }
+        test_cases = [
+            {'input_data': tc.input_data, 'output_data': tc.output_data, 'is_hidden': tc.is_hidden}
+            for tc in q.test_cases
+        ]
+    player_ids = [pid for pid in (match.player1_id, match.player2_id) if pid]
+    return {
+        'question':   question,
+        'test_cases': test_cases,
+        'limits': {
+            'time_limit_ms':   getattr(q, 'time_limit_ms', 0),
+            'memory_limit_mb': getattr(q, 'memory_limit_mb', 0),
+            'language_limits': dict(getattr(q, 'language_limits', None) or {}),
+        },
+        'players':         [{'id': pid, 'username': usernames.get(pid, pid)} for pid in player_ids],
+        'usernames':       {pid: usernames.get(pid, '') for pid in player_ids},
+        'status':          match.status,
+        'winner_id':       match.winner_id,
+        'winner_username': match.winner_username,
+        'round_num':       match.round_num,
+        'current_round':   t.current_round,
+        'round_matches':   sum(m.round_num == t.current_round for m in t.matches),
+    }
+
+
+def judge_limits(state, language: str) -> dict:
+    """limits.for_task() for the match's question in `language`."""
+    from . import limits
+    return limits.for_task(SimpleNamespace(**state['limits']), language)
+
+
+# ── API ───────────────────────────────────────────────────────────────────────
+
+def get(tournament_id, match_id):
+    """
+    The state of a match (see the module docstring), loaded from MongoDB on a
+    miss. None when the tournament or the match does not exist; that is not
+    cached, so a match created by the next round is seen straight away.
+    """
+    from .models import Tournament
+    key = _key(tournament_id, match_id)
+    if _shared():
+        from django.core.cache import cache
+        try:
+            state = cache.get(key)
+        except Exception as e:
+            _cache_error(e)
+        else:
+            if state is not None:
+                _count('hits')
+                return state
+    else:
+        with _lock:
+            entry = _local.get(key)
+            if entry and entry[0] > time.monotonic():
+                _local.move_to_end(key)
+                _counts['hits'] += 1
+                return entry[1]
+
+    try:
+        t = Tournament.objects.get(id=tournament_id)
+    except Exception:
+        return None
+    state = build(t, match_id)
+    if state is None:
+        return None
+    _count('loads')
+    put(tournament_id, match_id, state)
+    return state
+
+
+def put(tournament_id, match_id, state) -> None:
+    """Cache `state` for a match, e.g. after writing a transition through to MongoDB."""
+    key = _key(tournament_id, match_id)
+    if _shared():
+        from django.core.cache import cache
+        try:
+            cache.set(key, state, TTL)
+            return
+        except Exception as e:
+            _cache_error(e)
+    with _lock:
+        _local[key] = (time.monotonic() + LOCAL_TTL, state)
+        _local.move_to_end(key)
+        while len(_local) > MAX_LOCAL:
+            _local.popitem(last=False)
+
+
+def invalidate(tournament_id, match_ids) -> None:
+    """Drop the cached state of these matches, here and in the shared cache."""
+    keys = [_key(tournament_id, mid) for mid in match_ids]
+    if not keys:
+        return
+    _count('invalidations')
+    with _lock:
+        for key in keys:
+            _local.pop(key, None)
+    if SHARED:
+        # Even while marked down: a stale entry must not outlive the outage
+        from django.core.cache import cache
+        try:
+            cache.delete_many(keys)
+        except Exception as e:
+            _cache_error(e)
+
+
+def invalidate_tournament(t) -> None:
+    """Drop the cached state of every match of Tournament `t`."""
+    invalidate(str(t.id), [m.match_id for m in t.matches])
+
+
+def stats() -> dict:
+    shared = _shared()
+    with _lock:
+        return {
+            'backend': 'shared' if shared else 'local',
+            'local_entries': len(_local),
+            'ttl': TTL if shared else LOCAL_TTL,
+            **_counts,
+        }
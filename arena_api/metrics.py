@@ -0,0 +1,226 @@
+"""
+arena_api/metrics.py
+Per-phase instrumentation for the code runner.
+
+Each judged test case gets a record of where its time went:
+  queue    waiting for a worker slot
+  write    writing the source file
+  compile  building the artifact (once per call, on a build-cache miss;
+           includes its wait for a slot)
+  spawn    starting the process
+  execute  running it and collecting output
+  compare  checking the output against the expected one
+  precheck the syntax check of precheck.py (once per call)
+plus, where the child can be reaped with wait4, its CPU time and peak RSS, and
+an exit reason (exited, exit_code, signal, timeout, mismatch, output_limit,
+not_run).
+
+Records aggregate into per-language histograms in this process, served by
+GET /api/admin/judge-metrics/ and written to the 'arena_api.judge' log every
+JUDGE_METRICS_LOG_EVERY seconds (0 = never). Callers that want the raw
+numbers pass timings=True to run_test_cases.
+
+The current record travels in a ContextVar, so it follows each case into its
+worker thread or asyncio task without being passed around explicitly.
+"""
+import bisect
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+
+PHASES = ('queue', 'write', 'compile', 'spawn', 'execute', 'compare', 'precheck')
+# Histogram bucket upper bounds; the last bucket is everything above
+MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+KB_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+
+LOG_EVERY = float(os.environ.get('JUDGE_METRICS_LOG_EVERY', 0))
+
+logger = logging.getLogger('arena_api.judge')
+
+_record = contextvars.ContextVar('judge_record', default=None)
+_lock = threading.Lock()
+_stats = {}
+_since = time.time()
+_last_log = time.monotonic()
+
+
+# ── Recording ─────────────────────────────────────────────────────────────────
+
+@contextlib.contextmanager
+def recording(record: dict):
+    """Make `record` the target of phase()/note() in this thread or task."""
+    token = _record.set(record)
+    try:
+        yield record
+    finally:
+        _record.reset(token)
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """Add the time spent in the block to the current record (no-op without one)."""
+    record = _record.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        record[f'{name}_ms'] = round(record.get(f'{name}_ms', 0.0) + ms, 3)
+
+
+def active() -> bool:
+    """True while phase()/note() have a record to write to."""
+    return _record.get() is not None
+
+
+def note(**fields) -> None:
+    record = _record.get()
+    if record is not None:
+        record.update(fields)
+
+
+def note_exit(returncode, stop_reason=None) -> None:
+    """Record how the process ended; a judge stop reason wins over the exit status."""
+    record = _record.get()
+    if record is None:
+        return
+    if stop_reason:
+        record['exit_reason'] = stop_reason
+    elif returncode is not None:
+        record['exit_reason'] = 'signal' if returncode < 0 else 'exited' if returncode == 0 else 'exit_code'
+    if returncode is not None:
+        record['exit_code'] = returncode
+
+
+def note_rusage(status: int, rusage, stop_reason=None) -> None:
+    """note_exit() plus CPU time and peak RSS, from an os.wait4() result."""
+    note_exit(os.waitstatus_to_exitcode(status), stop_reason)
+    note(cpu_ms=round((rusage.ru_utime + rusage.ru_stime) * 1000, 3),
+         peak_rss_kb=rusage.ru_maxrss)   # kilobytes on Linux
+
+
+def timed(fn):
+    """
+    Wrap a per-case function so each call fills its own record, returned
+    under '_timings'. Only while a call is being recorded; otherwise fn is
+    returned unchanged, so results never carry the key by accident.
+    """
+    if not active():
+        return fn
+
+    def run(*args):
+        record = {}
+        with recording(record):
+            result = fn(*args)
+        result['_timings'] = record
+        return result
+    return run
+
+
+def timed_async(fn):
+    if not active():
+        return fn
+
+    async def run(*args):
+        record = {}
+        with recording(record):
+            result = await fn(*args)
+        result['_timings'] = record
+        return result
+    return run
+
+
+# ── Aggregation ───────────────────────────────────────────────────────────────
+
+def _histogram(buckets):
+    return {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(buckets) + 1)}
+
+
+def _add(hist, buckets, value):
+    hist['count'] += 1
+    hist['sum'] += value
+    hist['max'] = max(hist['max'], value)
+    hist['buckets'][bisect.bisect_left(buckets, value)] += 1
+
+
+def observe(language: str, call: dict, cases: list) -> None:
+    """Fold one judge call (its call-level record and per-case records) into the histograms."""
+    global _last_log
+    with _lock:
+        lang = _stats.setdefault(language, {'calls': 0, 'cases': 0, 'exit_reasons': {}, 'phases': {}})
+        lang['calls'] += 1
+        lang['cases'] += len(cases)
+        for key, value in call.items():
+            if key.endswith('_ms'):
+                _add(lang['phases'].setdefault(key, _histogram(MS_BUCKETS)), MS_BUCKETS, value)
+        for record in cases:
+            for key, value in record.items():
+                if key == 'peak_rss_kb':
+                    _add(lang['phases'].setdefault(key, _histogram(KB_BUCKETS)), KB_BUCKETS, value)
+                elif key.endswith('_ms'):
+                    _add(lang['phases'].setdefault(key, _histogram(MS_BUCKETS)), MS_BUCKETS, value)
+            reason = record.get('exit_reason', 'not_run')
+            lang['exit_reasons'][reason] = lang['exit_reasons'].get(reason, 0) + 1
+        due = LOG_EVERY > 0 and time.monotonic() - _last_log >= LOG_EVERY
+        if due:
+            _last_log = time.monotonic()
+    if due:
+        dump()
+
+
+def _percentile(hist, buckets, q):
+    """Upper bound of the bucket holding the q-th quantile (None above the last bound)."""
+    if not hist['count']:
+        return None
+    target = q * hist['count']
+    seen = 0
+    for i, n in enumerate(hist['buckets']):
+        seen += n
+        if seen >= target:
+            return buckets[i] if i < len(buckets) else None
+    return None
+
+
+def snapshot() -> dict:
+    """Histograms per language, with mean and bucketed p50/p95/p99 for each phase."""
+    with _lock:
+        languages = {}
+        for language, lang in _stats.items():
+            phases = {}
+            for key, hist in lang['phases'].items():
+                buckets = KB_BUCKETS if key == 'peak_rss_kb' else MS_BUCKETS
+                phases[key] = {
+                    'count': hist['count'],
+                    'mean':  round(hist['sum'] / hist['count'], 3) if hist['count'] else None,
+                    'max':   round(hist['max'], 3),
+                    'p50':   _percentile(hist, buckets, 0.50),
+                    'p95':   _percentile(hist, buckets, 0.95),
+                    'p99':   _percentile(hist, buckets, 0.99),
+                    'buckets': dict(zip([str(b) for b in buckets] + ['+Inf'], hist['buckets'])),
+                }
+            languages[language] = {
+                'calls': lang['calls'], 'cases': lang['cases'],
+                'exit_reasons': dict(lang['exit_reasons']), 'phases': phases,
+            }
+        return {'since': _since, 'pid': os.getpid(), 'languages': languages}
+
+
+def reset() -> None:
+    global _since
+    with _lock:
+        _stats.clear()
+        _since = time.time()
+
+
+def dump() -> None:
+    """Write a one-line summary per language to the 'arena_api.judge' log."""
+    for language, lang in snapshot()['languages'].items():
+        parts = [f'{key}={p["mean"]}/{p["p95"]}' for key, p in sorted(lang['phases'].items())]
+        logger.info('judge %s: %d calls, %d cases, exits=%s, mean/p95 %s',
+                    language, lang['calls'], lang['cases'], lang['exit_reasons'], ' '.join(parts))
@@ -61,6 +61,8 @@ class TestCase(EmbeddedDocument):
     input_data  = fields.StringField(required=True)
     output_data = fields.StringField(required=True)
     is_hidden   = fields.BooleanField(default=False)
+    # Timed by performance grading (all cases are timed if none is marked)
+    is_benchmark = fields.BooleanField(default=False)
 
 
 class Submission(EmbeddedDocument):
@@ -82,6 +84,12 @@ class Submission(EmbeddedDocument):
     is_active    = fields.BooleanField(default=True)
     status       = fields.StringField(default='Submitted', choices=['Submitted', 'Unsubmitted'])
     run_results  = fields.ListField(fields.DictField(), default=[]) # Added
+    # Hash of the test cases it was graded against (verdicts.test_cases_hash); see regrade.py
+    test_cases_hash = fields.StringField(default='')
+    late_penalty    = fields.FloatField(default=0.0)   # points taken off the score for lateness
+    # Performance tasks: timed after the verdict is recorded (regrade.grade_performance)
+    performance        = fields.DictField(null=True, default=None)
+    performance_status = fields.StringField(default='', choices=['', 'pending', 'graded'])
     last_edited_at = fields.DateTimeField(default=datetime.utcnow)
     created_at   = fields.DateTimeField(default=datetime.utcnow)
 
@@ -107,11 +115,21 @@ class CodingTask(Document):
     hints         = fields.ListField(fields.StringField(), default=[])
     # Grading configuration set by teacher
     grading_mode  = fields.StringField(choices=["Percentage", "Marks", "Grade"], default="Percentage")
-    grading_type  = fields.StringField(choices=["auto", "manual"], default="auto")  # auto=test cases, manual=teacher assigns marks
+    grading_type  = fields.StringField(choices=["auto", "manual", "performance"], default="auto")  # auto=test cases, manual=teacher assigns marks, performance=runtime vs reference
     allow_tab_completion = fields.BooleanField(default=True)
     max_marks     = fields.FloatField(default=100.0)
     pass_criteria = fields.FloatField(default=50.0)   # % or marks needed to pass
     allow_copy_paste = fields.BooleanField(default=True)
+    # Judge limits, 0 = judge default; language_limits overrides them per language,
+    # e.g. {"python": {"time_limit_ms": 4000}} (see limits.py)
+    time_limit_ms   = fields.IntField(default=0)
+    memory_limit_mb = fields.IntField(default=0)
+    language_limits = fields.DictField(default={})
+    # Performance grading: CPU time against the reference solution (see perf.py)
+    reference_code     = fields.StringField(default="")
+    reference_language = fields.StringField(default="")   # '' = tech_stack
+    perf_runs          = fields.IntField(default=5)
+    perf_tolerance     = fields.FloatField(default=1.5)   # full marks up to this many times the reference
     created_at    = fields.DateTimeField(default=datetime.utcnow)
 
     meta = {'collection': 'coding_tasks', 'ordering': ['-created_at']}
@@ -129,6 +147,29 @@ class CodingTask(Document):
         return 'F'
 
 
+class RegradeJob(Document):
+    """Background regrade of a task's submissions after its test cases changed (see regrade.py)."""
+    task_id         = fields.StringField(required=True)
+    task_title      = fields.StringField(default='')
+    test_cases_hash = fields.StringField(required=True)   # the test cases being graded against
+    status          = fields.StringField(choices=['queued', 'running', 'done', 'failed', 'superseded'], default='queued')
+    requested_by    = fields.StringField(default='')      # teacher notified when it ends
+    requested_by_name = fields.StringField(default='')
+    total           = fields.IntField(default=0)
+    regraded        = fields.IntField(default=0)
+    failed          = fields.IntField(default=0)
+    changed         = fields.IntField(default=0)          # regraded with a different score or pass
+    error           = fields.StringField(default='')
+    # Lease: the process working on it, and when it last said so
+    owner           = fields.StringField(default='')
+    heartbeat_at    = fields.DateTimeField(required=False)
+    created_at      = fields.DateTimeField(default=datetime.utcnow)
+    started_at      = fields.DateTimeField(required=False)
+    finished_at     = fields.DateTimeField(required=False)
+
+    meta = {'collection': 'regrade_jobs', 'ordering': ['-created_at']}
+
+
 class ReattemptRequest(Document):
     student_id   = fields.StringField(required=True)
     student_name = fields.StringField(required=True) # Redundant but useful for displaying
@@ -334,6 +375,10 @@ class TournamentQuestion(EmbeddedDocument):
     description = fields.StringField(required=True)
     difficulty  = fields.StringField(choices=["Easy", "Medium", "Hard"], default="Easy")
     test_cases  = fields.ListField(fields.EmbeddedDocumentField(TestCase), default=[])
+    # Judge limits, as on CodingTask
+    time_limit_ms   = fields.IntField(default=0)
+    memory_limit_mb = fields.IntField(default=0)
+    language_limits = fields.DictField(default={})
 
 
 class TournamentMatch(EmbeddedDocument):
@@ -0,0 +1,135 @@
+"""
+arena_api/perf.py
+Performance grading: a correct submission is scored on its CPU time against
+the task's reference solution (CodingTask.grading_type == "performance").
+
+  - The benchmark cases (TestCase.is_benchmark; every case if none is marked)
+    run one at a time, WARMUP times untimed and then task.perf_runs times.
+  - Each case's time is the median CPU time (user + system) of the timed
+    runs, and never less than MIN_MS, below which timings are noise. It is
+    the one metric for the reference and the submission alike: the rusage
+    wait4 returns for the case's process (the zygote's child for pooled
+    Python), or the thread's CPU time for SQL, which runs in-process. Runs
+    are timed with run_test_cases(cpu_time=True).
+  - The reference solution is measured the same way, on the same host, and
+    kept in the cache for REFERENCE_TTL.
+  - A case scores 100 while it runs within perf_tolerance times the
+    reference, and 100 * tolerance / ratio beyond that; the score is the mean.
+Times include the runtime's own start-up (10-20 ms for Python or Node), so
+benchmark inputs should keep the intended solution busy for well over that.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import statistics
+
+WARMUP        = int(os.environ.get('JUDGE_PERF_WARMUP', 1))
+MAX_RUNS      = 20
+MIN_MS        = 1.0
+REFERENCE_TTL = 24 * 3600
+
+logger = logging.getLogger('arena_api.judge')
+
+
+class MeasureFailed(Exception):
+    """The code did not pass every benchmark case while being timed."""
+
+
+def _case_ms(result: dict) -> float:
+    ms = (result.get('timings') or {}).get('cpu_ms')
+    if ms is None:
+        raise MeasureFailed('the runtime reported no CPU time')
+    return ms
+
+
+def measure(code: str, language: str, test_cases: list, runs: int, warmup: int = WARMUP,
+            priority: str = 'submit', **limits) -> list:
+    """
+    Median CPU milliseconds (user + system) per test case over `runs` timed runs after
+    `warmup` untimed ones. `limits` are run_test_cases options (see
+    limits.for_task). Raises MeasureFailed if a run fails a case; may raise
+    judge_queue.JudgeUnavailable.
+    """
+    from . import judge_queue
+    samples = [[] for _ in test_cases]
+    for i in range(warmup + min(max(runs, 1), MAX_RUNS)):
+        # One case at a time, in a process of its own, so runs don't compete for the CPU
+        result = judge_queue.judge(code, language, test_cases, priority=priority,
+                                   parallel=False, harness=False, timings=True, cpu_time=True,
+                                   **limits)
+        if not result['all_passed']:
+            raise MeasureFailed(f'{sum(not r["passed"] for r in result["results"])} benchmark case(s) failed')
+        if i < warmup:
+            continue
+        for case_samples, r in zip(samples, result['results']):
+            case_samples.append(_case_ms(r))
+    return [max(statistics.median(s), MIN_MS) for s in samples]
+
+
+def benchmark_indexes(test_cases: list) -> list:
+    marked = [i for i, tc in enumerate(test_cases) if tc.get('is_benchmark')]
+    return marked or list(range(len(test_cases)))
+
+
+def reference_times(task, test_cases: list, limits: dict, priority: str = 'submit') -> list:
+    """The reference solution's per-case times, measured on this host and cached."""
+    from django.core.cache import cache
+    from . import verdicts
+    language = task.reference_language or task.tech_stack or 'Python'
+    key = 'perf:ref:' + hashlib.sha256(json.dumps([
+        socket.gethostname(), language, task.reference_code, verdicts.test_cases_hash(test_cases),
+        task.perf_runs, WARMUP, limits, 'cpu',
+    ], sort_keys=True).encode('utf-8')).hexdigest()
+    try:
+        times = cache.get(key)
+    except Exception:
+        times = None
+    if times is None:
+        times = measure(task.reference_code, language, test_cases, task.perf_runs, priority=priority, **limits)
+        try:
+            cache.set(key, times, REFERENCE_TTL)
+        except Exception:
+            pass
+    return times
+
+
+def case_score(student_ms: float, reference_ms: float, tolerance: float) -> float:
+    allowed = reference_ms * max(tolerance, 1.0)
+    return 100.0 if student_ms <= allowed else 100.0 * allowed / student_ms
+
+
+def grade(task, code: str, language: str, test_cases: list, priority: str = 'submit') -> dict:
+    """
+    Time a submission that already passed every case. Returns
+      { 'score': float, 'runs': int, 'tolerance': float,
+        'cases': [{ 'index': int, 'cpu_ms': float, 'reference_ms': float, 'score': float }] }
+    or None when the task has no reference solution, or it fails its own
+    cases (the task is then graded on test cases alone). Raises MeasureFailed
+    if the submission fails while timed; may raise judge_queue.JudgeUnavailable.
+    """
+    from . import limits
+    if not task.reference_code:
+        return None
+    indexes = benchmark_indexes(test_cases)
+    bench = [test_cases[i] for i in indexes]
+    reference_limits = limits.for_task(task, task.reference_language or task.tech_stack or 'Python')
+    try:
+        reference = reference_times(task, bench, reference_limits, priority)
+    except MeasureFailed as e:
+        logger.warning('perf: reference solution of task %s fails: %s', task.id, e)
+        return None
+    student = measure(code, language, bench, task.perf_runs, priority=priority,
+                      **limits.for_task(task, language))
+    cases = [
+        {'index': i + 1, 'cpu_ms': round(s, 3), 'reference_ms': round(r, 3),
+         'score': round(case_score(s, r, task.perf_tolerance), 1)}
+        for i, s, r in zip(indexes, student, reference)
+    ]
+    return {
+        'score':     round(sum(c['score'] for c in cases) / len(cases), 1),
+        'runs':      min(max(task.perf_runs, 1), MAX_RUNS),
+        'tolerance': task.perf_tolerance,
+        'cases':     cases,
+    }
@@ -0,0 +1,90 @@
+"""
+arena_api/precheck.py
+Syntax pre-check for interpreted languages.
+
+Code that does not even parse fails every test case the same way, so it is
+rejected once, before any source file is written or process started:
+  python      — compile() in this process (same interpreter the runner uses)
+  javascript  — `node --check`, one process per distinct source, with the
+                verdict cached by source hash
+The error becomes the stderr of every test case, as a normal run would show.
+
+Compiled languages need no separate stage: they are built once per
+submission and a compile error is stored in the artifact cache like a build
+(see runner._prepare_compiled), so it is never re-run per case or per submit.
+"""
+import hashlib
+import os
+import subprocess
+import threading
+import traceback
+import warnings
+from collections import OrderedDict
+
+ENABLED   = os.environ.get('JUDGE_PRECHECK', 'True') == 'True'
+LANGUAGES = ('python', 'javascript')
+MAX_CACHED = 512
+
+_cache = OrderedDict()   # sha256 of the source → error message or None
+_lock  = threading.Lock()
+_counts = {'checked': 0, 'rejected': 0, 'cache_hits': 0}
+
+
+def _check_python(code: str):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')   # SyntaxWarnings would land in the server log
+            compile(code, 'solution.py', 'exec')
+    except (SyntaxError, ValueError) as e:   # ValueError: null bytes
+        return ''.join(traceback.format_exception_only(type(e), e)).rstrip()
+    except (MemoryError, RecursionError):
+        return None   # too big to judge here; let the real run decide
+    return None
+
+
+def _check_javascript(code: str):
+    from . import runner, workspace
+    with workspace.job_dir() as job:
+        workspace.write_source(job, 'solution.js', code)
+        with runner._slot():
+            r = subprocess.run(['node', '--check', 'solution.js'], cwd=job,
+                               capture_output=True, text=True, timeout=10, encoding='utf-8')
+    if r.returncode == 0:
+        return None
+    # Keep the code frame and the error line; the stack is node's own internals,
+    # and the job directory is gone (and reused) by the time this is shown
+    stderr = r.stderr.replace(job + os.sep, '')
+    lines = [line for line in stderr.splitlines()
+             if not line.startswith(('    at ', 'Node.js v'))]
+    return '\n'.join(lines).strip() or None
+
+
+_CHECKS = {'python': _check_python, 'javascript': _check_javascript}
+
+
+def check(lang_key: str, code: str):
+    """The syntax error to report for `code`, or None if it parses (or can't be checked)."""
+    if not ENABLED or lang_key not in _CHECKS:
+        return None
+    key = hashlib.sha256(f'{lang_key}\0{code}'.encode('utf-8')).hexdigest()
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _counts['cache_hits'] += 1
+            return _cache[key]
+    try:
+        error = _CHECKS[lang_key](code)
+    except (OSError, subprocess.SubprocessError):
+        return None   # node missing or stuck: no verdict, run normally
+    with _lock:
+        _counts['checked'] += 1
+        _counts['rejected'] += error is not None
+        _cache[key] = error
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+    return error
+
+
+def stats() -> dict:
+    with _lock:
+        return {'enabled': ENABLED, 'cached': len(_cache), **_counts}
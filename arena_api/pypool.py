@@ -0,0 +1,267 @@
+"""
+arena_api/pypool.py
+Warm Python interpreter pool used by runner.run_python.
+
+Each pool member is a long-lived "zygote" interpreter started from this file.
+It imports the stdlib modules students commonly use once, then for every job
+forks a child that runs the submission in a fresh __main__ namespace with its
+own stdin/stdout/stderr pipes. Student code never runs inside the zygote, so a
+crash or a mutated module only ever affects one child; the zygote itself is
+still recycled after a fixed job budget or on any protocol error.
+
+Protocol (one JSON object per line over the zygote's stdin/stdout):
+  → { "code": str, "stdin": str, "timeout": float,
+      "expected": str | null, "output_limit": int | null, "memory_mb": int }
+  ← { "stdout": str, "stderr": str, "returncode": int, "timed_out": bool,
+      "stop_reason": null | "timeout" | "mismatch" | "output_limit",
+      "cpu_ms": float, "peak_rss_kb": int }
+
+With "expected" set, stdout is compared while it streams (see streamcmp.py)
+and the child is killed as soon as the output can no longer match. With
+"memory_mb" the child gets the memory and CPU rlimits of limits.set_rlimits.
+"""
+import json
+import os
+import queue
+import selectors
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from . import streamcmp
+except ImportError:
+    # Launched by path as the zygote script: import the sibling module, then
+    # drop arena_api/ from sys.path again so student code cannot import from it
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import streamcmp
+    sys.path.pop(0)
+
+# Hard cap on captured output per stream unless the job sets a lower one
+OUTPUT_CAP = 16 * 1024 * 1024
+
+
+# ── Zygote side (runs as a standalone script) ─────────────────────────────────
+
+def _exec_student(code):
+    """Runs in the forked child: execute `code` as __main__ and exit."""
+    import io, traceback, types
+
+    sys.stdin  = io.TextIOWrapper(io.BufferedReader(io.FileIO(0, 'r')), encoding='utf-8')
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(io.FileIO(1, 'w')), encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(io.BufferedWriter(io.FileIO(2, 'w')), encoding='utf-8')
+    sys.argv   = ['solution.py']
+
+    main = types.ModuleType('__main__')
+    main.__file__ = 'solution.py'
+    sys.modules['__main__'] = main
+
+    status = 0
+    try:
+        exec(compile(code, 'solution.py', 'exec'), main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException as e:
+        # Drop the zygote's own frame so the traceback looks like a normal run
+        tb = e.__traceback__.tb_next if e.__traceback__ else None
+        traceback.print_exception(type(e), e, tb)
+        status = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try: stream.flush()
+            except Exception: pass
+    os._exit(status & 0xFF)
+
+
+def _set_rlimits(memory_mb, timeout):
+    """limits.set_rlimits for the forked child (this script cannot import the package)."""
+    import math, resource
+    size = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_DATA, (size, size))
+    seconds = math.ceil(timeout) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+
+
+def _run_job(job):
+    """Fork a child for one job and collect its output under a deadline."""
+    in_r, in_w   = os.pipe()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setpgid(0, 0)
+            os.dup2(in_r, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            os.closerange(3, 1024)
+            if job.get('memory_mb'):
+                _set_rlimits(job['memory_mb'], float(job.get('timeout', 5)))
+            _exec_student(job.get('code', ''))
+        finally:
+            os._exit(1)
+
+    for fd in (in_r, out_w, err_w):
+        os.close(fd)
+
+    limit    = int(job.get('output_limit') or OUTPUT_CAP)
+    matcher  = streamcmp.StreamMatcher(job.get('expected'), limit)
+    deadline = time.monotonic() + float(job.get('timeout', 5))
+    reason, err = streamcmp.pump(
+        in_w, out_r, err_r, job.get('stdin', '').encode('utf-8'), matcher, deadline, OUTPUT_CAP,
+    )
+
+    # Streams closed does not mean the child exited; keep honouring the deadline
+    status = usage = None
+    while reason is None and status is None:
+        wpid, wstatus, wusage = os.wait4(pid, os.WNOHANG)
+        if wpid:
+            status, usage = wstatus, wusage
+        elif time.monotonic() >= deadline:
+            reason = streamcmp.TIMEOUT
+        else:
+            time.sleep(0.002)
+
+    # Kill the whole process group: covers early stops and stray grandchildren
+    try: os.killpg(pid, signal.SIGKILL)
+    except OSError: pass
+    if status is None:
+        _, status, usage = os.wait4(pid, 0)
+    for fd in (out_r, err_r):
+        os.close(fd)
+
+    return {
+        'stdout':      matcher.output(),
+        'stderr':      err.decode('utf-8', 'replace'),
+        'returncode':  os.waitstatus_to_exitcode(status),
+        'timed_out':   reason == streamcmp.TIMEOUT,
+        'stop_reason': reason,
+        'cpu_ms':      round((usage.ru_utime + usage.ru_stime) * 1000, 3),
+        'peak_rss_kb': usage.ru_maxrss,
+    }
+
+
+def _serve():
+    # Warm the modules beginner solutions import so each fork starts hot
+    import bisect, collections, functools, heapq, itertools, math, re, string  # noqa: F401
+
+    proto_in  = os.fdopen(os.dup(0), 'rb')
+    proto_out = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    for line in proto_in:
+        try:
+            reply = _run_job(json.loads(line))
+        except Exception as e:
+            reply = {'stdout': '', 'stderr': str(e), 'returncode': 1, 'timed_out': False, 'stop_reason': None}
+        proto_out.write(json.dumps(reply).encode('utf-8') + b'\n')
+        proto_out.flush()
+
+
+# ── Parent side ───────────────────────────────────────────────────────────────
+
+class ZygoteError(Exception):
+    """The zygote died or stopped answering; the job should be retried elsewhere."""
+
+
+class _Zygote:
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-I', os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self.jobs = 0
+
+    def run(self, code, stdin, timeout, expected=None, output_limit=None, memory_mb=0):
+        self.jobs += 1
+        try:
+            payload = json.dumps({
+                'code': code, 'stdin': stdin, 'timeout': timeout,
+                'expected': expected, 'output_limit': output_limit, 'memory_mb': memory_mb,
+            })
+            self.proc.stdin.write(payload.encode('utf-8') + b'\n')
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise ZygoteError(str(e))
+
+        # The zygote enforces `timeout` itself; the grace period only covers a hung zygote
+        fd = self.proc.stdout.fileno()
+        deadline = time.monotonic() + timeout + 5
+        buf = b''
+        # A selector rather than select.select, which refuses fds >= FD_SETSIZE (1024)
+        with selectors.DefaultSelector() as sel:
+            sel.register(fd, selectors.EVENT_READ)
+            while not buf.endswith(b'\n'):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not sel.select(remaining):
+                    raise ZygoteError('Python worker did not respond.')
+                data = os.read(fd, 65536)
+                if not data:
+                    raise ZygoteError('Python worker exited unexpectedly.')
+                buf += data
+        try:
+            return json.loads(buf)
+        except ValueError as e:
+            raise ZygoteError(str(e))
+
+    def close(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=1)
+        except Exception:
+            pass
+
+
+class PythonPool:
+    """A fixed number of pre-started zygotes, checked out one job at a time."""
+
+    def __init__(self, size, max_jobs):
+        self.size     = size
+        self.max_jobs = max_jobs
+        self._idle    = queue.Queue()
+        self._started = False
+        self._lock    = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._idle.put(_Zygote())
+                self._started = True
+
+    def run(self, code, stdin, timeout, expected=None, output_limit=None, memory_mb=0):
+        """Run one job; raises ZygoteError if the worker failed (it is replaced)."""
+        self._start()
+        z = self._idle.get()
+        try:
+            reply = z.run(code, stdin, timeout, expected, output_limit, memory_mb)
+        except Exception:
+            z.close()
+            self._idle.put(_Zygote())
+            raise
+        if z.jobs >= self.max_jobs:
+            z.close()
+            z = _Zygote()
+        self._idle.put(z)
+        return reply
+
+    def close(self):
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().close()
+            self._started = False
+
+
+if __name__ == '__main__':
+    _serve()
@@ -0,0 +1,397 @@
+"""
+arena_api/regrade.py
+Background regrade of a task's submissions after its test cases change.
+
+Every Submission records the hash of the test cases it was graded against
+(test_cases_hash). When a teacher edits a task's test cases, start() opens a
+RegradeJob and a background thread re-judges every active submission whose
+hash is not the current one:
+  - BATCH submissions at a time, WORKERS of them judged concurrently, at the
+    lowest judge priority ('regrade') and without admission leases
+  - each batch is written back in a single update of the task document:
+    score, marks, grade, passed, remarks and run_results are recomputed as
+    /submit/ computes them (grading_fields), keeping the late penalty the
+    submission was given. Manually graded tasks only get new run_results, so
+    the teacher's marks stand. XP already awarded is left alone.
+  - progress (regraded / failed / changed out of total) is saved on the job
+    after every batch; GET /api/tasks/<id>/regrade/ reports it, and the
+    teacher who made the edit is notified when the job ends
+A job is leased by the process running it and the lease is renewed every
+HEARTBEAT seconds. If that process dies, the lease lapses after LEASE seconds
+and resume() takes the job over (`manage.py regrade --resume`, or the
+progress endpoint when polled); regraded submissions already carry the new
+hash, so none is judged twice. A newer edit supersedes a job in progress,
+which stops after its current batch.
+
+Performance tasks are timed here too, rather than inside /submit/: the
+request records the test-case verdict with performance_status 'pending', and
+grade_performance_later() times the submission on one of WORKERS background
+threads at 'regrade' priority and stores the performance grade. A
+submission still pending when its process stops is picked up by the next
+regrade of the task (_pending counts it).
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from . import tasks
+
+BATCH     = int(os.environ.get('JUDGE_REGRADE_BATCH', 16))
+WORKERS   = int(os.environ.get('JUDGE_REGRADE_WORKERS', 2))
+HEARTBEAT = 10   # seconds between lease renewals
+LEASE     = 60   # seconds without a renewal before another process may take a job over
+ACTIVE    = ('queued', 'running')
+
+logger = logging.getLogger('arena_api.judge')
+
+
+# ── Grading ───────────────────────────────────────────────────────────────────
+
+def grading_fields(task, run_results: list, performance: dict = None, late_penalty: float = 0.0) -> dict:
+    """
+    How a submission with these run_results (and performance grade, if any)
+    is graded under the task's grading config:
+      { 'all_passed', 'n_passed', 'total', 'score', 'max_marks',
+        'marks_obtained', 'grade', 'passed', 'review_status', 'remarks' }
+    """
+    all_passed = all(r.get('passed', False) for r in run_results) if run_results else False
+    total      = max(len(run_results), 1)
+    n_passed   = sum(1 for r in run_results if r.get('passed', False))
+    score      = round(n_passed / total * 100, 1)
+    if performance is not None:
+        score = performance['score']
+    if late_penalty > 0:
+        score = max(0.0, round(score - late_penalty, 1))
+
+    grading_type = getattr(task, 'grading_type', 'auto') or 'auto'
+    max_marks    = float(getattr(task, 'max_marks', 100) or 100)
+    is_final     = getattr(task, 'is_final', False)
+    fields = {'all_passed': all_passed, 'n_passed': n_passed, 'total': total,
+              'score': score, 'max_marks': max_marks}
+
+    if grading_type == 'manual':
+        fields.update(
+            marks_obtained = 0.0,
+            grade          = '',
+            passed         = False,
+            review_status  = 'pending',
+            remarks        = 'Submitted for teacher review. Marks will be assigned by your teacher.',
+        )
+    else:
+        remarks = f'Final assessment submitted. Score: {score}%' if is_final else (
+            'All test cases passed.' if all_passed else f'{n_passed}/{total} test cases passed.')
+        if performance is not None and not is_final:
+            remarks += f' Performance score: {score}%.'
+        fields.update(
+            marks_obtained = round(score / 100 * max_marks, 1),
+            grade          = task.compute_grade(score) if hasattr(task, 'compute_grade') else '',
+            passed         = True if is_final else all_passed,
+            review_status  = 'graded',
+            remarks        = remarks,
+        )
+    return fields
+
+
+def test_cases_hash(task) -> str:
+    """Hash of the task's current test cases, as stored on the submissions graded against them."""
+    from . import verdicts
+    return verdicts.test_cases_hash(tasks.test_cases(task))
+
+
+def _late_penalty(task, sub) -> float:
+    if sub.late_penalty:
+        return sub.late_penalty
+    # Recorded before the penalty was stored: recover it from the score it left
+    results = sub.run_results or []
+    if not results or (getattr(task, 'grading_type', 'auto') or 'auto') != 'auto':
+        return 0.0
+    raw = round(sum(1 for r in results if r.get('passed', False)) / len(results) * 100, 1)
+    return max(0.0, round(raw - (sub.score or 0.0), 1))
+
+
+def _pending(task, tc_hash: str) -> list:
+    """Active submissions not graded against the test cases with hash `tc_hash`, or not timed yet."""
+    return [
+        s for s in (task.submissions or [])
+        if getattr(s, 'is_active', True) and s.code
+        and (s.test_cases_hash != tc_hash or s.performance_status == 'pending')
+    ]
+
+
+def _key(sub):
+    return (sub.user_id, sub.created_at)
+
+
+def _regrade_one(task, test_cases: list, tc_hash: str, sub) -> dict:
+    """The fields to store on `sub` after judging it against `test_cases`."""
+    from . import limits, verdicts
+    language = sub.language or task.tech_stack or 'Python'
+    verdict = verdicts.judge(str(task.id), test_cases, language, sub.code, priority='regrade',
+                             limits=limits.for_task(task, language))
+    run_results = verdicts.redact_hidden(verdict['results'])
+    updates = {'run_results': run_results, 'test_cases_hash': tc_hash}
+    grading_type = getattr(task, 'grading_type', 'auto') or 'auto'
+    if grading_type == 'manual':
+        return updates   # the teacher's marks stand
+
+    performance = None
+    if grading_type == 'performance':
+        if verdict['all_passed']:
+            performance = _performance(task, sub.code, language, test_cases)
+        updates.update(performance=performance, performance_status='graded')
+    updates.update(_graded(task, run_results, performance, _late_penalty(task, sub)))
+    return updates
+
+
+def _performance(task, code: str, language: str, test_cases: list):
+    """perf.grade() at regrade priority, with a submission that fails while timed scoring 0."""
+    from . import perf
+    try:
+        return perf.grade(task, code, language, test_cases, priority='regrade')
+    except perf.MeasureFailed as e:
+        # Passed once but not on every timed run (e.g. only just inside the time limit)
+        return {'score': 0.0, 'cases': [], 'error': str(e)}
+
+
+def _graded(task, run_results: list, performance, penalty: float) -> dict:
+    graded = grading_fields(task, run_results, performance, penalty)
+    return {'score': graded['score'], 'marks_obtained': graded['marks_obtained'], 'grade': graded['grade'],
+            'passed': graded['passed'], 'remarks': graded['remarks'], 'late_penalty': penalty}
+
+
+def _write_back(task, updates: list) -> None:
+    """Store a batch of [(submission, fields)] in one update of the task document."""
+    from .models import CodingTask
+    changes, filters = {}, []
+    for i, (sub, fields) in enumerate(updates):
+        for name, value in fields.items():
+            changes[f'submissions.$[s{i}].{name}'] = value
+        # Only while it is still the active one: a resubmission is graded on its own
+        filters.append({f's{i}.user_id': sub.user_id, f's{i}.created_at': sub.created_at,
+                        f's{i}.is_active': True})
+    CodingTask._get_collection().update_one({'_id': task.pk}, {'$set': changes}, array_filters=filters)
+
+
+# ── Performance grading after /submit/ ────────────────────────────────────────
+
+_perf_executor = None
+_perf_lock = threading.Lock()
+
+
+def grade_performance(task_id: str, user_id: str) -> None:
+    """Time the user's active submission if it awaits performance grading, and store the grade."""
+    from . import verdicts
+    from .models import CodingTask
+    task = CodingTask.objects.get(id=task_id)
+    sub = next((s for s in task.submissions or []
+                if s.user_id == user_id and getattr(s, 'is_active', True) and s.performance_status == 'pending'),
+               None)
+    if sub is None:
+        return   # resubmitted, or graded by a regrade meanwhile
+    test_cases = tasks.test_cases(task)
+    if verdicts.test_cases_hash(test_cases) != sub.test_cases_hash:
+        return   # the test cases changed since; the regrade of the task times it
+    language = sub.language or task.tech_stack or 'Python'
+    performance = _performance(task, sub.code, language, test_cases)
+    fields = _graded(task, sub.run_results or [], performance, sub.late_penalty or 0.0)
+    _write_back(task, [(sub, {**fields, 'performance': performance, 'performance_status': 'graded'})])
+
+
+def _grade_performance_logged(task_id, user_id):
+    try:
+        grade_performance(task_id, user_id)
+    except Exception:
+        # Stays pending: a regrade of the task (POST /api/tasks/<id>/regrade/) retries it
+        logger.exception('performance grading of task %s for %s failed', task_id, user_id)
+
+
+def grade_performance_later(task_id: str, user_id: str) -> None:
+    """grade_performance() on a background thread, WORKERS at a time."""
+    global _perf_executor
+    with _perf_lock:
+        if _perf_executor is None:
+            _perf_executor = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix='perf-grade')
+    _perf_executor.submit(_grade_performance_logged, str(task_id), str(user_id))
+
+
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+def _now():
+    return datetime.utcnow()
+
+
+def _keep_lease(job_id, owner, stop):
+    from .models import RegradeJob
+    while not stop.wait(HEARTBEAT):
+        try:
+            if not RegradeJob.objects(id=job_id, owner=owner, status='running').update_one(
+                    set__heartbeat_at=_now()):
+                return   # superseded or taken over; the batch loop notices too
+        except Exception:
+            pass   # the lease may lapse; whoever takes over skips what is already regraded
+
+
+def _claim(job_id, owner) -> bool:
+    from mongoengine.queryset.visitor import Q
+    from .models import RegradeJob
+    now = _now()
+    lapsed = Q(status='running') & Q(heartbeat_at__lt=now - timedelta(seconds=LEASE))
+    return bool(RegradeJob.objects(Q(id=job_id) & (Q(status='queued') | lapsed)).update_one(
+        set__status='running', set__owner=owner, set__heartbeat_at=now))
+
+
+def _finish(job, owner, status, error='') -> None:
+    from .models import RegradeJob, UserNotification
+    if not RegradeJob.objects(id=job.id, owner=owner, status='running').update_one(
+            set__status=status, set__error=error, set__finished_at=_now()):
+        return
+    if status == 'superseded' or not job.requested_by:
+        return
+    job.reload()
+    try:
+        message = (f'{job.regraded} of {job.total} submission(s) for "{job.task_title}" were regraded '
+                   f'against the new test cases; {job.changed} score(s) changed.')
+        if job.failed:
+            message += f' {job.failed} could not be judged and keep their old score.'
+        if status == 'failed':
+            message = f'Regrading "{job.task_title}" stopped: {error}. ' + message
+        UserNotification(
+            user_id    = job.requested_by,
+            username   = job.requested_by_name,
+            title      = 'Regrade Finished' if status == 'done' else 'Regrade Failed',
+            message    = message,
+            notif_type = 'general',
+            task_id    = job.task_id,
+            task_title = job.task_title,
+        ).save()
+    except Exception:
+        pass
+
+
+def _work(job, owner) -> None:
+    from . import verdicts
+    from .models import CodingTask, RegradeJob
+    attempted = set()   # once per run: a failure is left for a later regrade
+    with ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix='regrade') as executor:
+        while True:
+            # Reloaded every batch: submissions change while the job runs
+            task = CodingTask.objects.get(id=job.task_id)
+            test_cases = tasks.test_cases(task)
+            if verdicts.test_cases_hash(test_cases) != job.test_cases_hash:
+                _finish(job, owner, 'superseded')   # a newer edit has its own job
+                return
+            batch = [s for s in _pending(task, job.test_cases_hash) if _key(s) not in attempted][:BATCH]
+            if not batch:
+                break
+            attempted.update(_key(s) for s in batch)
+
+            def regrade(sub):
+                try:
+                    return sub, _regrade_one(task, test_cases, job.test_cases_hash, sub), None
+                except Exception as e:
+                    return sub, None, e
+
+            updates, failed = [], 0
+            for sub, fields, error in executor.map(regrade, batch):
+                if error is not None:
+                    logger.warning('regrade %s: submission of %s failed: %s', job.id, sub.user_id, error)
+                    failed += 1
+                else:
+                    updates.append((sub, fields))
+            if updates:
+                _write_back(task, updates)
+            changed = sum(1 for sub, fields in updates
+                          if 'score' in fields and (fields['score'], fields['passed']) != (sub.score, sub.passed))
+            if not RegradeJob.objects(id=job.id, owner=owner, status='running').update_one(
+                    inc__regraded=len(updates), inc__failed=failed, inc__changed=changed,
+                    set__heartbeat_at=_now()):
+                return   # superseded or taken over
+    _finish(job, owner, 'done')
+
+
+def run_job(job_id) -> None:
+    """Work on a job until it ends; returns at once if another process holds it."""
+    from .models import RegradeJob
+    owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    if not _claim(job_id, owner):
+        return
+    job = RegradeJob.objects.get(id=job_id)
+    if job.started_at is None:
+        RegradeJob.objects(id=job_id).update_one(set__started_at=_now())
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(job_id, owner, stop),
+                     name=f'regrade-lease-{job_id}', daemon=True).start()
+    try:
+        _work(job, owner)
+    except Exception as e:
+        logger.exception('regrade %s failed', job_id)
+        _finish(job, owner, 'failed', str(e)[:500])
+    finally:
+        stop.set()
+
+
+def _spawn(job_id) -> None:
+    threading.Thread(target=run_job, args=(job_id,), name=f'regrade-{job_id}', daemon=True).start()
+
+
+def start(task, requested_by: str = '', requested_by_name: str = '', background: bool = True):
+    """
+    Regrade the active submissions of `task` that were graded against other
+    test cases, superseding any regrade of it in progress. Returns the
+    RegradeJob, or None when there is nothing to regrade.
+    """
+    from .models import RegradeJob
+    RegradeJob.objects(task_id=str(task.id), status__in=ACTIVE).update(
+        set__status='superseded', set__finished_at=_now())
+    tc_hash = test_cases_hash(task)
+    pending = _pending(task, tc_hash) if task.test_cases else []
+    if not pending:
+        return None
+    job = RegradeJob(
+        task_id=str(task.id), task_title=task.title, test_cases_hash=tc_hash,
+        requested_by=str(requested_by or ''), requested_by_name=requested_by_name or '',
+        total=len(pending),
+    ).save()
+    if background:
+        _spawn(job.id)
+    else:
+        run_job(job.id)
+        job.reload()
+    return job
+
+
+def resume(task_id: str = None) -> int:
+    """Restart the jobs nobody is running (queued, or past their lease); returns how many."""
+    from mongoengine.queryset.visitor import Q
+    from .models import RegradeJob
+    lapsed = Q(status='running') & Q(heartbeat_at__lt=_now() - timedelta(seconds=LEASE))
+    jobs = RegradeJob.objects(Q(status='queued') | lapsed)
+    if task_id:
+        jobs = jobs.filter(task_id=task_id)
+    count = 0
+    for job in jobs:
+        _spawn(job.id)
+        count += 1
+    return count
+
+
+def job_dict(job) -> dict:
+    done = job.regraded + job.failed
+    return {
+        'id':          str(job.id),
+        'task_id':     job.task_id,
+        'status':      job.status,
+        'total':       job.total,
+        'regraded':    job.regraded,
+        'failed':      job.failed,
+        'changed':     job.changed,
+        'progress':    round(min(done, job.total) / job.total * 100, 1) if job.total else 100.0,
+        'error':       job.error,
+        'created_at':  job.created_at.isoformat() if job.created_at else None,
+        'started_at':  job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -3,11 +3,42 @@ arena_api/runner.py
 Executes student code against test cases in a sandboxed subprocess.
 Supports Python, JavaScript, TypeScript, C++, Java, Go, SQL, HTML.
 """
+import contextlib
+import contextvars
+import os
 import re
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-TIMEOUT = 5  # seconds max per test case
+from . import limits, metrics
+
+TIMEOUT = limits.TIME_LIMIT  # default seconds per test case; tasks may set their own (limits.py)
+
+# Process-wide cap on concurrently running student/compiler processes.
+# Every subprocess the runner starts takes one slot, whichever request it
+# belongs to, so a burst of /run/ calls queues instead of forking the host flat.
+MAX_WORKERS = int(os.environ.get('JUDGE_MAX_WORKERS', os.cpu_count() or 2))
+# Fan test cases out across the worker pool (False → one case at a time)
+PARALLEL = os.environ.get('JUDGE_PARALLEL', 'True') == 'True'
+# Serve Python from pre-forked warm interpreters (see pypool.py); POSIX only
+PY_POOL = os.environ.get('JUDGE_PY_POOL', 'True') == 'True' and hasattr(os, 'fork')
+PY_POOL_MAX_JOBS = int(os.environ.get('JUDGE_PY_POOL_MAX_JOBS', 200))
+# Compare stdout while it streams and kill the program as soon as it has
+# diverged from the expected output or printed more than OUTPUT_LIMIT bytes
+STREAMING    = os.environ.get('JUDGE_STREAMING', 'True') == 'True'
+OUTPUT_LIMIT = int(os.environ.get('JUDGE_OUTPUT_LIMIT_KB', 1024)) * 1024
+# Run all Python/JavaScript cases of a submission in one harness process
+# (see harness.py). Opt-in: module state outside __main__ is shared by cases
+HARNESS = os.environ.get('JUDGE_HARNESS', 'False') == 'True'
+
+_slots = threading.BoundedSemaphore(MAX_WORKERS)
+# run_test_cases(cpu_time=True): every case reports its CPU time (see perf.py)
+_cpu_time = contextvars.ContextVar('judge_cpu_time', default=False)
+_pool = None
+_pool_lock = threading.Lock()
+_py_pool = None
 
 # ── helpers ────────────────────────────────────────────────────────────────────
 
@@ -21,24 +52,161 @@ def _result(passed, actual, expected, stderr=''):
 
 
 def _timeout_result(expected):
-    return _result(False, '', expected, 'Time limit exceeded (5s)')
+    message = f'Time limit exceeded ({limits.current().time_s:g}s)'
+    return {**_result(False, '', expected, message), 'stop_reason': 'timeout'}
+
+
+def _skipped_result(expected):
+    """Placeholder for a case fail_fast did not run."""
+    return {**_result(False, '', expected, 'Not run: another test case already failed.'), 'stop_reason': 'skipped'}
+
+
+def _stopped_result(reason, actual, expected, stderr=''):
+    """Result for a run the judge cut short; `reason` is a streamcmp stop reason."""
+    from . import streamcmp
+    if reason == streamcmp.TIMEOUT:
+        return _timeout_result(expected)
+    if reason == streamcmp.OUTPUT_LIMIT:
+        stderr = f'Output limit exceeded ({OUTPUT_LIMIT // 1024} KB)'
+        actual = actual[:1000]   # a preview is enough; don't ship the whole flood
+    return {**_result(False, actual.strip(), expected, stderr.strip()), 'stop_reason': reason}
+
+
+@contextlib.contextmanager
+def _slot():
+    """Hold a worker slot; the wait counts as the 'queue' phase (see metrics.py)."""
+    with metrics.phase('queue'):
+        _slots.acquire()
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+def _executor() -> ThreadPoolExecutor:
+    """Lazily create the shared pool used to fan test cases out."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='judge')
+    return _pool
+
 
+def _map_cases(fn, cases: list, parallel: bool, fail_fast: bool = False) -> list:
+    """
+    Apply fn(input_data, expected_output) to every case, keeping the original
+    order. With `fail_fast`, cases not yet started when one fails are skipped.
+    """
+    fn = metrics.timed(fn)
+    if not parallel or len(cases) < 2:
+        outcomes = []
+        for inp, exp in cases:
+            failed = fail_fast and outcomes and not outcomes[-1]['passed']
+            outcomes.append(_skipped_result(exp.strip()) if failed else fn(inp, exp))
+        return outcomes
+    # Each case runs in a copy of this context, so it sees the run's limits
+    futures = [_executor().submit(contextvars.copy_context().run, fn, inp, exp) for inp, exp in cases]
+    if fail_fast:
+        for f in as_completed(futures):
+            if not f.result()['passed']:
+                for other in futures:
+                    other.cancel()   # only those still queued; running ones finish
+                break
+    return [_skipped_result(exp.strip()) if f.cancelled() else f.result()
+            for f, (_, exp) in zip(futures, cases)]
+
+
+def _preexec(cmd):
+    """preexec_fn applying the run's limits; Java gets its memory limit as -Xmx instead."""
+    return limits.preexec(memory=os.path.basename(cmd[0]) != 'java')
+
+
+def _run_streaming(cmd, input_data, expected_output, timeout=None) -> dict:
+    """
+    _run_subprocess with streaming comparison: stdout is checked as it
+    arrives and the process group is killed on the first definite mismatch,
+    when it exceeds OUTPUT_LIMIT, or at the timeout.
+    """
+    import signal, time
+    from . import streamcmp
+    expected = expected_output.strip()
+    matcher  = streamcmp.StreamMatcher(expected, OUTPUT_LIMIT)
+    timeout  = timeout or limits.current().time_s
+    with _slot():
+        # stdin is a pipe of our own rather than proc.stdin: pump() closes the write
+        # end, and no file object may close that fd number again after it is reused
+        in_r, in_w = os.pipe()
+        try:
+            with metrics.phase('spawn'):
+                proc = subprocess.Popen(
+                    cmd, stdin=in_r, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    start_new_session=True, preexec_fn=_preexec(cmd),
+                )
+        except FileNotFoundError:
+            os.close(in_w)
+            raise  # let callers handle missing runtimes
+        except Exception as e:
+            os.close(in_w)
+            return _result(False, '', expected, str(e))
+        finally:
+            os.close(in_r)
+        deadline = time.monotonic() + timeout
+        status = usage = None
+        try:
+            with metrics.phase('execute'):
+                reason, err = streamcmp.pump(
+                    in_w, proc.stdout.fileno(), proc.stderr.fileno(),
+                    (input_data or '').encode('utf-8'), matcher, deadline, OUTPUT_LIMIT,
+                )
+                # Reaped with wait4 rather than proc.wait() to get its CPU time and peak RSS
+                while reason is None and status is None:
+                    pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+                    if not pid:
+                        status = None
+                        if time.monotonic() >= deadline:
+                            reason = streamcmp.TIMEOUT
+                        else:
+                            time.sleep(0.001)
+        finally:
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except OSError: pass
+            if status is None:
+                _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            for stream in (proc.stdout, proc.stderr):
+                stream.close()
+        metrics.note_rusage(status, usage, reason)
+
+    with metrics.phase('compare'):
+        stderr = err.decode('utf-8', 'replace')
+        if reason:
+            return _stopped_result(reason, matcher.output(), expected, stderr)
+        actual = matcher.output().strip()
+        return _result(actual == expected, actual, expected, stderr.strip())
 
-def _run_subprocess(cmd, input_data, expected_output, timeout=TIMEOUT) -> dict:
+
+def _run_subprocess(cmd, input_data, expected_output, timeout=None) -> dict:
     """Generic helper: run cmd, feed stdin, compare stdout vs expected."""
+    if STREAMING or _cpu_time.get():   # reaped with wait4, which reports CPU time
+        return _run_streaming(cmd, input_data, expected_output, timeout)
     try:
-        r = subprocess.run(
-            cmd,
-            input=input_data,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-            encoding='utf-8',
-        )
+        with _slot(), metrics.phase('execute'):
+            r = subprocess.run(
+                cmd,
+                input=input_data,
+                capture_output=True,
+                text=True,
+                timeout=timeout or limits.current().time_s,
+                encoding='utf-8',
+                preexec_fn=_preexec(cmd),
+            )
+        metrics.note_exit(r.returncode)
         actual = r.stdout.strip()
         expected = expected_output.strip()
         return _result(actual == expected, actual, expected, r.stderr.strip())
     except subprocess.TimeoutExpired:
+        metrics.note_exit(None, 'timeout')
         return _timeout_result(expected_output.strip())
     except FileNotFoundError:
         raise  # let callers handle missing runtimes
@@ -46,203 +214,849 @@ def _run_subprocess(cmd, input_data, expected_output, timeout=TIMEOUT) -> dict:
         return _result(False, '', expected_output.strip(), str(e))
 
 
-def run_python(code: str, input_data: str, expected_output: str) -> dict:
-    import tempfile, os
-    with tempfile.NamedTemporaryFile(suffix='.py', mode='w', delete=False, encoding='utf-8') as f:
-        f.write(code)
-        tmp = f.name
+def _python_pool():
+    global _py_pool
+    if _py_pool is None:
+        with _pool_lock:
+            if _py_pool is None:
+                from .pypool import PythonPool
+                _py_pool = PythonPool(size=MAX_WORKERS, max_jobs=PY_POOL_MAX_JOBS)
+    return _py_pool
+
+
+def _run_python_pooled(code: str, input_data: str, expected_output: str) -> dict:
+    """Run on a warm zygote; returns None if the pool failed and the caller should fall back."""
+    from .pypool import ZygoteError
+    expected = expected_output.strip()
     try:
-        return _run_subprocess([sys.executable, tmp], input_data, expected_output)
-    except FileNotFoundError:
-        return _result(False, '', expected_output.strip(), 'Python interpreter not found.')
-    finally:
-        try: os.unlink(tmp)
-        except Exception: pass
+        with _slot(), metrics.phase('execute'):
+            r = _python_pool().run(
+                code, input_data or '', limits.current().time_s,
+                expected=expected if STREAMING else None,
+                output_limit=OUTPUT_LIMIT if STREAMING else None,
+                memory_mb=limits.current().memory_mb,
+            )
+    except ZygoteError:
+        return None
+    metrics.note_exit(r['returncode'], r.get('stop_reason'))
+    metrics.note(cpu_ms=r.get('cpu_ms'), peak_rss_kb=r.get('peak_rss_kb'))
+    if r.get('stop_reason'):
+        return _stopped_result(r['stop_reason'], r['stdout'], expected, r['stderr'])
+    actual = r['stdout'].strip()
+    return _result(actual == expected, actual, expected, r['stderr'].strip())
+
+
+def run_python(code: str, input_data: str, expected_output: str) -> dict:
+    if PY_POOL:
+        r = _run_python_pooled(code, input_data, expected_output)
+        if r is not None:
+            return r
+    from . import workspace
+    with workspace.job_dir() as job:
+        with metrics.phase('write'):
+            src = workspace.write_source(job, 'solution.py', code)
+        try:
+            return _run_subprocess([sys.executable, src], input_data, expected_output)
+        except FileNotFoundError:
+            return _result(False, '', expected_output.strip(), 'Python interpreter not found.')
 
 
 def run_javascript(code: str, input_data: str, expected_output: str) -> dict:
-    import tempfile, os
-    with tempfile.NamedTemporaryFile(suffix='.js', mode='w', delete=False, encoding='utf-8') as f:
-        f.write(code)
-        tmp = f.name
-    try:
-        return _run_subprocess(['node', tmp], input_data, expected_output)
-    except FileNotFoundError:
-        return _result(False, '', expected_output.strip(), 'Node.js not found on server.')
-    finally:
-        try: os.unlink(tmp)
-        except Exception: pass
+    from . import workspace
+    with workspace.job_dir() as job:
+        with metrics.phase('write'):
+            src = workspace.write_source(job, 'solution.js', code)
+        try:
+            return _run_subprocess(['node', src], input_data, expected_output)
+        except FileNotFoundError:
+            return _result(False, '', expected_output.strip(), 'Node.js not found on server.')
 
 
 def run_typescript(code: str, input_data: str, expected_output: str) -> dict:
-    import tempfile, os
-    with tempfile.NamedTemporaryFile(suffix='.ts', mode='w', delete=False, encoding='utf-8') as f:
-        f.write(code)
-        tmp = f.name
-    try:
-        # Try ts-node first, then npx ts-node
-        for cmd in (['ts-node', tmp], ['npx', '--yes', 'ts-node', tmp]):
-            try:
-                return _run_subprocess(cmd, input_data, expected_output)
-            except FileNotFoundError:
-                continue
-        # Last resort: node (works for .ts files that are valid JS)
-        return _run_subprocess(['node', tmp], input_data, expected_output)
-    except FileNotFoundError:
-        return _result(False, '', expected_output.strip(), 'Node.js / ts-node not found on server.')
-    finally:
-        try: os.unlink(tmp)
-        except Exception: pass
+    from . import toolchains
+    spec = toolchains.language('typescript')
+    if spec['mode'] == 'compiled':
+        return _run_compiled('typescript', code, [(input_data, expected_output)])[0]
+    if not spec['available']:
+        return _result(False, '', expected_output.strip(), spec['missing'])
+    from . import workspace
+    with workspace.job_dir() as job:
+        with metrics.phase('write'):
+            src = workspace.write_source(job, 'solution.ts', code)
+        try:
+            # ts-node, or node itself (see toolchains._typescript)
+            return _run_subprocess(toolchains.command('typescript', src), input_data, expected_output)
+        except FileNotFoundError:
+            return _result(False, '', expected_output.strip(), spec['missing'])
 
 
-def run_cpp(code: str, input_data: str, expected_output: str) -> dict:
-    import tempfile, os, shutil
-    tmp_dir = tempfile.mkdtemp()
-    src = os.path.join(tmp_dir, 'solution.cpp')
-    exe = os.path.join(tmp_dir, 'solution')
-    try:
-        with open(src, 'w', encoding='utf-8') as f:
-            f.write(code)
+class _CompileError(Exception):
+    """Raised by a compile step; the message is reported as the stderr of every test case."""
+
+
+# Compile steps write their artifact into build_dir; the matching *_command
+# builds the argv that runs it. Keeping the two apart lets a build directory
+# be moved into the artifact cache before it is executed.
+
+def _java_class_name(code: str) -> str:
+    # Java requires filename == public class name
+    m = re.search(r'public\s+class\s+(\w+)', code)
+    return m.group(1) if m else 'Solution'
+
+
+def _compile_cpp(code: str, build_dir: str) -> None:
+    src = os.path.join(build_dir, 'solution.cpp')
+    exe = os.path.join(build_dir, 'solution')
+    with open(src, 'w', encoding='utf-8') as f:
+        f.write(code)
+    with _slot():
         cr = subprocess.run(
             ['g++', '-std=c++17', '-O2', '-o', exe, src],
             capture_output=True, text=True, timeout=15, encoding='utf-8',
         )
-        if cr.returncode != 0:
-            return _result(False, '', expected_output.strip(), 'Compilation error:\n' + cr.stderr.strip())
-        return _run_subprocess([exe], input_data, expected_output)
-    except subprocess.TimeoutExpired:
-        return _result(False, '', expected_output.strip(), 'Compilation timed out.')
-    except FileNotFoundError:
-        return _result(False, '', expected_output.strip(), 'g++ compiler not found on server.')
-    except Exception as e:
-        return _result(False, '', expected_output.strip(), str(e))
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if cr.returncode != 0:
+        raise _CompileError('Compilation error:\n' + cr.stderr.strip())
 
 
-def run_java(code: str, input_data: str, expected_output: str) -> dict:
-    import tempfile, os, shutil
-    # Java requires filename == public class name
-    m = re.search(r'public\s+class\s+(\w+)', code)
-    class_name = m.group(1) if m else 'Solution'
-    tmp_dir = tempfile.mkdtemp()
-    src = os.path.join(tmp_dir, f'{class_name}.java')
-    try:
-        with open(src, 'w', encoding='utf-8') as f:
-            f.write(code)
+def _compile_java(code: str, build_dir: str) -> None:
+    src = os.path.join(build_dir, f'{_java_class_name(code)}.java')
+    with open(src, 'w', encoding='utf-8') as f:
+        f.write(code)
+    with _slot():
         cr = subprocess.run(
             ['javac', src],
             capture_output=True, text=True, timeout=20, encoding='utf-8',
         )
-        if cr.returncode != 0:
-            return _result(False, '', expected_output.strip(), 'Compilation error:\n' + cr.stderr.strip())
-        return _run_subprocess(
-            ['java', '-cp', tmp_dir, class_name],
-            input_data, expected_output,
+    if cr.returncode != 0:
+        raise _CompileError('Compilation error:\n' + cr.stderr.strip())
+
+
+def _java_flags() -> list:
+    from .javacds import java_flags
+    return java_flags()
+
+
+def _java_heap(cmd: list) -> list:
+    """The `java` command with the run's memory limit as its heap size; cmd itself without one."""
+    memory_mb = limits.current().memory_mb
+    return [cmd[0], f'-Xmx{memory_mb}m', *cmd[1:]] if memory_mb else cmd
+
+
+def _compile_go(code: str, build_dir: str) -> None:
+    src = os.path.join(build_dir, 'main.go')
+    exe = os.path.join(build_dir, 'main')
+    with open(src, 'w', encoding='utf-8') as f:
+        f.write(code)
+    with _slot():
+        cr = subprocess.run(
+            ['go', 'build', '-o', exe, src],
+            capture_output=True, text=True, timeout=30, encoding='utf-8',
         )
+    if cr.returncode != 0:
+        raise _CompileError('Compilation error:\n' + cr.stderr.strip())
+
+
+def _compile_typescript(code: str, build_dir: str) -> None:
+    src = os.path.join(build_dir, 'solution.ts')
+    with open(src, 'w', encoding='utf-8') as f:
+        f.write(code)
+    with _slot():
+        cr = subprocess.run(
+            ['tsc', '--target', 'es2019', '--module', 'commonjs', '--outDir', build_dir, src],
+            capture_output=True, text=True, timeout=30, encoding='utf-8',
+        )
+    if cr.returncode != 0:
+        raise _CompileError('Compilation error:\n' + (cr.stdout + cr.stderr).strip())
+
+
+# lang_key → (compile step, run command, version probe, message when the toolchain is missing)
+_COMPILED = {
+    'cpp':  (_compile_cpp,  lambda code, d: [os.path.join(d, 'solution')],
+             ('g++', '--version'), 'g++ compiler not found on server.'),
+    'java': (_compile_java, lambda code, d: ['java', *_java_flags(), '-cp', d, _java_class_name(code)],
+             ('javac', '-version'), 'Java (javac/java) not found on server.'),
+    'go':   (_compile_go,   lambda code, d: [os.path.join(d, 'main')],
+             ('go', 'version'), 'Go runtime not found on server.'),
+    # Only used when tsc is installed (see toolchains._typescript); otherwise
+    # run_typescript hands the source to ts-node or node per test case
+    'typescript': (_compile_typescript, lambda code, d: ['node', os.path.join(d, 'solution.js')],
+                   ('tsc', '--version'), 'Node.js / tsc not found on server.'),
+}
+_LANG_ALIASES = {'c++': 'cpp', 'cplusplus': 'cpp', 'ts': 'typescript', 'js': 'javascript'}
+
+_COMPILE_ERROR_FILE = 'compile_error.txt'
+
+
+def _build_into(lang: str, code: str, build_dir: str) -> None:
+    """Compile into build_dir, recording a compile error as a file so it can be cached too."""
+    try:
+        with metrics.phase('compile'):   # only on a cache miss
+            _COMPILED[lang][0](code, build_dir)
+    except _CompileError as e:
+        # Report paths relative to the build dir, which may be a throwaway staging path
+        with open(os.path.join(build_dir, _COMPILE_ERROR_FILE), 'w', encoding='utf-8') as f:
+            f.write(str(e).replace(build_dir + os.sep, ''))
+
+
+def _prepare_compiled(lang: str, code: str):
+    """
+    Build `code` (or fetch it from the artifact cache) and return
+    (cmd, error, owned_dir). `error` is a message to report for every test
+    case instead of running; `owned_dir` is a workspace job directory the
+    caller must workspace.release(), or None when the artifact lives in the cache.
+    """
+    from . import build_cache, workspace
+    _, command_fn, version_cmd, missing_msg = _COMPILED[lang]
+    owned_dir = build_dir = None
+    try:
+        if build_cache.ENABLED:
+            key = build_cache.cache_key(lang, build_cache.toolchain_version(*version_cmd), code)
+            try:
+                build_dir = build_cache.get_or_build(key, lambda d: _build_into(lang, code, d))
+            except build_cache.Untrusted:
+                pass   # logged there; build in the workspace instead
+        if build_dir is None:
+            build_dir = owned_dir = workspace.acquire()
+            _build_into(lang, code, build_dir)
     except subprocess.TimeoutExpired:
-        return _result(False, '', expected_output.strip(), 'Compilation timed out.')
+        return None, 'Compilation timed out.', owned_dir
     except FileNotFoundError:
-        return _result(False, '', expected_output.strip(), 'Java (javac/java) not found on server.')
+        return None, missing_msg, owned_dir
     except Exception as e:
-        return _result(False, '', expected_output.strip(), str(e))
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None, str(e), owned_dir
 
+    error_path = os.path.join(build_dir, _COMPILE_ERROR_FILE)
+    if os.path.exists(error_path):
+        with open(error_path, encoding='utf-8') as f:
+            return None, f.read(), owned_dir
+    return command_fn(code, build_dir), None, owned_dir
 
-def run_go(code: str, input_data: str, expected_output: str) -> dict:
-    import tempfile, os, shutil
-    tmp_dir = tempfile.mkdtemp()
-    src = os.path.join(tmp_dir, 'main.go')
+
+def _run_compiled(lang: str, code: str, cases: list, parallel: bool = False,
+                  fail_fast: bool = False) -> list:
+    """
+    Compile `code` once, then run every (input_data, expected_output) pair in
+    `cases` against the same artifact. A compile failure is reported once and
+    copied into the result of every case. With the build cache enabled, a
+    source that was compiled before (successfully or not) is not rebuilt.
+    """
+    from . import workspace
+    missing_msg = _COMPILED[lang][3]
+    cmd, error, owned_dir = _prepare_compiled(lang, code)
     try:
-        with open(src, 'w', encoding='utf-8') as f:
-            f.write(code)
-        result = _run_subprocess(['go', 'run', src], input_data, expected_output)
-        return result
-    except FileNotFoundError:
-        return _result(False, '', expected_output.strip(), 'Go runtime not found on server.')
-    except Exception as e:
-        return _result(False, '', expected_output.strip(), str(e))
+        if error is not None:
+            return [_result(False, '', exp.strip(), error) for _, exp in cases]
+
+        run_cmd = _java_heap(cmd) if lang == 'java' else cmd
+
+        def execute(input_data, expected_output):
+            try:
+                return _run_subprocess(run_cmd, input_data, expected_output)
+            except FileNotFoundError:
+                return _result(False, '', expected_output.strip(), missing_msg)
+
+        return _map_cases(execute, cases, parallel, fail_fast)
     finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if owned_dir:
+            workspace.release(owned_dir)
+
+
+def run_cpp(code: str, input_data: str, expected_output: str) -> dict:
+    return _run_compiled('cpp', code, [(input_data, expected_output)])[0]
+
+
+def run_java(code: str, input_data: str, expected_output: str) -> dict:
+    return _run_compiled('java', code, [(input_data, expected_output)])[0]
+
+
+def run_go(code: str, input_data: str, expected_output: str) -> dict:
+    return _run_compiled('go', code, [(input_data, expected_output)])[0]
 
 
 def run_sql(code: str, input_data: str, expected_output: str) -> dict:
     """
     Run SQL using Python's built-in sqlite3.
-    input_data may contain setup SQL (CREATE TABLE / INSERT statements).
+    input_data may contain setup SQL (CREATE TABLE / INSERT statements); it is
+    executed once per distinct script and cloned per run (see sqlfixtures.py).
     code is the student's query (typically SELECT).
-    Output is formatted as tab-separated rows, one per line.
+    Output is formatted as tab-separated rows, one per line, and compared
+    while the rows are fetched.
     """
-    import sqlite3, io
+    import sqlite3, time
+    from . import sqlfixtures, streamcmp
+    expected = expected_output.strip()
     try:
-        conn = sqlite3.connect(':memory:')
-        cur = conn.cursor()
-        # Run setup first if provided
-        if input_data and input_data.strip():
-            conn.executescript(input_data)
-        # Run the student's query
-        cur.execute(code.strip())
-        rows = cur.fetchall()
-        if rows:
-            actual = '\n'.join('\t'.join(str(c) for c in row) for row in rows).strip()
-        else:
-            # For non-SELECT statements (INSERT/UPDATE), report rows affected
-            actual = f'{cur.rowcount} row(s) affected' if cur.rowcount >= 0 else ''
-        conn.close()
-        expected = expected_output.strip()
-        return _result(actual == expected, actual, expected)
+        with metrics.phase('spawn'):   # the fixture clone stands in for process start
+            conn = sqlfixtures.clone(input_data)
+        try:
+            # Abort the query at the time limit, like a process would be killed
+            deadline = time.monotonic() + limits.current().time_s
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+            cur = conn.cursor()
+            with metrics.phase('execute'):
+                cpu = time.thread_time()   # the query runs on this thread
+                # Run the student's query
+                cur.execute(code.strip())
+                matcher = streamcmp.StreamMatcher(expected, OUTPUT_LIMIT)
+                first = True
+                while matcher.reason is None:
+                    rows = cur.fetchmany(500)
+                    if not rows:
+                        break
+                    for row in rows:
+                        line = '\t'.join(str(c) for c in row)
+                        if not matcher.feed((line if first else '\n' + line).encode('utf-8')):
+                            break
+                        first = False
+            metrics.note(cpu_ms=round((time.thread_time() - cpu) * 1000, 3))
+            metrics.note_exit(0, matcher.reason)
+            if first and matcher.reason is None:
+                # For non-SELECT statements (INSERT/UPDATE), report rows affected
+                actual = f'{cur.rowcount} row(s) affected' if cur.rowcount >= 0 else ''
+                return _result(actual == expected, actual, expected)
+        finally:
+            conn.close()
+        if matcher.reason:
+            return _stopped_result(matcher.reason, matcher.output(), expected)
+        return _result(matcher.matched(), matcher.output().strip(), expected)
+    except sqlite3.OperationalError as e:
+        if str(e) != 'interrupted':
+            metrics.note_exit(1)
+            return _result(False, '', expected, str(e))
+        metrics.note_exit(None, 'timeout')
+        return _timeout_result(expected)
     except Exception as e:
-        return _result(False, '', expected_output.strip(), str(e))
+        metrics.note_exit(1)
+        return _result(False, '', expected, str(e))
+
+
+def _check_html(code: str, input_data: str, expected: str) -> dict:
+    """HTML: check if expected snippet is present in the submitted code."""
+    passed = expected.lower() in code.lower() if expected else True
+    return _result(
+        passed,
+        'HTML contains expected content' if passed else 'Missing expected elements',
+        expected,
+        '' if passed else f"Expected to find '{expected}' in your HTML.",
+    )
+
+
+# Per-case runners for languages without a separate compile step
+_CASE_RUNNERS = {
+    'python':     run_python,
+    'javascript': run_javascript,
+    'typescript': run_typescript,
+    'sql':        run_sql,
+    'html':       _check_html,
+}
+
+
+def _run_interpreted(code: str, language: str, lang_key: str, input_data: str, expected: str) -> dict:
+    """Run a single test case for a language without a separate compile step."""
+    run = _CASE_RUNNERS.get(lang_key)
+    if run is None:
+        return _result(False, '', expected,
+                       f'Auto-execution not supported for {language}. Ask your teacher to evaluate manually.')
+    return run(code, input_data, expected)
+
+
+_HARNESS_LANGS = ('python', 'javascript')
+
+
+def _precheck(lang_key: str, code: str, cases: list):
+    """
+    One shared error result per case if the code does not parse, else None.
+    Python is checked in-process, so always; a JavaScript check costs a node
+    process of its own and only pays off when it saves more than one.
+    """
+    from . import precheck
+    if lang_key not in precheck.LANGUAGES or (lang_key != 'python' and len(cases) < 2):
+        return None
+    with metrics.phase('precheck'):
+        error = precheck.check(lang_key, code)
+    if error is None:
+        return None
+    return [_result(False, '', exp.strip(), error) for _, exp in cases]
+
+
+def _harness_outcome(r: dict, expected_output: str) -> dict:
+    """The result _run_subprocess would give for a harness reply, stop_reason included."""
+    from . import streamcmp
+    expected = expected_output.strip()
+    reason = r.get('stop_reason')
+    if reason is None and STREAMING:
+        # Where a streamed run would have been stopped as a mismatch
+        matcher = streamcmp.StreamMatcher(expected, OUTPUT_LIMIT)
+        matcher.feed(r['stdout'].encode('utf-8'))
+        reason = matcher.reason
+    if reason:
+        outcome = _stopped_result(reason, r['stdout'], expected, r['stderr'])
+    else:
+        actual = r['stdout'].strip()
+        outcome = _result(actual == expected, actual, expected, r['stderr'].strip())
+    if metrics.active():   # the harness times each case itself
+        outcome['_timings'] = {'execute_ms': r.get('elapsed_ms', 0.0), 'exit_reason': reason or 'exited'}
+    return outcome
+
+
+def _run_harness(code: str, language: str, lang_key: str, cases: list, parallel: bool,
+                 fail_fast: bool = False, notify=None) -> list:
+    """
+    Run every case through one harness process. Cases the harness could not
+    finish (or a missing interpreter) fall back to the one-process-per-case path.
+    With `fail_fast` the harness is stopped at the first failing case.
+    `notify(i, outcome)`, if given, is called as each harness reply arrives.
+    """
+    from . import harness
+    outcomes = [None] * len(cases)
+
+    def record(i, reply):
+        outcomes[i] = _harness_outcome(reply, cases[i][1])
+        if notify is not None:
+            notify(i, outcomes[i])
+        return fail_fast and not outcomes[i]['passed']
+
+    try:
+        with _slot():
+            harness.run(lang_key, code, [inp for inp, _ in cases], limits.current().time_s, OUTPUT_LIMIT,
+                        stop=record)
+    except FileNotFoundError:
+        pass
+
+    failed = next((i for i, o in enumerate(outcomes) if o is not None and not o['passed']), None)
+    if fail_fast and failed is not None:
+        for i in range(failed + 1, len(cases)):
+            outcomes[i] = _skipped_result(cases[i][1].strip())
+    retry = [i for i, o in enumerate(outcomes) if o is None]
+    if retry:
+        redone = _map_cases(
+            lambda inp, exp: _run_interpreted(code, language, lang_key, inp, exp),
+            [cases[i] for i in retry], parallel, fail_fast,
+        )
+        for i, o in zip(retry, redone):
+            outcomes[i] = o
+    return outcomes
+
+
+def _lang_key(language: str) -> str:
+    lang_key = language.strip().lower() if language else 'python'
+    return _LANG_ALIASES.get(lang_key, lang_key)
+
+
+def _cases(test_cases: list) -> list:
+    """[(input_data, expected_output)] from the task's test-case dicts."""
+    cases = []
+    for tc in test_cases:
+        input_data = tc.get('input_data', '')
+        if input_data == "NA":
+            input_data = ""
+        cases.append((input_data, tc.get('output_data', tc.get('expected_output', ''))))
+    return cases
+
+
+def _observe(lang_key: str, call: dict, outcomes: list, timings: bool) -> None:
+    """Feed the call's timing records to metrics; keep them on the results only if asked."""
+    records = [o.pop('_timings', {}) for o in outcomes]
+    metrics.observe(lang_key, call, records)
+    if timings:
+        for o, record in zip(outcomes, records):
+            o['timings'] = record
 
 
-def run_test_cases(code: str, language: str, test_cases: list) -> dict:
+# Execution modes: which cases run, and whether the first failure ends the run
+#   full      — every case (graded submissions, regrades)
+#   visible   — only the cases students can see (practice runs); all of them
+#               if none are visible
+#   fail_fast — every case until one fails; the rest come back skipped
+#               (battles and tournaments only need all_passed)
+MODES = ('full', 'visible', 'fail_fast')
+
+
+def _plan(test_cases: list, mode: str):
+    """(indexes of the cases to run, effective mode)."""
+    if mode not in MODES:
+        raise ValueError(f'Unknown execution mode: {mode!r}')
+    if mode == 'visible':
+        visible = [i for i, tc in enumerate(test_cases) if not tc.get('is_hidden', False)]
+        if visible:
+            return visible, mode
+        mode = 'full'
+    return list(range(len(test_cases))), mode
+
+
+def _summary(test_cases: list, outcomes: list, indexes: list, mode: str) -> dict:
+    """Result dict for the cases at `indexes` of test_cases; 'index' stays 1-based in the full list."""
+    results = [
+        {'index': i + 1, 'is_hidden': test_cases[i].get('is_hidden', False), **r}
+        for i, r in zip(indexes, outcomes)
+    ]
+
+    all_passed = all(r['passed'] for r in results)
+    return {'all_passed': all_passed, 'results': results, 'mode': mode}
+
+
+def run_test_cases(code: str, language: str, test_cases: list, parallel: bool = None,
+                   harness: bool = None, timings: bool = False, mode: str = 'full',
+                   time_limit: float = None, memory_limit_mb: int = None,
+                   cpu_time: bool = False) -> dict:
     """
     Run all test cases for a piece of code.
+    Compiled languages (C++, Java, Go, and TypeScript when tsc is installed)
+    are built once, through the artifact cache, and every case runs against
+    the same artifact. With `parallel` (defaults to PARALLEL) the
+    cases run concurrently on the shared worker pool; results keep their order.
+    With `harness` (defaults to HARNESS) Python and JavaScript cases all run
+    in a single harness process instead. Python and JavaScript code that does
+    not parse fails every case with the same error, without running any (see
+    precheck.py).
+    Every call is recorded in the judge metrics (see metrics.py); with
+    `timings` the per-phase records are returned too, as 'timings' on each
+    result and, for work shared by all cases such as compiling, on the summary.
+    `mode` picks which cases run (see MODES); results only cover the cases
+    that were selected, and 'mode' reports the one actually used.
+    `time_limit` (seconds per case) and `memory_limit_mb` override the judge
+    defaults for this call (see limits.py).
+    With `cpu_time` every case runs where its CPU time can be read (its own
+    process reaped with wait4, a Python zygote child, or this thread for SQL)
+    and reports it as cpu_ms in its timings.
+    With JUDGE_DAEMON_SOCKET set the call runs in the judge daemon, or here
+    if it cannot be reached; a run the daemon fails is a judge error, flagged
+    'judge_error' (see judged.py).
     Returns:
       {
         'all_passed': bool,
         'results': [{ 'index': int, 'passed': bool, 'actual': str, 'expected': str, 'stderr': str }],
+        'mode': str,
       }
     """
-    lang_key = language.strip().lower() if language else 'python'
+    from . import judged
+    if judged.enabled():
+        _plan(test_cases, mode)   # a bad mode raises here, not in the daemon
+        try:
+            return judged.run(dict(code=code, language=language, test_cases=test_cases,
+                                   parallel=parallel, harness=harness, timings=timings, mode=mode,
+                                   time_limit=time_limit, memory_limit_mb=memory_limit_mb,
+                                   cpu_time=cpu_time))
+        except judged.DaemonUnavailable:
+            pass   # run it here
+        except judged.DaemonFailed as e:
+            from .judge_queue import error_result
+            return error_result(test_cases, f'Judge error: {e}', mode)
 
-    results = []
-    for i, tc in enumerate(test_cases):
-        input_data = tc.get('input_data', '')
-        if input_data == "NA":
-            input_data = ""
-            
-        expected   = tc.get('output_data', tc.get('expected_output', ''))
-
-        if lang_key == 'python':
-            r = run_python(code, input_data, expected)
-        elif lang_key in ('javascript', 'js'):
-            r = run_javascript(code, input_data, expected)
-        elif lang_key in ('typescript', 'ts'):
-            r = run_typescript(code, input_data, expected)
-        elif lang_key in ('c++', 'cpp', 'cplusplus'):
-            r = run_cpp(code, input_data, expected)
-        elif lang_key == 'java':
-            r = run_java(code, input_data, expected)
-        elif lang_key == 'go':
-            r = run_go(code, input_data, expected)
-        elif lang_key == 'sql':
-            r = run_sql(code, input_data, expected)
-        elif lang_key == 'html':
-            # HTML: check if expected snippet is present in the submitted code
-            passed = expected.lower() in code.lower() if expected else True
-            r = _result(
-                passed,
-                'HTML contains expected content' if passed else 'Missing expected elements',
-                expected,
-                '' if passed else f"Expected to find '{expected}' in your HTML.",
+    lang_key = _lang_key(language)
+    indexes, mode = _plan(test_cases, mode)
+    cases     = _cases([test_cases[i] for i in indexes])
+    fail_fast = mode == 'fail_fast'
+
+    if parallel is None:
+        parallel = PARALLEL
+    if harness is None:
+        harness = HARNESS
+
+    from . import toolchains
+    spec = toolchains.language(lang_key)   # None: no toolchain, see _run_interpreted
+    call = {}
+    cpu_token = _cpu_time.set(cpu_time)
+    try:
+        with limits.applied(limits.resolve(time_limit, memory_limit_mb)), metrics.recording(call):
+            rejected = _precheck(lang_key, code, cases) if spec is not None and spec['available'] else None
+            if spec is not None and not spec['available']:
+                outcomes = [_result(False, '', exp.strip(), spec['missing']) for _, exp in cases]
+            elif rejected is not None:
+                outcomes = rejected
+            # Compiled languages: build one artifact and run every case against it
+            elif spec is not None and spec['mode'] == 'compiled':
+                outcomes = _run_compiled(lang_key, code, cases, parallel, fail_fast)
+            elif harness and lang_key in _HARNESS_LANGS and len(cases) > 1:
+                outcomes = _run_harness(code, language, lang_key, cases, parallel, fail_fast)
+            else:
+                outcomes = _map_cases(
+                    lambda inp, exp: _run_interpreted(code, language, lang_key, inp, exp),
+                    cases, parallel, fail_fast,
+                )
+    finally:
+        _cpu_time.reset(cpu_token)
+
+    _observe(lang_key, call, outcomes, timings)
+    summary = _summary(test_cases, outcomes, indexes, mode)
+    if timings:
+        summary['timings'] = call
+    return summary
+
+
+# ── asyncio API ───────────────────────────────────────────────────────────────
+# Used by the WebSocket consumers: student processes are awaited on the event
+# loop instead of parking a thread (in particular the thread-sensitive executor
+# that channels' database_sync_to_async helpers share) for the whole run.
+
+# Source file names for interpreted languages; the command comes from toolchains
+_SOURCE_NAMES = {'python': 'solution.py', 'javascript': 'solution.js', 'typescript': 'solution.ts'}
+
+
+async def _acquire_slot() -> None:
+    """Take a worker slot without blocking the event loop."""
+    import asyncio
+    with metrics.phase('queue'):
+        while not _slots.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+
+
+async def _run_subprocess_async(cmd, input_data, expected_output, timeout=None) -> dict:
+    """Async twin of _run_subprocess; the timeout is enforced by the event loop."""
+    import asyncio, signal
+    from . import streamcmp
+    expected = expected_output.strip()
+    matcher  = streamcmp.StreamMatcher(expected if STREAMING else None,
+                                       OUTPUT_LIMIT if STREAMING else float('inf'))
+    timeout  = timeout or limits.current().time_s
+    await _acquire_slot()
+    try:
+        with metrics.phase('spawn'):
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+                preexec_fn=_preexec(cmd),
             )
-        else:
-            r = _result(False, '', expected,
-                        f'Auto-execution not supported for {language}. Ask your teacher to evaluate manually.')
 
-        results.append({'index': i + 1, 'is_hidden': tc.get('is_hidden', False), **r})
+        async def feed_stdin():
+            try:
+                proc.stdin.write((input_data or '').encode('utf-8'))
+                await proc.stdin.drain()
+                proc.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the program stopped reading stdin
 
-    all_passed = all(r['passed'] for r in results)
-    return {'all_passed': all_passed, 'results': results}
+        async def read_stdout():
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if not chunk:
+                    return None
+                if not matcher.feed(chunk):
+                    return matcher.reason
+
+        async def read_stderr():
+            err = b''
+            while True:
+                chunk = await proc.stderr.read(65536)
+                if not chunk:
+                    return err
+                if len(err) < OUTPUT_LIMIT:
+                    err += chunk
+
+        stdin_task  = asyncio.ensure_future(feed_stdin())
+        stderr_task = asyncio.ensure_future(read_stderr())
+        deadline = asyncio.get_running_loop().time() + timeout
+        try:
+            with metrics.phase('execute'):
+                reason = await asyncio.wait_for(read_stdout(), timeout)
+                if reason is None:
+                    await asyncio.wait_for(proc.wait(), max(0.0, deadline - asyncio.get_running_loop().time()))
+        except asyncio.TimeoutError:
+            reason = streamcmp.TIMEOUT
+        finally:
+            stdin_task.cancel()
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except OSError: pass
+            await proc.wait()
+        # The event loop reaps the child, so there is no rusage on this path
+        metrics.note_exit(proc.returncode, reason)
+        err = await stderr_task
+        with metrics.phase('compare'):
+            stderr = (err or b'').decode('utf-8', 'replace')
+            if reason:
+                return _stopped_result(reason, matcher.output(), expected, stderr)
+            actual = matcher.output().strip()
+            return _result(actual == expected, actual, expected, stderr.strip())
+    except FileNotFoundError:
+        raise  # let callers handle missing runtimes
+    except Exception as e:
+        return _result(False, '', expected, str(e))
+    finally:
+        _slots.release()
+
+
+async def _map_cases_async(fn, cases: list, parallel: bool, fail_fast: bool = False,
+                           notify=None) -> list:
+    """
+    Async _map_cases; with `fail_fast` cases still running at the first failure
+    are cancelled too. `notify(i, outcome)`, if given, is called as each case
+    finishes.
+    """
+    import asyncio
+    timed = metrics.timed_async(fn)
+
+    async def one(i, inp, exp):
+        outcome = await timed(inp, exp)
+        if notify is not None:
+            notify(i, outcome)
+        return outcome
+
+    if not parallel or len(cases) < 2:
+        outcomes = []
+        for i, (inp, exp) in enumerate(cases):
+            failed = fail_fast and outcomes and not outcomes[-1]['passed']
+            outcomes.append(_skipped_result(exp.strip()) if failed else await one(i, inp, exp))
+        return outcomes
+    if not fail_fast:
+        return list(await asyncio.gather(*(one(i, inp, exp) for i, (inp, exp) in enumerate(cases))))
+    tasks = [asyncio.ensure_future(one(i, inp, exp)) for i, (inp, exp) in enumerate(cases)]
+    try:
+        for done in asyncio.as_completed(tasks):
+            if not (await done)['passed']:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()   # kills the process of a case that is still running
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return [_skipped_result(exp.strip()) if task.cancelled() else task.result()
+            for task, (_, exp) in zip(tasks, cases)]
+
+
+async def run_test_cases_async(code: str, language: str, test_cases: list, parallel: bool = None,
+                               harness: bool = None, timings: bool = False, mode: str = 'full',
+                               time_limit: float = None, memory_limit_mb: int = None,
+                               on_result=None) -> dict:
+    """
+    Awaitable version of run_test_cases with the same result shape.
+    Compilation (usually an artifact-cache hit) runs in a worker thread; every
+    test case runs via asyncio.create_subprocess_exec.
+    With `on_result`, each entry of 'results' is also passed to
+    on_result(entry), on the event loop, as soon as that case has finished:
+    in completion order, not case order. Cases that finish together (a
+    compile error, skipped cases) are reported just before the call returns.
+    Cancelling the call kills the processes of the cases still running.
+    Like run_test_cases, the call goes to the judge daemon when one is set up.
+    """
+    import asyncio
+    from . import judged
+    if judged.enabled():
+        _plan(test_cases, mode)   # a bad mode raises here, not in the daemon
+        streamed = set()
+
+        def forward(entry):
+            streamed.add(entry['index'])
+            on_result(entry)
+
+        try:
+            return await judged.run_async(
+                dict(code=code, language=language, test_cases=test_cases, parallel=parallel,
+                     harness=harness, timings=timings, mode=mode,
+                     time_limit=time_limit, memory_limit_mb=memory_limit_mb),
+                forward if on_result is not None else None)
+        except judged.DaemonUnavailable:
+            pass   # run it here
+        except judged.DaemonFailed as e:
+            from .judge_queue import error_result
+            result = error_result(test_cases, f'Judge error: {e}', mode)
+            if on_result is not None:
+                for entry in result['results']:
+                    if entry['index'] not in streamed:   # don't report a case twice
+                        on_result(entry)
+            return result
+
+    lang_key = _lang_key(language)
+    indexes, mode = _plan(test_cases, mode)
+    cases = _cases([test_cases[i] for i in indexes])
+    if parallel is None:
+        parallel = PARALLEL
+    if harness is None:
+        harness = HARNESS
+
+    notify = None
+    if on_result is not None:
+        loop = asyncio.get_running_loop()
+        reported = set()
+
+        def report(pos, outcome):
+            if pos not in reported:
+                reported.add(pos)
+                entry = {k: v for k, v in outcome.items() if k != '_timings'}
+                on_result(_summary(test_cases, [entry], [indexes[pos]], mode)['results'][0])
+
+        def notify(pos, outcome):   # also called from worker threads
+            loop.call_soon_threadsafe(report, pos, outcome)
+
+    call = {}
+    with limits.applied(limits.resolve(time_limit, memory_limit_mb)), metrics.recording(call):
+        outcomes = await _dispatch_async(code, language, lang_key, cases, parallel, harness,
+                                         mode == 'fail_fast', notify)
+    if on_result is not None:
+        for pos, outcome in enumerate(outcomes):
+            report(pos, outcome)
+    _observe(lang_key, call, outcomes, timings)
+    summary = _summary(test_cases, outcomes, indexes, mode)
+    if timings:
+        summary['timings'] = call
+    return summary
+
+
+async def _dispatch_async(code: str, language: str, lang_key: str, cases: list, parallel: bool,
+                          harness: bool, fail_fast: bool, notify=None) -> list:
+    """Outcomes for run_test_cases_async, in case order."""
+    import asyncio
+    from . import toolchains, workspace
+    spec = toolchains.language(lang_key)
+    rejected = None
+    if spec is not None and spec['available']:
+        rejected = await asyncio.to_thread(_precheck, lang_key, code, cases)
+    if spec is not None and not spec['available']:
+        outcomes = [_result(False, '', exp.strip(), spec['missing']) for _, exp in cases]
+
+    elif rejected is not None:
+        outcomes = rejected
+
+    elif harness and lang_key in _HARNESS_LANGS and len(cases) > 1:
+        outcomes = await asyncio.to_thread(_run_harness, code, language, lang_key, cases, parallel,
+                                           fail_fast, notify)
+
+    elif spec is not None and spec['mode'] == 'compiled':
+        missing_msg = _COMPILED[lang_key][3]
+        cmd, error, owned_dir = await asyncio.to_thread(_prepare_compiled, lang_key, code)
+        try:
+            if error is not None:
+                outcomes = [_result(False, '', exp.strip(), error) for _, exp in cases]
+            else:
+                run_cmd = _java_heap(cmd) if lang_key == 'java' else cmd
+
+                async def execute(input_data, expected_output):
+                    try:
+                        return await _run_subprocess_async(run_cmd, input_data, expected_output)
+                    except FileNotFoundError:
+                        return _result(False, '', expected_output.strip(), missing_msg)
+
+                outcomes = await _map_cases_async(execute, cases, parallel, fail_fast, notify)
+        finally:
+            if owned_dir:
+                workspace.release(owned_dir)
+
+    elif spec is not None and spec['mode'] == 'interpreted':
+        job = workspace.acquire()
+        try:
+            with metrics.phase('write'):
+                src = workspace.write_source(job, _SOURCE_NAMES[lang_key], code)
+            cmd = toolchains.command(lang_key, src)
+
+            async def execute(input_data, expected_output):
+                try:
+                    return await _run_subprocess_async(cmd, input_data, expected_output)
+                except FileNotFoundError:
+                    return _result(False, '', expected_output.strip(), spec['missing'])
+
+            outcomes = await _map_cases_async(execute, cases, parallel, fail_fast, notify)
+        finally:
+            workspace.release(job)
+
+    elif lang_key == 'sql':
+        outcomes = await _map_cases_async(
+            lambda inp, exp: asyncio.to_thread(run_sql, code, inp, exp), cases, False, fail_fast, notify,
+        )
+
+    else:
+        outcomes = _map_cases(
+            lambda inp, exp: _run_interpreted(code, language, lang_key, inp, exp), cases, False, fail_fast,
+        )
+
+    return outcomes
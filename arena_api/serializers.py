@@ -7,6 +7,7 @@ class TestCaseSerializer(serializers.Serializer):
     input_data  = serializers.CharField()
     output_data = serializers.CharField()
     is_hidden   = serializers.BooleanField(default=False)
+    is_benchmark = serializers.BooleanField(default=False)
 
 
 class SubmissionSerializer(serializers.Serializer):
@@ -24,6 +25,8 @@ class SubmissionSerializer(serializers.Serializer):
     status         = serializers.ChoiceField(choices=['Submitted', 'Unsubmitted'], default='Submitted')
     review_status  = serializers.ChoiceField(choices=['pending', 'graded'], default='graded')
     run_results    = serializers.ListField(child=serializers.DictField(), default=[])
+    performance        = serializers.DictField(read_only=True, allow_null=True)
+    performance_status = serializers.CharField(read_only=True)
     last_edited_at = serializers.DateTimeField(read_only=True)
     created_at     = serializers.DateTimeField(read_only=True)
 
@@ -47,11 +50,19 @@ class CodingTaskSerializer(serializers.Serializer):
     linked_lab    = serializers.IntegerField(default=0)
     hints         = serializers.ListField(child=serializers.CharField(), default=[])
     grading_mode  = serializers.ChoiceField(choices=["Percentage", "Marks", "Grade"], default="Percentage")
-    grading_type  = serializers.ChoiceField(choices=["auto", "manual"], default="auto")
+    grading_type  = serializers.ChoiceField(choices=["auto", "manual", "performance"], default="auto")
     allow_tab_completion = serializers.BooleanField(default=True)
     max_marks     = serializers.FloatField(default=100.0)
     pass_criteria = serializers.FloatField(default=50.0)
     allow_copy_paste = serializers.BooleanField(default=True)
+    time_limit_ms   = serializers.IntegerField(default=0, min_value=0)
+    memory_limit_mb = serializers.IntegerField(default=0, min_value=0)
+    language_limits = serializers.DictField(child=serializers.DictField(child=serializers.IntegerField(min_value=0)),
+                                            default={})
+    reference_code     = serializers.CharField(default="", allow_blank=True, write_only=True)
+    reference_language = serializers.CharField(default="", allow_blank=True)
+    perf_runs          = serializers.IntegerField(default=5, min_value=1, max_value=20)
+    perf_tolerance     = serializers.FloatField(default=1.5, min_value=1.0)
     created_at    = serializers.DateTimeField(read_only=True)
     classroom_name = serializers.SerializerMethodField()
     classroom_type = serializers.SerializerMethodField()
@@ -82,13 +93,24 @@ class CodingTaskSerializer(serializers.Serializer):
         return task
 
     def update(self, instance, validated_data):
+        from . import regrade
         test_cases_data = validated_data.pop('test_cases', None)
         validated_data.pop('submissions', None)
+        previous_cases = regrade.test_cases_hash(instance)
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         if test_cases_data is not None:
             instance.test_cases = [TestCase(**tc) for tc in test_cases_data]
         instance.save()
+        # Existing submissions were graded against the old cases: regrade them in the background
+        if regrade.test_cases_hash(instance) != previous_cases:
+            request = self.context.get('request')
+            user = getattr(request, 'user', None)
+            try:
+                regrade.start(instance, requested_by=getattr(user, 'id', ''),
+                              requested_by_name=getattr(user, 'username', ''))
+            except Exception:
+                regrade.logger.exception('regrade of task %s could not be started', instance.id)
         return instance
 
 
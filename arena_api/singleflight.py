@@ -0,0 +1,178 @@
+"""
+arena_api/singleflight.py
+Coalescing of identical judge requests that are in flight at the same time.
+
+A double-click or a frontend retry sends the same code twice within
+milliseconds. do(key, fn) runs fn() once per key at a time: callers that
+arrive while it runs wait for it and get the same result.
+
+Within a process the waiters share one call. With REDIS_URL set, the first
+process to take the key's lock (SET NX, kept alive by a heartbeat while fn
+runs) executes it and publishes the result on a pub/sub channel; the other
+processes subscribe and wait. If the executing caller fails, or its process
+dies and the lock expires, the waiters run fn() themselves, so an error is
+never shared and nobody waits on a dead worker. Without Redis (or when it is
+unreachable) only callers in the same process are coalesced.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+ENABLED     = os.environ.get('JUDGE_SINGLEFLIGHT', 'True') == 'True'
+REDIS_URL   = os.environ.get('REDIS_URL', '')
+# Longest a caller waits on another worker's execution before running it itself
+WAIT_SECONDS = float(os.environ.get('JUDGE_SINGLEFLIGHT_WAIT', 150))
+LOCK_TTL_MS  = 15000   # lock lifetime without a heartbeat
+HEARTBEAT    = 5       # seconds between lock refreshes
+RESULT_TTL   = 5       # the published result also sits in a key for late subscribers
+
+_lock  = threading.Lock()
+_calls = {}
+_counts = {'executed': 0, 'coalesced': 0, 'coalesced_remote': 0}
+_redis = None
+
+# Delete the lock only if it is still ours
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.done   = threading.Event()
+        self.ok     = False
+        self.result = None
+
+
+def _count(name):
+    with _lock:
+        _counts[name] += 1
+
+
+def _client():
+    """Redis client, or None without REDIS_URL or the redis package."""
+    global _redis
+    if _redis is None:
+        try:
+            import redis as redis_lib
+            _redis = redis_lib.from_url(REDIS_URL, socket_connect_timeout=1) if REDIS_URL else False
+        except ImportError:
+            _redis = False
+    return _redis or None
+
+
+# ── Across workers (Redis) ────────────────────────────────────────────────────
+
+def _lead(r, key, token, fn):
+    """Run fn() holding the lock, then publish its result to the other workers."""
+    lock = f'judge:sf:{key}:lock'
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT):
+            try:
+                r.pexpire(lock, LOCK_TTL_MS)
+            except Exception:
+                return
+
+    threading.Thread(target=heartbeat, name='judge-singleflight', daemon=True).start()
+    try:
+        result = fn()
+        try:
+            payload = json.dumps(result)
+            pipe = r.pipeline()
+            pipe.set(f'judge:sf:{key}:result', payload, ex=RESULT_TTL)
+            pipe.publish(f'judge:sf:{key}', payload)
+            pipe.execute()
+        except Exception:
+            pass   # the waiters time out on the lock and run it themselves
+        return result
+    finally:
+        stop.set()
+        try:
+            r.eval(_RELEASE, 1, lock, token)
+        except Exception:
+            pass
+
+
+def _follow(r, key, deadline):
+    """Wait for another worker's result; None if it gave up, died or took too long."""
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(f'judge:sf:{key}')
+        # Subscribed first, so a result published from here on is not missed
+        while time.monotonic() < deadline:
+            stored = r.get(f'judge:sf:{key}:result')
+            if stored is not None:
+                return json.loads(stored)
+            message = pubsub.get_message(timeout=0.5)
+            if message is not None:
+                return json.loads(message['data'])
+            if not r.exists(f'judge:sf:{key}:lock'):
+                stored = r.get(f'judge:sf:{key}:result')
+                return json.loads(stored) if stored is not None else None
+        return None
+    finally:
+        pubsub.close()
+
+
+def _across_workers(key, fn):
+    r = _client()
+    if r is None:
+        return fn()
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            leader = r.set(f'judge:sf:{key}:lock', token, nx=True, px=LOCK_TTL_MS)
+            if not leader:
+                result = _follow(r, key, deadline)
+        except Exception:
+            break   # Redis unreachable: just run it
+        if leader:
+            return _lead(r, key, token, fn)
+        if result is not None:
+            _count('coalesced_remote')
+            return result
+    return fn()
+
+
+# ── API ───────────────────────────────────────────────────────────────────────
+
+def do(key: str, fn):
+    """Return fn(), sharing one execution among concurrent callers with the same key."""
+    if not ENABLED:
+        return fn()
+    while True:
+        with _lock:
+            call = _calls.get(key)
+            leader = call is None
+            if leader:
+                call = _calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.ok:
+                _count('coalesced')
+                return call.result
+            continue   # the call failed: run it ourselves (or join whoever does)
+
+        def run():
+            _count('executed')
+            return fn()
+
+        try:
+            call.result = _across_workers(key, run)
+            call.ok = True
+            return call.result
+        finally:
+            with _lock:
+                del _calls[key]
+            call.done.set()
+
+
+def stats() -> dict:
+    with _lock:
+        return {'enabled': ENABLED, 'in_flight': len(_calls), 'shared': _client() is not None, **_counts}
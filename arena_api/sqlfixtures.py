@@ -0,0 +1,82 @@
+"""
+arena_api/sqlfixtures.py
+Snapshot-and-clone fixtures for SQL test cases.
+
+A SQL case's input_data is a setup script (CREATE TABLE / INSERT ...). Rather
+than replaying it for every case of every run, it is executed once into an
+in-memory database kept in a bounded LRU keyed by the script's hash. Each run
+gets its own copy through the SQLite backup API, so the student's query can
+never change the cached fixture.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+MAX_FIXTURES = int(os.environ.get('JUDGE_SQL_FIXTURES', 32))
+
+_fixtures = OrderedDict()   # sha256(setup) → (connection, lock)
+_lock     = threading.Lock()
+_counts   = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _build(setup: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    try:
+        conn.executescript(setup)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def clone(setup: str) -> sqlite3.Connection:
+    """
+    A fresh in-memory database holding the result of `setup`. Raises the
+    sqlite3 error if the setup script itself fails (nothing is cached then).
+    """
+    conn = sqlite3.connect(':memory:')
+    if not setup or not setup.strip():
+        return conn
+    if MAX_FIXTURES <= 0:
+        conn.executescript(setup)
+        return conn
+
+    key = hashlib.sha256(setup.encode('utf-8')).hexdigest()
+    with _lock:
+        entry = _fixtures.get(key)
+        if entry is not None:
+            _fixtures.move_to_end(key)
+            _counts['hits'] += 1
+    if entry is None:
+        fixture = _build(setup)
+        with _lock:
+            _counts['misses'] += 1
+            entry = _fixtures.get(key)
+            if entry is None:   # another thread may have built it meanwhile
+                entry = _fixtures[key] = (fixture, threading.Lock())
+            else:
+                fixture.close()
+            while len(_fixtures) > MAX_FIXTURES:
+                # Not closed here: another thread may still be cloning it
+                _fixtures.popitem(last=False)
+                _counts['evictions'] += 1
+
+    fixture, fixture_lock = entry
+    with fixture_lock:   # a connection must not be used from two threads at once
+        fixture.backup(conn)
+    return conn
+
+
+def stats() -> dict:
+    with _lock:
+        counts = dict(_counts)
+        entries = len(_fixtures)
+    lookups = counts['hits'] + counts['misses']
+    return {
+        'entries':     entries,
+        'max_entries': MAX_FIXTURES,
+        'hit_rate':    round(counts['hits'] / lookups, 3) if lookups else 0.0,
+        **counts,
+    }
@@ -0,0 +1,138 @@
+"""
+arena_api/streamcmp.py
+Streaming stdout comparison for the judge.
+
+Instead of buffering a program's whole output and comparing after it exits,
+the runner feeds stdout to a StreamMatcher chunk by chunk. The judge compares
+`actual.strip() == expected.strip()`, so as soon as the stream contains a
+character that can no longer be stripped away to reach the expected text the
+run is a definite failure and the process can be killed.
+
+Dependency-free on purpose: pypool.py's zygote imports it by path.
+"""
+import codecs
+import os
+import selectors
+import time
+
+# Why a run was stopped early (recorded on the result as 'stop_reason')
+TIMEOUT      = 'timeout'
+MISMATCH     = 'mismatch'
+OUTPUT_LIMIT = 'output_limit'
+
+
+class StreamMatcher:
+    """
+    Incremental check of stdout against `expected` under strip() equality.
+    With expected=None it only enforces the byte limit.
+    """
+
+    def __init__(self, expected, limit):
+        self.expected = expected.strip() if expected is not None else None
+        self.limit    = limit
+        self.size     = 0
+        self.reason   = None
+        self._chunks  = []
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._started = False   # seen the first non-whitespace character
+        self._pos     = 0       # characters of `expected` matched so far
+
+    def feed(self, data: bytes) -> bool:
+        """Consume a chunk; returns False once the run should be stopped."""
+        self.size += len(data)
+        if self.size > self.limit:
+            self.reason = OUTPUT_LIMIT
+            return False
+        text = self._decoder.decode(data)
+        self._chunks.append(text)
+        if self.expected is not None and not self._consistent(text):
+            self.reason = MISMATCH
+            return False
+        return True
+
+    def _consistent(self, text: str) -> bool:
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return True
+            self._started = True
+        exp = self.expected
+        n = min(len(text), len(exp) - self._pos)
+        if text[:n] != exp[self._pos:self._pos + n]:
+            return False
+        self._pos += n
+        # Past the end of `expected` only trailing whitespace can still be stripped
+        rest = text[n:]
+        return not rest or rest.isspace()
+
+    def matched(self) -> bool:
+        """True if everything fed so far equals `expected` under strip()."""
+        return self.reason is None and self.expected is not None and self._pos == len(self.expected)
+
+    def output(self) -> str:
+        return ''.join(self._chunks) + self._decoder.decode(b'', final=True)
+
+
+def pump(stdin_fd, stdout_fd, stderr_fd, data: bytes, matcher: StreamMatcher, deadline: float, err_cap: int):
+    """
+    Write `data` to stdin_fd and drain stdout/stderr until both streams close,
+    the matcher asks to stop, or `deadline` (time.monotonic) passes.
+    Returns (reason, stderr_bytes); reason is None when the streams closed
+    normally. stdin_fd is always closed, so it must be a bare fd that nothing
+    else will close (not the fileno() of a file object); the caller owns the
+    other two.
+    """
+    os.set_blocking(stdin_fd, False)
+    # A selector rather than select.select, which refuses fds >= FD_SETSIZE (1024)
+    sel = selectors.DefaultSelector()
+    writing = bool(data)
+    if writing:
+        sel.register(stdin_fd, selectors.EVENT_WRITE)
+    else:
+        os.close(stdin_fd)
+    sel.register(stdout_fd, selectors.EVENT_READ)
+    sel.register(stderr_fd, selectors.EVENT_READ)
+    readers = 2
+    err = []
+    err_size = 0
+    reason = None
+
+    try:
+        while readers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                reason = TIMEOUT
+                break
+            for key, _ in sel.select(remaining):
+                fd = key.fd
+                if fd == stdin_fd:
+                    try:
+                        n = os.write(stdin_fd, data[:65536])
+                        data = data[n:]
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        data = b''   # the program stopped reading stdin
+                    if not data:
+                        sel.unregister(stdin_fd)
+                        os.close(stdin_fd)
+                        writing = False
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    sel.unregister(fd)
+                    readers -= 1
+                elif fd == stdout_fd:
+                    if not matcher.feed(chunk):
+                        reason = matcher.reason
+                else:
+                    err_size += len(chunk)
+                    if err_size <= err_cap:
+                        err.append(chunk)
+            if reason:
+                break
+    finally:
+        sel.close()
+        if writing:
+            os.close(stdin_fd)
+    return reason, b''.join(err)
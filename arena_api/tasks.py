@@ -0,0 +1,30 @@
+"""
+arena_api/tasks.py
+What the judge needs to know about a CodingTask, shared by the views, the
+consumers and the regrade workers.
+"""
+from .models import Exam, ExamSubmission
+
+
+def test_cases(task) -> list:
+    """Test cases of a CodingTask in the dict form the runner expects."""
+    return [
+        {'input_data': tc.input_data, 'output_data': tc.output_data, 'is_hidden': tc.is_hidden,
+         'is_benchmark': getattr(tc, 'is_benchmark', False)}
+        for tc in (task.test_cases or [])
+    ]
+
+
+def judge_priority(user_id, task_id, default: str) -> str:
+    """Judge queue class for this request: 'exam' while the task is part of the user's running exam."""
+    from . import judge_queue
+    if not judge_queue.QUEUE:
+        return default   # priority only matters when jobs are queued
+    try:
+        for sub in ExamSubmission.objects.filter(student_id=user_id, status='in_progress'):
+            exam = Exam.objects.get(id=sub.exam_id)
+            if any(task_id in s.question_ids for s in (exam.sets or [])):
+                return 'exam'
+    except Exception:
+        pass
+    return default
@@ -1,3 +1,1344 @@
-from django.test import TestCase
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+try:
+    import mongomock   # only for the regrade lease tests
+except ImportError:
+    mongomock = None
+
+from . import (build_cache, javacds, judge_queue, judged, limits, regrade, runner, singleflight,
+               verdicts, workspace)
+
+
+# ── Runner ────────────────────────────────────────────────────────────────────
+
+UPPER = 'import sys\nprint(sys.stdin.read().upper())'
+
+
+class StreamingRunTests(SimpleTestCase):
+
+    def test_concurrent_runs_keep_their_own_pipes(self):
+        # pump() closes the stdin write end; it used to be proc.stdin's fd too,
+        # which closed again later, possibly after another run had reused it
+        failures = []
+
+        def work(n):
+            for i in range(15):
+                text = f'case {n}-{i}'
+                r = runner._run_streaming([sys.executable, '-c', UPPER], text, text.upper())
+                if not r['passed']:
+                    failures.append(r)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            threads = [threading.Thread(target=work, args=(n,)) for n in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            gc.collect()
+        self.assertEqual(failures, [])
+        self.assertEqual([str(w.message) for w in caught if issubclass(w.category, ResourceWarning)], [])
+
+    def test_stdin_larger_than_the_pipe_buffer(self):
+        text = 'x' * 300_000
+        r = runner._run_streaming([sys.executable, '-c', UPPER], text, text.upper())
+        self.assertTrue(r['passed'])
+
+    def test_descriptors_past_fd_setsize(self):
+        # select.select raises ValueError for any fd >= 1024, which a busy daemon reaches
+        import resource
+        from . import harness, pypool
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1100:
+            self.skipTest('the open-file limit is below 1100')
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1100), hard))
+        self.addCleanup(resource.setrlimit, resource.RLIMIT_NOFILE, (soft, hard))
+        filler = []
+        self.addCleanup(lambda: [os.close(fd) for fd in filler])
+        while not filler or filler[-1] < 1024:
+            filler.append(os.open(os.devnull, os.O_RDONLY))
+
+        r = runner._run_streaming([sys.executable, '-c', UPPER], 'abc', 'ABC')
+        self.assertTrue(r['passed'])
+        replies = harness.run('python', 'print(int(input()) * 2)', ['1', '2'], 5, 1 << 20)
+        self.assertEqual([reply['stdout'].strip() for reply in replies], ['2', '4'])
+        pool = pypool.PythonPool(size=1, max_jobs=10)
+        self.addCleanup(pool.close)
+        self.assertEqual(pool.run('print(input())', 'hi', 5)['stdout'].strip(), 'hi')
+
+
+class HarnessTests(SimpleTestCase):
+
+    CASES = [{'input_data': '1', 'output_data': '2'},
+             {'input_data': 'secret', 'output_data': 'x'},
+             {'input_data': '3', 'output_data': '6'}]
+
+    def run_both(self, code, language='Python', cases=CASES):
+        return [runner.run_test_cases(code, language, cases, harness=harness, parallel=False)['results']
+                for harness in (True, False)]
+
+    def test_results_match_one_process_per_case(self):
+        for code in ('print(int(input()) * 2)', 'print(int(input()) * 3)', 'print(input(', 'raise SystemExit(3)'):
+            with self.subTest(code=code):
+                harnessed, isolated = self.run_both(code)
+                self.assertEqual(harnessed, isolated)
+
+    def test_a_case_sees_only_its_own_files(self):
+        code = "import os\nprint(sorted(os.listdir('.')))\nopen('leak', 'w').write(input())"
+        results = runner.run_test_cases(code, 'Python', self.CASES, harness=True)['results']
+        self.assertEqual({r['actual'] for r in results}, {"['err', 'in', 'out']"})
+
+    @skipUnless(shutil.which('node'), 'node is not installed')
+    def test_a_javascript_case_sees_no_files(self):
+        code = ("const fs = require('fs');\nconsole.log(JSON.stringify(fs.readdirSync('.')));\n"
+                "fs.writeFileSync('leak', fs.readFileSync(0, 'utf8'));\n")
+        results = runner.run_test_cases(code, 'JavaScript', self.CASES, harness=True)['results']
+        self.assertEqual({r['actual'] for r in results}, {'[]'})
+
+
+DOUBLE = 'print(int(input()) * 2)'
+
+
+def _cases(*specs):
+    """Test-case dicts from (input, expected output, hidden) triples."""
+    return [{'input_data': i, 'output_data': o, 'is_hidden': h} for i, o, h in specs]
+
+
+class ExecutionModeTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '5', False), ('3', '6', True), ('4', '8', True))
+
+    def run_mode(self, mode, cases=CASES, **options):
+        return runner.run_test_cases(DOUBLE, 'Python', cases, mode=mode, harness=False, **options)
+
+    def test_full_runs_every_case(self):
+        result = self.run_mode('full')
+        self.assertEqual(result['mode'], 'full')
+        self.assertEqual([(r['index'], r['passed']) for r in result['results']],
+                         [(1, True), (2, False), (3, True), (4, True)])
+        self.assertFalse(result['all_passed'])
+
+    def test_visible_runs_only_the_visible_cases(self):
+        result = self.run_mode('visible')
+        self.assertEqual(result['mode'], 'visible')
+        self.assertEqual([r['index'] for r in result['results']], [1, 2])
+        self.assertFalse(any(r['is_hidden'] for r in result['results']))
+
+    def test_visible_without_visible_cases_runs_them_all(self):
+        hidden = _cases(('1', '2', True), ('3', '6', True))
+        result = self.run_mode('visible', hidden)
+        self.assertEqual(result['mode'], 'full')
+        self.assertEqual([r['index'] for r in result['results']], [1, 2])
+        self.assertTrue(result['all_passed'])
+
+    def test_fail_fast_skips_the_rest(self):
+        for parallel in (False, True):
+            with self.subTest(parallel=parallel):
+                result = self.run_mode('fail_fast', parallel=parallel)
+                self.assertEqual(result['mode'], 'fail_fast')
+                self.assertEqual([r['index'] for r in result['results']], [1, 2, 3, 4])
+                self.assertEqual(result['results'][1].get('stop_reason'), 'mismatch')
+                if not parallel:   # in parallel, cases already running still finish
+                    self.assertEqual([r.get('stop_reason') for r in result['results'][2:]], ['skipped'] * 2)
+
+    def test_unknown_mode_is_refused(self):
+        with self.assertRaises(ValueError):
+            self.run_mode('quick')
+
+
+class LimitVerdictTests(SimpleTestCase):
+
+    CASE = _cases(('1', '2', False))
+
+    def first(self, code, language='Python', **options):
+        return runner.run_test_cases(code, language, self.CASE, harness=False, **options)['results'][0]
+
+    def test_cpu_backstop_without_a_memory_limit(self):
+        show = 'import resource\nprint(resource.getrlimit(resource.RLIMIT_CPU))'
+        with limits.applied(limits.Limits(1.5, 0)):
+            out = subprocess.run([sys.executable, '-c', show], capture_output=True, text=True,
+                                 preexec_fn=limits.preexec()).stdout
+        self.assertEqual(out.strip(), '(3, 4)')
+
+    def test_time_limit(self):
+        r = self.first('while True:\n    pass\n', time_limit=0.5)
+        self.assertFalse(r['passed'])
+        self.assertEqual(r['stop_reason'], 'timeout')
+        self.assertEqual(r['stderr'], 'Time limit exceeded (0.5s)')
+
+    def test_memory_limit(self):
+        r = self.first('x = bytearray(512 * 1024 * 1024)\nprint(2)\n', memory_limit_mb=64)
+        self.assertFalse(r['passed'])
+        self.assertIn('MemoryError', r['stderr'])
+
+    def test_output_flood(self):
+        # Whitespace after the right answer never mismatches, so only the limit stops it
+        for harness in (False, True):
+            with self.subTest(harness=harness):
+                r = runner.run_test_cases("print(2)\nwhile True:\n    print(' ' * 100)\n", 'Python',
+                                          self.CASE * 2, harness=harness)['results'][0]
+                self.assertFalse(r['passed'])
+                self.assertEqual(r['stop_reason'], 'output_limit')
+                self.assertTrue(r['stderr'].startswith('Output limit exceeded'))
+
+    @skipUnless(shutil.which('g++'), 'g++ is not installed')
+    def test_compiled_limits(self):
+        r = self.first('int main() {\n    volatile unsigned long i = 0;\n    for (;;) ++i;\n}\n', 'C++',
+                       time_limit=0.5)
+        self.assertEqual(r['stop_reason'], 'timeout')
+        r = self.first('#include <vector>\nint main() {\n    std::vector<char> v(1ul << 30, 1);\n'
+                       '    return v[5];\n}\n', 'C++', memory_limit_mb=64)
+        self.assertFalse(r['passed'])
+        self.assertIn('bad_alloc', r['stderr'])
+
+
+class CompileOnceTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '4', False), ('3', '6', True))
+
+    def run_counted(self, code):
+        """run_test_cases on CASES with the build cache off; returns (result, compiler calls)."""
+        compile_cpp = mock.Mock(wraps=runner._compile_cpp)
+        with mock.patch.object(build_cache, 'ENABLED', False), \
+                mock.patch.dict(runner._COMPILED, cpp=(compile_cpp, *runner._COMPILED['cpp'][1:])):
+            result = runner.run_test_cases(code, 'C++', self.CASES)
+        return result, compile_cpp.call_count
+
+    @skipUnless(shutil.which('g++'), 'g++ is not installed')
+    def test_every_case_runs_one_build(self):
+        code = '#include <iostream>\nint main() { int n; std::cin >> n; std::cout << n * 2; }\n'
+        result, compiles = self.run_counted(code)
+        self.assertTrue(result['all_passed'])
+        self.assertEqual(compiles, 1)
+
+    @skipUnless(shutil.which('g++'), 'g++ is not installed')
+    def test_a_compile_error_is_reported_for_every_case(self):
+        result, compiles = self.run_counted('int main() { return x; }\n')
+        self.assertEqual(compiles, 1)
+        self.assertEqual(len(result['results']), 3)
+        self.assertTrue(all(r['stderr'].startswith('Compilation error') for r in result['results']))
+        self.assertEqual(len({r['stderr'] for r in result['results']}), 1)
+
+
+class WorkerPoolTests(SimpleTestCase):
+
+    class Slots:
+        """BoundedSemaphore stand-in that records the most slots held at once."""
+
+        def __init__(self, size):
+            self._sem = threading.BoundedSemaphore(size)
+            self._lock = threading.Lock()
+            self.held = self.peak = 0
+
+        def acquire(self, blocking=True):
+            if not self._sem.acquire(blocking):
+                return False
+            with self._lock:
+                self.held += 1
+                self.peak = max(self.peak, self.held)
+            return True
+
+        def release(self):
+            with self._lock:
+                self.held -= 1
+            self._sem.release()
+
+    def test_concurrent_runs_stay_under_the_ceiling(self):
+        slots = self.Slots(2)
+        code = 'import time\ntime.sleep(0.2)\nprint(int(input()) * 2)'
+        cases = _cases(*[(str(i), str(i * 2), False) for i in range(6)])
+        results = []
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=8)   # more threads than slots
+        self.addCleanup(pool.shutdown)
+        with mock.patch.object(runner, '_slots', slots), mock.patch.object(runner, '_pool', pool), \
+                mock.patch.object(runner, 'PY_POOL', False):
+            threads = [threading.Thread(target=lambda: results.append(
+                runner.run_test_cases(code, 'Python', cases, parallel=True, harness=False)))
+                for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(slots.peak, 2)
+        self.assertEqual(slots.held, 0)
+        for result in results:
+            self.assertTrue(result['all_passed'])
+            self.assertEqual([r['index'] for r in result['results']], list(range(1, 7)))
+
+
+class PythonPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        from . import pypool
+        self.pool = pypool.PythonPool(size=1, max_jobs=3)
+        self.addCleanup(self.pool.close)
+
+    def zygote_pid(self):
+        z = self.pool._idle.get()
+        self.pool._idle.put(z)
+        return z.proc.pid
+
+    def test_jobs_share_a_warm_zygote_but_not_state(self):
+        first = self.pool.run('import math, os\nmath.pi = 3\nx = input()\nprint(os.getpid(), x)', 'one', 5)
+        zygote = self.zygote_pid()
+        second = self.pool.run('import math, os\nprint(os.getpid(), math.pi, "x" in globals())', '', 5)
+        self.assertEqual(self.zygote_pid(), zygote)
+        first_pid, text = first['stdout'].split()
+        second_pid, pi, leaked = second['stdout'].split()
+        self.assertEqual(text, 'one')
+        self.assertNotEqual(first_pid, second_pid)
+        self.assertNotIn(int(first_pid), (zygote, int(second_pid)))
+        self.assertEqual((pi, leaked), ('3.141592653589793', 'False'))
+
+    def test_a_crashing_job_leaves_the_zygote_serving(self):
+        crashed = self.pool.run('import os\nos.kill(os.getpid(), 9)', '', 5)
+        self.assertEqual(crashed['returncode'], -9)
+        self.assertEqual(self.pool.run('raise SystemExit(4)', '', 5)['returncode'], 4)
+        self.assertEqual(self.pool.run('print(input())', 'still here', 5)['stdout'].strip(), 'still here')
+
+    def test_the_zygote_is_recycled_after_its_job_budget(self):
+        self.pool.run('pass', '', 5)
+        zygote = self.zygote_pid()
+        for _ in range(2):   # max_jobs=3
+            self.pool.run('pass', '', 5)
+        self.assertNotEqual(self.zygote_pid(), zygote)
+
+
+class AsyncRunnerTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '5', False), ('3', '6', True))
+
+    def test_results_match_the_synchronous_runner(self):
+        import asyncio
+        programs = [('Python', DOUBLE), ('Python', 'print(input('), ('Python', 'raise SystemExit(3)')]
+        if shutil.which('g++'):
+            programs.append(('C++', '#include <iostream>\nint main() { int n; std::cin >> n; std::cout << n * 2; }\n'))
+        for language, code in programs:
+            for mode in ('full', 'visible'):
+                with self.subTest(language=language, code=code, mode=mode):
+                    expected = runner.run_test_cases(code, language, self.CASES, mode=mode, harness=False)
+                    actual = asyncio.run(runner.run_test_cases_async(code, language, self.CASES, mode=mode,
+                                                                     harness=False))
+                    self.assertEqual(actual, expected)
+
+    def test_cancelling_kills_the_running_cases(self):
+        import asyncio
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        code = (f'import os, time\nopen(os.path.join({base!r}, str(os.getpid())), "w").close()\n'
+                'time.sleep(30)\n')
+
+        async def cancelled_run():
+            task = asyncio.ensure_future(runner.run_test_cases_async(code, 'Python', self.CASES[:2],
+                                                                     harness=False, parallel=True))
+            while len(os.listdir(base)) < min(2, runner.MAX_WORKERS):
+                await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(asyncio.wait_for(cancelled_run(), 10))
+        for pid in map(int, os.listdir(base)):
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+
+class SQLFixtureTests(SimpleTestCase):
+
+    SETUP = "CREATE TABLE t (n INTEGER);\nINSERT INTO t VALUES (1), (2);\n"
+
+    def setUp(self):
+        from . import sqlfixtures
+        self.sqlfixtures = sqlfixtures
+        for name, value in (('_fixtures', type(sqlfixtures._fixtures)()), ('MAX_FIXTURES', 2),
+                            ('_counts', dict.fromkeys(sqlfixtures._counts, 0))):
+            patcher = mock.patch.object(sqlfixtures, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_a_query_cannot_change_the_fixture(self):
+        deleted = runner.run_test_cases('DELETE FROM t', 'SQL', _cases((self.SETUP, '2 row(s) affected', False)))
+        counted = runner.run_test_cases('SELECT COUNT(*) FROM t', 'SQL', _cases((self.SETUP, '2', False)))
+        self.assertTrue(deleted['all_passed'])
+        self.assertTrue(counted['all_passed'])
+        self.assertEqual(self.sqlfixtures.stats()['hits'], 1)
+
+    def test_the_cache_is_bounded(self):
+        for n in range(4):
+            self.sqlfixtures.clone(f'CREATE TABLE t{n} (n INTEGER);').close()
+        stats = self.sqlfixtures.stats()
+        self.assertEqual((stats['entries'], stats['misses'], stats['evictions']), (2, 4, 2))
+
+    def test_a_failing_setup_is_not_cached(self):
+        result = runner.run_test_cases('SELECT 1', 'SQL', _cases(('CREATE TABLE (', '1', False)))
+        self.assertFalse(result['all_passed'])
+        self.assertIn('syntax error', result['results'][0]['stderr'])
+        self.assertEqual(self.sqlfixtures.stats()['entries'], 0)
+
+
+class ToolchainDispatchTests(SimpleTestCase):
+
+    def setUp(self):
+        from . import toolchains
+        self.toolchains = toolchains
+        for name in ('_tools', '_languages'):
+            patcher = mock.patch.object(toolchains, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_tools(self, *available, node='v20.11.0'):
+        return {name: {'available': name in available, 'path': f'/usr/bin/{name}' if name in available else None,
+                       'version': (node if name == 'node' else '1.0') if name in available else None}
+                for name in self.toolchains.TOOLS}
+
+    def test_toolchains_are_probed_once(self):
+        with mock.patch.object(self.toolchains, '_probe', wraps=self.toolchains._probe) as probe:
+            for _ in range(2):
+                runner.run_test_cases(DOUBLE, 'Python', _cases(('1', '2', False)))
+                self.toolchains.languages()
+        self.assertEqual(probe.call_count, len(self.toolchains.TOOLS))
+
+    def test_a_missing_toolchain_fails_every_case_without_running(self):
+        self.toolchains._tools = self.fake_tools('python', 'node')
+        with mock.patch.object(runner, '_prepare_compiled') as prepare:
+            result = runner.run_test_cases('int main() {}', 'C++', _cases(('1', '2', False), ('3', '6', True)))
+        prepare.assert_not_called()
+        self.assertEqual({r['stderr'] for r in result['results']}, {'g++ compiler not found on server.'})
+
+    def test_an_unsupported_language_is_left_to_the_teacher(self):
+        result = runner.run_test_cases('PRINT 2', 'COBOL', _cases(('1', '2', False)))
+        self.assertIn('Auto-execution not supported for COBOL', result['results'][0]['stderr'])
+
+    def test_typescript_takes_the_best_toolchain_installed(self):
+        for available, node, mode, command in (
+                (('tsc', 'node'), 'v20.11.0', 'compiled', None),
+                (('ts-node', 'node'), 'v20.11.0', 'interpreted', ['ts-node', '{src}']),
+                (('node',), 'v22.6.0', 'interpreted',
+                 ['node', '--experimental-strip-types', '--no-warnings', '{src}']),
+                (('node',), 'v20.11.0', 'interpreted', ['node', '{src}']),
+                ((), None, 'interpreted', None)):
+            with self.subTest(available=available, node=node):
+                self.toolchains._tools = self.fake_tools(*available, node=node)
+                self.toolchains._languages = None
+                spec = self.toolchains.language('typescript')
+                self.assertEqual((spec['mode'], spec['command']), (mode, command))
+                self.assertEqual(spec['available'], bool(available))
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        from . import metrics
+        self.metrics = metrics
+        patcher = mock.patch.object(metrics, '_stats', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_timings_are_returned_only_when_asked(self):
+        cases = _cases(('1', '2', False), ('2', '5', False))
+        plain = runner.run_test_cases(DOUBLE, 'Python', cases, harness=False)
+        timed = runner.run_test_cases(DOUBLE, 'Python', cases, harness=False, timings=True)
+        self.assertNotIn('timings', plain)
+        self.assertFalse(any('timings' in r or '_timings' in r for r in plain['results']))
+        self.assertIn('precheck_ms', timed['timings'])
+        for r in timed['results']:
+            self.assertIn('execute_ms', r['timings'])
+        self.assertEqual([r['timings']['exit_reason'] for r in timed['results']], ['exited', 'mismatch'])
+
+    def test_calls_fold_into_per_language_histograms(self):
+        runner.run_test_cases(DOUBLE, 'Python', _cases(('1', '2', False), ('2', '4', False)), harness=False)
+        runner.run_test_cases('while True:\n    pass\n', 'Python', _cases(('1', '2', False)),
+                              harness=False, time_limit=0.3)
+        python = self.metrics.snapshot()['languages']['python']
+        self.assertEqual((python['calls'], python['cases']), (2, 3))
+        self.assertEqual(python['exit_reasons'], {'exited': 2, 'timeout': 1})
+        execute = python['phases']['execute_ms']
+        self.assertEqual(execute['count'], 3)
+        self.assertEqual(sum(execute['buckets'].values()), 3)
+        self.assertGreaterEqual(execute['max'], 300)
+
+    def test_percentiles_are_bucket_bounds(self):
+        hist = self.metrics._histogram(self.metrics.MS_BUCKETS)
+        for value in (0.5, 3, 3, 4, 20000):
+            self.metrics._add(hist, self.metrics.MS_BUCKETS, value)
+        self.assertEqual(self.metrics._percentile(hist, self.metrics.MS_BUCKETS, 0.5), 5)
+        self.assertIsNone(self.metrics._percentile(hist, self.metrics.MS_BUCKETS, 0.99))
+
+
+class BenchmarkTests(SimpleTestCase):
+
+    def test_the_corpus_gets_the_expected_verdicts(self):
+        from . import benchmark
+        report = benchmark.run(languages=['python', 'sql', 'cobol'], kinds=['ac', 'wa', 'ce', 'flood'],
+                               concurrency=2, repeat=1, warmup=False)
+        self.assertEqual(report['skipped'], {'cobol': 'no benchmark corpus for this language'})
+        self.assertEqual(report['overall']['unexpected'], 0)
+        self.assertEqual(report['languages']['python']['jobs'], 4)
+        self.assertEqual(set(report['languages']['python']['kinds']), {'ac', 'wa', 'ce', 'flood'})
+        self.assertIn('execute_ms', report['languages']['sql']['phases'])
+
+    def test_the_command_writes_a_json_report(self):
+        import io, json
+        from django.core.management import call_command
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        output = os.path.join(base, 'bench.json')
+        call_command('judge_bench', languages='python', kinds='ac', repeat=2, no_warmup=True, output=output,
+                     stdout=io.StringIO())
+        with open(output, encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(report['overall']['jobs'], 2)
+        self.assertFalse(report['config']['warmup'])
+
+
+class AdmissionTests(SimpleTestCase):
+
+    def setUp(self):
+        from . import admission
+        self.admission = admission
+        for name, value in (('_memory', admission.MemoryBackend()), ('REDIS_URL', ''), ('ENABLED', True),
+                            ('MAX_PER_USER', 2), ('MAX_INFLIGHT', 3), ('WAIT_SECONDS', 0.3)):
+            patcher = mock.patch.object(admission, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def hold(self, *users):
+        """Leases for `users`, released at the end of the test."""
+        import contextlib
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        for user in users:
+            stack.enter_context(self.admission.admit(user))
+        return stack
+
+    def test_a_user_over_their_limit_is_refused_straight_away(self):
+        self.hold('u1', 'u1')
+        started = time.monotonic()
+        with self.assertRaisesRegex(self.admission.Rejected, 'already have code running'):
+            with self.admission.admit('u1'):
+                pass
+        self.assertLess(time.monotonic() - started, 0.2)
+
+    def test_a_saturated_judge_refuses_after_the_wait(self):
+        self.hold('u1', 'u2', 'u3')
+        with self.assertRaisesRegex(self.admission.Rejected, 'busy') as caught:
+            with self.admission.admit('u4'):
+                pass
+        self.assertEqual(caught.exception.retry_after, self.admission.RETRY_AFTER)
+        self.assertEqual(self.admission._memory.stats(), {'inflight': 3, 'waiting': 0})
+
+    def test_a_waiting_request_gets_a_freed_slot(self):
+        leases = self.hold('u1', 'u2', 'u3')
+        threading.Timer(0.1, leases.close).start()
+        with self.admission.admit('u4'):
+            self.assertEqual(self.admission._memory.stats()['inflight'], 1)
+
+    def test_a_full_wait_queue_refuses_straight_away(self):
+        self.hold('u1', 'u2', 'u3')
+        with mock.patch.object(self.admission, 'MAX_WAITING', 0), \
+                self.assertRaisesRegex(self.admission.Rejected, 'busy'):
+            with self.admission.admit('u4'):
+                pass
+
+    def test_a_refused_run_is_a_429(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from . import views
+        request = APIRequestFactory().post('/api/tasks/t1/run/', {'code': DOUBLE}, format='json')
+        force_authenticate(request, user=mock.Mock(is_authenticated=True, id='u1'))
+        task = mock.Mock(tech_stack='Python', classroom_id=None, test_cases=[], time_limit_ms=0,
+                         memory_limit_mb=0, language_limits={})
+        with mock.patch.object(views.CodingTask, 'objects') as objects, \
+                mock.patch.object(views.tasks, 'test_cases', return_value=_cases(('1', '2', False))), \
+                mock.patch.object(verdicts, 'run', side_effect=self.admission.Rejected('busy', retry_after=7)):
+            objects.get.return_value = task
+            response = views.run_code(request, 't1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(response.data, {'error': 'busy', 'retry_after': 7})
+
+
+class PrecheckTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '4', False), ('3', '6', True))
+
+    def setUp(self):
+        from . import precheck
+        self.precheck = precheck
+        for name, value in (('_cache', type(precheck._cache)()), ('ENABLED', True),
+                            ('_counts', dict.fromkeys(precheck._counts, 0))):
+            patcher = mock.patch.object(precheck, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_python_that_does_not_parse_runs_nothing(self):
+        with mock.patch.object(runner, '_run_interpreted') as run, \
+                mock.patch.object(runner, '_run_harness') as harness:
+            result = runner.run_test_cases('print(int(input()) * 2', 'Python', self.CASES)
+        run.assert_not_called()
+        harness.assert_not_called()
+        self.assertEqual(len({r['stderr'] for r in result['results']}), 1)
+        self.assertIn('SyntaxError', result['results'][0]['stderr'])
+        self.assertFalse(any(r['passed'] for r in result['results']))
+
+    def test_a_rejection_matches_a_real_run(self):
+        code = 'print(int(input()) * 2'
+        checked = runner.run_test_cases(code, 'Python', self.CASES[:1], harness=False)
+        with mock.patch.object(self.precheck, 'ENABLED', False):
+            run = runner.run_test_cases(code, 'Python', self.CASES[:1], harness=False)
+        self.assertEqual(checked['results'][0]['stderr'].splitlines()[-1],
+                         run['results'][0]['stderr'].splitlines()[-1])
+
+    @skipUnless(shutil.which('node'), 'node is not installed')
+    def test_javascript_is_checked_once_per_source(self):
+        code = 'console.log(1 +;\n'
+        for _ in range(2):
+            result = runner.run_test_cases(code, 'JavaScript', self.CASES)
+            self.assertIn('SyntaxError', result['results'][0]['stderr'])
+        self.assertEqual(self.precheck.stats()['checked'], 1)
+        self.assertEqual(self.precheck.stats()['cache_hits'], 1)
+
+    def test_code_that_parses_is_run(self):
+        self.assertTrue(runner.run_test_cases(DOUBLE, 'Python', self.CASES)['all_passed'])
+        self.assertEqual(self.precheck.stats()['rejected'], 0)
+
+
+# ── Judge queue ───────────────────────────────────────────────────────────────
+
+class SQLiteQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        self.backend = judge_queue.SQLiteBackend(os.path.join(base, 'queue.sqlite3'))
+        for name, value in (('QUEUE', 'sqlite'), ('_backend', self.backend), ('WAIT_SECONDS', 30)):
+            patcher = mock.patch.object(judge_queue, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_round_trip_through_a_worker(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=judge_queue.work, args=(self.backend, stop))
+        worker.start()
+        try:
+            result = judge_queue.judge(DOUBLE, 'Python', _cases(('1', '2', False), ('2', '5', True)),
+                                       priority='submit', mode='full')
+        finally:
+            stop.set()
+            worker.join()
+        self.assertEqual([(r['index'], r['passed']) for r in result['results']], [(1, True), (2, False)])
+        self.assertEqual(self.backend.depth(), dict.fromkeys(judge_queue.PRIORITIES, 0))
+
+    def test_jobs_are_served_by_priority(self):
+        for n, priority in enumerate(('regrade', 'practice', 'exam', 'submit', 'exam')):
+            self.backend.push({'id': str(n), 'priority': priority, 'enqueued_at': n})
+        self.assertEqual(self.backend.depth()['exam'], 2)
+        order = [self.backend.pop(timeout=0)['id'] for _ in range(5)]
+        self.assertEqual(order, ['2', '4', '3', '1', '0'])
+        self.assertIsNone(self.backend.pop(timeout=0))
+
+    def test_no_worker_is_unavailable(self):
+        with mock.patch.object(judge_queue, 'WAIT_SECONDS', 0.2):
+            with self.assertRaises(judge_queue.JudgeUnavailable):
+                judge_queue.judge(DOUBLE, 'Python', _cases(('1', '2', False)))
+        self.assertEqual(self.backend.depth()['practice'], 0)   # the abandoned job is withdrawn
+
+    def work_one(self, job):
+        """Push `job` and let a worker handle it; returns what it published."""
+        self.backend.push(job)
+        stop = threading.Event()
+        with mock.patch.object(self.backend, 'publish', side_effect=lambda job_id, result: stop.set()) as publish:
+            judge_queue.work(self.backend, stop)
+        return publish.call_args.args[1]
+
+    def test_a_worker_crash_is_not_a_verdict(self):
+        job = {'id': 'crash', 'priority': 'submit', 'enqueued_at': 0, 'code': DOUBLE, 'language': 'Python',
+               'test_cases': _cases(('1', '2', False)), 'options': {'mode': 'full'}}
+        with mock.patch.object(runner, 'run_test_cases', side_effect=RuntimeError('boom')):
+            result = self.work_one(job)
+        self.assertEqual(result['mode'], 'full')
+        self.assertTrue(result['judge_error'])
+        self.assertEqual(result['results'][0]['stderr'], 'Judge error: boom')
+        with mock.patch.object(verdicts.cache, 'set') as cache_set:
+            verdicts.remember('task', job['test_cases'], 'Python', DOUBLE, result)
+        cache_set.assert_not_called()
+
+    def test_an_expired_job_is_cleaned_up(self):
+        self.backend.push({'id': 'late', 'priority': 'practice', 'enqueued_at': 0, 'deadline': 0})
+        stop = threading.Event()
+        publish = self.backend.publish
+        with mock.patch.object(self.backend, 'publish',
+                               side_effect=lambda *args: (publish(*args), stop.set())) as published:
+            judge_queue.work(self.backend, stop)
+        published.assert_called_once_with('late', {'expired': True})
+        # Not left 'running' forever: a published job past RESULT_TTL is deleted
+        self.assertEqual(self.backend._conn().execute('SELECT COUNT(*) FROM judge_jobs').fetchone(), (0,))
+
+
+# ── Single flight and verdicts ────────────────────────────────────────────────
+
+class SingleflightTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(singleflight, '_redis', False)   # this process only
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def callers(self, fn, n=4):
+        """Start one caller of do('k', fn), then n more once it is running; returns their results."""
+        results, started, release = [], threading.Event(), threading.Event()
+
+        def leader_fn():
+            started.set()
+            release.wait(5)
+            return fn()
+
+        def call(f):
+            try:
+                results.append(singleflight.do('k', f))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call, args=(leader_fn,))]
+        threads[0].start()
+        started.wait(5)
+        threads += [threading.Thread(target=call, args=(fn,)) for _ in range(n)]
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.2)   # the followers are waiting on the leader by now
+        release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_concurrent_callers_share_one_call(self):
+        calls = []
+        results = self.callers(lambda: calls.append(1) or {'n': len(calls)})
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [{'n': 1}] * 5)
+
+    def test_a_failure_is_not_shared(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('judge crashed')
+            return 'ok'
+
+        results = self.callers(fn)
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertEqual(results[1:], ['ok'] * 4)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'verdict-tests'}})
+class VerdictCacheTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '4', False), ('3', '6', True), ('4', '8', True))
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        patcher = mock.patch.object(judge_queue, 'judge', wraps=judge_queue.judge)
+        self.judged = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def executed(self):
+        """(number of cases, mode) of every execution so far."""
+        return [(len(c.args[2]), c.kwargs['mode']) for c in self.judged.call_args_list]
+
+    def test_a_stored_verdict_is_not_judged_again(self):
+        first = verdicts.judge('task', self.CASES, 'Python', DOUBLE)
+        again = verdicts.judge('task', self.CASES, 'Python', DOUBLE)
+        self.assertEqual(again, first)
+        self.assertEqual(self.executed(), [(4, 'full')])
+
+    def test_submit_after_a_practice_run_only_runs_the_hidden_cases(self):
+        practice = verdicts.run('task', self.CASES, 'Python', DOUBLE, mode='visible')
+        self.assertEqual(verdicts.practice_summary(practice, self.CASES)['hidden_count'], 2)
+        full = verdicts.judge('task', self.CASES, 'Python', DOUBLE)
+        self.assertEqual(self.executed(), [(4, 'visible'), (2, 'full')])
+        self.assertEqual([(r['index'], r['is_hidden']) for r in full['results']],
+                         [(1, False), (2, False), (3, True), (4, True)])
+        self.assertTrue(full['all_passed'])
+        self.assertEqual(full['mode'], 'full')
+
+    def test_submit_without_hidden_cases_reuses_the_practice_run(self):
+        from . import admission
+        cases = self.CASES[:2]
+        practice = verdicts.run('task', cases, 'Python', DOUBLE, mode='visible')
+        with mock.patch.object(admission, 'admit') as admit:
+            full = verdicts.run('task', cases, 'Python', DOUBLE, user_id='u1')
+        admit.assert_not_called()
+        self.assertEqual(self.executed(), [(2, 'visible')])
+        self.assertEqual(full, {**practice, 'mode': 'full'})
+
+    def test_the_key_covers_code_and_limits(self):
+        verdicts.judge('task', self.CASES, 'Python', DOUBLE)
+        verdicts.judge('task', self.CASES, 'Python', DOUBLE + '\n')
+        verdicts.judge('task', self.CASES, 'Python', DOUBLE, limits={'time_limit': 2.0})
+        self.assertEqual(len(self.executed()), 3)
+
+    def test_fail_fast_verdicts_are_not_stored(self):
+        verdicts.run('task', self.CASES, 'Python', DOUBLE, mode='fail_fast')
+        self.assertIsNone(verdicts.lookup('task', self.CASES, 'Python', DOUBLE))
+        self.assertIsNone(verdicts.lookup('task', self.CASES, 'Python', DOUBLE, mode='fail_fast'))
+
+
+# ── Regrade leases ────────────────────────────────────────────────────────────
+
+@skipUnless(mongomock, 'mongomock is not installed')
+class RegradeLeaseTests(SimpleTestCase):
+
+    def setUp(self):
+        from .models import RegradeJob
+        self.RegradeJob = RegradeJob
+        patcher = mock.patch.object(RegradeJob, '_collection', mongomock.MongoClient().db.regrade_jobs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.job = RegradeJob(task_id='task', test_cases_hash='hash').save()
+
+    def age_lease(self, seconds):
+        self.RegradeJob.objects(id=self.job.id).update_one(
+            set__heartbeat_at=regrade._now() - timedelta(seconds=seconds))
+
+    def state(self):
+        job = self.RegradeJob.objects.get(id=self.job.id)
+        return job.status, job.owner
+
+    def test_a_held_lease_is_not_taken_over(self):
+        self.assertTrue(regrade._claim(self.job.id, 'a'))
+        self.assertFalse(regrade._claim(self.job.id, 'b'))
+        self.age_lease(regrade.LEASE - 5)
+        self.assertFalse(regrade._claim(self.job.id, 'b'))
+        self.assertEqual(self.state(), ('running', 'a'))
+
+    def test_an_expired_lease_is_taken_over(self):
+        self.assertTrue(regrade._claim(self.job.id, 'a'))
+        self.age_lease(regrade.LEASE + 5)
+        self.assertTrue(regrade._claim(self.job.id, 'b'))
+        self.assertEqual(self.state(), ('running', 'b'))
+        # The old owner coming back can no longer finish the job
+        regrade._finish(self.job, 'a', 'done')
+        self.assertEqual(self.state(), ('running', 'b'))
+        regrade._finish(self.job, 'b', 'done')
+        self.assertEqual(self.state(), ('done', 'b'))
+
+    def test_resume_restarts_only_expired_jobs(self):
+        regrade._claim(self.job.id, 'a')
+        with mock.patch.object(regrade, '_spawn') as spawn:
+            self.assertEqual(regrade.resume(), 0)
+            self.age_lease(regrade.LEASE + 5)
+            self.assertEqual(regrade.resume(), 1)
+        spawn.assert_called_once_with(self.job.id)
+
+
+# ── Build cache ───────────────────────────────────────────────────────────────
+
+class BuildCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        patcher = mock.patch.object(build_cache, 'CACHE_DIR', os.path.join(base, 'builds'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self, key='k'):
+        built = []
+
+        def build_fn(d):
+            built.append(d)
+            with open(os.path.join(d, 'artifact'), 'w') as f:
+                f.write('ok')
+        return build_cache.get_or_build(key, build_fn), built
+
+    def test_directory_is_private(self):
+        self.build()
+        self.assertEqual(os.stat(build_cache.CACHE_DIR).st_mode & 0o777, 0o700)
+
+    def test_hit_reuses_the_entry(self):
+        entry, _ = self.build()
+        again, built = self.build()
+        self.assertEqual((again, built), (entry, []))
+
+    def test_entry_writable_by_others_is_rebuilt(self):
+        entry, _ = self.build()
+        os.chmod(entry, 0o777)
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            again, built = self.build()
+        self.assertEqual(again, entry)
+        self.assertEqual(len(built), 1)
+        self.assertEqual(os.stat(entry).st_mode & 0o022, 0)
+
+    def test_directory_of_another_user_is_refused(self):
+        os.makedirs(build_cache.CACHE_DIR)
+        with mock.patch.object(os, 'geteuid', return_value=os.geteuid() + 1), \
+                self.assertLogs('arena_api.judge', 'WARNING'), \
+                self.assertRaises(build_cache.Untrusted):
+            self.build()
+
+
+# ── Java CDS archive ──────────────────────────────────────────────────────────
+
+class JavaCDSTests(SimpleTestCase):
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        for name, value in (('HOME_DIR', os.path.join(base, 'jvm')), ('_archive', None),
+                            ('_setup_thread', None), ('_setup_failed_at', None)):
+            patcher = mock.patch.object(javacds, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_setup_failure_runs_java_without_the_archive(self):
+        with mock.patch.object(javacds, '_build', side_effect=FileNotFoundError('javac')), \
+                self.assertLogs('arena_api.judge', 'WARNING'):
+            javacds._prepare()
+        self.assertEqual(javacds.java_flags(), [])
+        self.assertIsNone(javacds._setup_thread)   # not retried before SETUP_RETRY
+
+    @skipUnless(shutil.which('javac'), 'javac is not installed')
+    def test_java_runs_with_the_archive(self):
+        javacds._prepare()
+        self.assertIn(f'-XX:SharedArchiveFile={javacds._archive}', javacds.java_flags())
+        code = ('import java.util.Scanner;\npublic class Main {\n    public static void main(String[] a) {\n'
+                '        System.out.println(new Scanner(System.in).nextInt() * 2);\n    }\n}\n')
+        result = runner.run_test_cases(code, 'Java', _cases(('1', '2', False), ('3', '6', False)))
+        self.assertTrue(result['all_passed'])
+
+
+# ── Workspace ─────────────────────────────────────────────────────────────────
+
+class WorkspaceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base, ignore_errors=True)
+        self.shm = os.path.join(self.base, 'shm')
+        self.tmp = os.path.join(self.base, 'tmp')
+        os.mkdir(self.shm)
+        os.mkdir(self.tmp)
+        for target, name, value in ((workspace, 'ROOT_DIR', self.shm), (workspace, '_root', None),
+                                    (workspace, '_pid', None), (workspace, '_idle', []),
+                                    (tempfile, 'tempdir', self.tmp)):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_root_is_private(self):
+        root = workspace.root()
+        self.assertEqual(os.path.dirname(os.path.dirname(root)), self.shm)
+        self.assertEqual(os.stat(os.path.dirname(root)).st_mode & 0o777, 0o700)
+
+    def test_a_squatted_directory_is_not_used(self):
+        elsewhere = os.path.join(self.base, 'elsewhere')
+        os.mkdir(elsewhere)
+        for parent in (self.shm, self.tmp):
+            os.symlink(elsewhere, os.path.join(parent, f'bytebit-judge-{os.geteuid()}'))
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            root = workspace.root()
+        self.assertEqual(os.listdir(elsewhere), [])
+        self.assertEqual(os.path.dirname(os.path.dirname(root)), self.tmp)
+
+
+    def test_a_released_directory_is_emptied_and_reused(self):
+        job = workspace.acquire()
+        os.mkdir(os.path.join(job, 'build'))
+        workspace.write_source(job, 'solution.py', 'print(1)')
+        workspace.release(job)
+        self.assertEqual(os.listdir(job), [])
+        self.assertEqual(workspace.acquire(), job)
+
+    def test_roots_of_dead_workers_are_swept(self):
+        base = os.path.dirname(workspace.root())
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        for pid in (dead.pid, os.getppid()):
+            os.makedirs(os.path.join(base, str(pid), 'job-x'))
+        workspace._root = None   # as in a new worker
+        workspace.root()
+        self.assertFalse(os.path.exists(os.path.join(base, str(dead.pid))))
+        self.assertTrue(os.path.exists(os.path.join(base, str(os.getppid()))))
+
+# ── Streamed practice runs ────────────────────────────────────────────────────
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'run-consumer-tests'}})
+class RunConsumerTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '5', False), ('3', '6', True))
+
+    async def connect(self):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from .consumers import RunConsumer
+        from .routing import websocket_urlpatterns
+        task = {'language': 'Python', 'classroom_id': None, 'test_cases': self.CASES, 'limits': {},
+                'priority': 'practice'}
+        patcher = mock.patch.object(RunConsumer, 'get_task', mock.AsyncMock(return_value=task))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/run/task-1/')
+        communicator.scope['user'] = mock.Mock(is_authenticated=True, id='u1')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_results_stream_before_the_summary(self):
+        import asyncio
+
+        async def session():
+            communicator = await self.connect()
+            await communicator.send_json_to({'type': 'run', 'code': DOUBLE})
+            messages = [await communicator.receive_json_from(timeout=10) for _ in range(4)]
+            await communicator.disconnect()
+            return messages
+
+        started, *cases, complete = asyncio.run(session())
+        self.assertEqual(started, {'type': 'run_started', 'total': 2})
+        self.assertEqual([m['type'] for m in cases], ['case_result'] * 2)
+        self.assertEqual(sorted((m['result']['index'], m['result']['passed']) for m in cases),
+                         [(1, True), (2, False)])
+        self.assertEqual(complete['type'], 'run_complete')
+        self.assertEqual((complete['mode'], complete['total'], complete['passed_count'], complete['hidden_count']),
+                         ('visible', 2, 1, 1))
+        self.assertIsNotNone(verdicts.lookup('task-1', self.CASES, 'Python', DOUBLE, mode='visible'))
+
+    def test_cancel_stops_the_run(self):
+        import asyncio
+
+        async def session():
+            communicator = await self.connect()
+            await communicator.send_json_to({'type': 'run', 'code': 'import time\ntime.sleep(30)'})
+            started = await communicator.receive_json_from(timeout=10)
+            await asyncio.sleep(0.2)
+            await communicator.send_json_to({'type': 'cancel'})
+            cancelled = await communicator.receive_json_from(timeout=5)
+            nothing_else = await communicator.receive_nothing(timeout=0.5)
+            await communicator.disconnect()
+            return started, cancelled, nothing_else
+
+        started, cancelled, nothing_else = asyncio.run(session())
+        self.assertEqual(started['type'], 'run_started')
+        self.assertEqual(cancelled, {'type': 'run_cancelled'})
+        self.assertTrue(nothing_else)
+
+
+# ── Judge daemon ──────────────────────────────────────────────────────────────
+
+class DaemonClientTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '4', True))
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        self.path = os.path.join(base, 'judged.sock')
+        for name, value in (('SOCKET', self.path), ('_down_until', 0.0), ('_idle', []), ('TIMEOUT', 2),
+                            ('_counts', dict.fromkeys(judged._counts, 0))):
+            patcher = mock.patch.object(judged, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def serve(self, reply):
+        """A stand-in daemon answering one request with `reply` (bytes), or never if None."""
+        import socket
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen()
+        self.addCleanup(listener.close)
+
+        def answer():
+            conn, _ = listener.accept()
+            with conn:
+                conn.makefile('rb').readline()
+                if reply is None:
+                    time.sleep(judged.TIMEOUT + 1)
+                else:
+                    conn.sendall(reply)
+
+        thread = threading.Thread(target=answer, daemon=True)
+        thread.start()
+
+    def assertJudgeError(self, result):
+        self.assertTrue(result['judge_error'])
+        self.assertFalse(result['all_passed'])
+        self.assertTrue(all(r['stderr'].startswith('Judge error') for r in result['results']))
+
+    def test_an_unreachable_daemon_runs_the_code_here(self):
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            result = runner.run_test_cases(DOUBLE, 'Python', self.CASES)
+        self.assertTrue(result['all_passed'])
+        self.assertEqual(judged._counts['fallbacks'], 1)
+
+    def test_a_daemon_error_is_not_run_again(self):
+        self.serve(b'{"error": "RuntimeError: boom"}\n')
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            result = runner.run_test_cases(DOUBLE, 'Python', self.CASES, mode='visible')
+        self.assertJudgeError(result)
+        self.assertEqual((result['mode'], [r['index'] for r in result['results']]), ('visible', [1]))
+        self.assertEqual(judged._counts, {'remote': 0, 'fallbacks': 0, 'reconnects': 0, 'failures': 1})
+        self.assertEqual(judged._down_until, 0.0)
+
+    def test_a_daemon_timeout_is_not_run_again(self):
+        judged.TIMEOUT = 0.3
+        self.serve(None)
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            result = runner.run_test_cases(DOUBLE, 'Python', self.CASES)
+        self.assertJudgeError(result)
+        self.assertEqual(len(result['results']), 2)
+
+    def test_a_daemon_error_on_a_streamed_run(self):
+        import asyncio
+        self.serve(b'{"error": "RuntimeError: boom"}\n')
+        streamed = []
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            result = asyncio.run(runner.run_test_cases_async(DOUBLE, 'Python', self.CASES,
+                                                             on_result=streamed.append))
+        self.assertJudgeError(result)
+        self.assertEqual(streamed, result['results'])
+
+
+
+class DaemonRoundTripTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '5', False), ('3', '6', True))
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base, ignore_errors=True)
+        path = os.path.join(base, 'judged.sock')
+        self.daemon = subprocess.Popen([sys.executable, '-m', 'arena_api.judged', '--socket', path],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.addCleanup(self.stop_daemon)
+        deadline = time.monotonic() + 15
+        while not os.path.exists(path):
+            if time.monotonic() > deadline or self.daemon.poll() is not None:
+                self.fail('the judge daemon did not start')
+            time.sleep(0.05)
+        for name, value in (('SOCKET', path), ('_down_until', 0.0), ('_idle', []),
+                            ('_counts', dict.fromkeys(judged._counts, 0))):
+            patcher = mock.patch.object(judged, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [conn.close() for conn in judged._idle])
+
+    def stop_daemon(self):
+        if self.daemon.poll() is None:
+            self.daemon.terminate()
+            self.daemon.wait(10)
+
+    def test_a_run_goes_through_the_daemon(self):
+        with mock.patch.object(judged, 'SOCKET', ''):
+            local = runner.run_test_cases(DOUBLE, 'Python', self.CASES, harness=False)
+        remote = runner.run_test_cases(DOUBLE, 'Python', self.CASES, harness=False)
+        self.assertEqual(remote, local)
+        self.assertEqual(judged._counts['remote'], 1)
+        self.assertEqual(judged.stats()['daemon']['pid'], self.daemon.pid)
+
+    def test_a_streamed_run_goes_through_the_daemon(self):
+        import asyncio
+        streamed = []
+        result = asyncio.run(runner.run_test_cases_async(DOUBLE, 'Python', self.CASES, mode='visible',
+                                                         on_result=streamed.append))
+        self.assertEqual(sorted(streamed, key=lambda r: r['index']), result['results'])
+        self.assertEqual([r['index'] for r in result['results']], [1, 2])
+        self.assertEqual(judged._counts['remote'], 1)
+
+    def test_a_stopped_daemon_falls_back_to_running_here(self):
+        runner.run_test_cases(DOUBLE, 'Python', self.CASES)   # leaves a pooled connection behind
+        self.stop_daemon()
+        with self.assertLogs('arena_api.judge', 'WARNING'):
+            result = runner.run_test_cases(DOUBLE, 'Python', self.CASES)
+        self.assertEqual([r['passed'] for r in result['results']], [True, False, True])
+        self.assertEqual((judged._counts['remote'], judged._counts['fallbacks']), (1, 1))
+        self.assertFalse(judged.enabled())   # skipped for RETRY seconds
+
+# ── Health and judge metrics ──────────────────────────────────────────────────
+
+class JudgeStatusVisibilityTests(SimpleTestCase):
+
+    def setUp(self):
+        from rest_framework.test import APIRequestFactory
+        self.factory = APIRequestFactory()
+
+    def test_health_shows_no_judge_internals(self):
+        from .health import health_check
+        with mock.patch('mongoengine.get_db', side_effect=RuntimeError('no database')), \
+                mock.patch.dict(os.environ, {'REDIS_URL': 'redis://127.0.0.1:1/1'}):
+            response = health_check(self.factory.get('/api/health/', HTTP_ACCEPT='application/json'))
+        self.assertIn('status', response.data)
+        self.assertNotIn('judge', response.data)
+
+    def test_judge_status_is_for_admins_only(self):
+        from rest_framework.test import force_authenticate
+        from . import views
+        user = mock.Mock(is_authenticated=True, is_superuser=False)
+        for admin, status in ((False, 403), (True, 200)):
+            request = self.factory.get('/api/admin/judge-metrics/')
+            force_authenticate(request, user=user)
+            with self.subTest(admin=admin), mock.patch.object(views, '_is_admin', return_value=admin), \
+                    mock.patch.object(judged, 'SOCKET', ''):
+                response = views.judge_metrics(request)
+                self.assertEqual(response.status_code, status)
+                if admin:
+                    self.assertIn('languages', response.data)
+                    self.assertIn('toolchains', response.data['judge'])
+
+
+# ── Battles ───────────────────────────────────────────────────────────────────
+
+class BattleJudgingTests(SimpleTestCase):
+
+    CASES = _cases(('1', '2', False), ('2', '4', True))
+
+    def run_code(self, code, result=None):
+        """BattleConsumer.run_code on CASES, in-process, or answered with `result` when given."""
+        import asyncio
+        import contextlib
+        from . import admission
+        from .consumers import BattleConsumer
+        consumer = BattleConsumer()
+        consumer.user = None
+        consumer.channel_name = 'battle-test'
+        task = {'classroom_id': None, 'test_cases': self.CASES, 'limits': {}}
+        patches = [mock.patch.object(BattleConsumer, 'get_task', mock.AsyncMock(return_value=task)),
+                   mock.patch.object(admission, 'admit_async',
+                                     lambda *a: contextlib.AsyncExitStack())]
+        if result is not None:
+            patches.append(mock.patch.object(judge_queue, 'judge_async', mock.AsyncMock(return_value=result)))
+        with contextlib.ExitStack() as stack:
+            for patcher in patches:
+                stack.enter_context(patcher)
+            return asyncio.run(consumer.run_code(code, 'task', 'Python'))
+
+    def test_passing_solution(self):
+        self.assertEqual(self.run_code(DOUBLE), (True, '✅ All test cases passed!'))
+
+    def test_wrong_answer_on_a_visible_case(self):
+        self.assertEqual(self.run_code('print(int(input()) * 3)'),
+                         (False, "❌  Expected: '2'\n   Got:      '3'"))
+
+    def test_wrong_answer_on_a_hidden_case_does_not_reveal_it(self):
+        code = 'n = int(input())\nprint(2 if n == 1 else 0)'
+        self.assertEqual(self.run_code(code), (False, '❌  Hidden test case 2 failed'))
+
+    def test_runtime_error(self):
+        passed, message = self.run_code('print(1 // 0)')
+        self.assertFalse(passed)
+        self.assertTrue(message.startswith('Runtime Error:'), message)
+        self.assertIn('ZeroDivisionError', message)
+
+    def test_only_skipped_cases_left(self):
+        result = {'all_passed': False, 'mode': 'fail_fast', 'results': [
+            {**r, 'passed': False, 'actual': '', 'expected': '', 'stderr': '', 'stop_reason': 'skipped'}
+            for r in judge_queue.error_result(self.CASES, '')['results']]}
+        self.assertEqual(self.run_code(DOUBLE, result), (False, '❌  Some test cases did not pass'))
+
+
+# ── Tournament match state ────────────────────────────────────────────────────
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'matchstate-tests'}})
+class MatchStateTests(SimpleTestCase):
+
+    def setUp(self):
+        from types import SimpleNamespace as NS
+        from django.core.cache import cache
+        from . import matchstate
+        from .models import Tournament
+        cache.clear()
+        self.matchstate = matchstate
+        case = NS(input_data='1', output_data='2', is_hidden=True)
+        question = NS(title='Double', description='', difficulty='easy', test_cases=[case],
+                      time_limit_ms=500, memory_limit_mb=64, language_limits={})
+        self.match = NS(match_id='m1', question_index=0, player1_id='p1', player2_id='p2',
+                        status='active', winner_id='', winner_username='', round_num=1)
+        self.tournament = NS(id='t1', matches=[self.match], questions=[question], current_round=1,
+                             participant_usernames={'p1': 'ada', 'p2': 'alan'})
+        self.loads = mock.Mock(return_value=self.tournament)
+        for target, name, value in ((Tournament, 'objects', NS(get=self.loads)),
+                                    (matchstate, '_local', matchstate._local.__class__()),
+                                    (matchstate, '_down_until', 0.0),
+                                    (matchstate, '_counts', dict.fromkeys(matchstate._counts, 0))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def shared(self, shared=True):
+        patcher = mock.patch.object(self.matchstate, 'SHARED', shared)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_state_is_built_for_the_consumer(self):
+        state = self.matchstate.get('t1', 'm1')
+        self.assertEqual(state['test_cases'], [{'input_data': '1', 'output_data': '2', 'is_hidden': True}])
+        self.assertEqual(state['usernames'], {'p1': 'ada', 'p2': 'alan'})
+        self.assertEqual(state['round_matches'], 1)
+        self.assertEqual(self.matchstate.judge_limits(state, 'Python'), {'time_limit': 0.5, 'memory_limit_mb': 64})
+        self.assertIsNone(self.matchstate.get('t1', 'no-such-match'))
+
+    def test_hits_skip_the_database(self):
+        for shared in (False, True):
+            with self.subTest(shared=shared):
+                self.shared(shared)
+                self.loads.reset_mock()
+                self.matchstate.invalidate('t1', ['m1'])
+                first = self.matchstate.get('t1', 'm1')
+                self.assertEqual(self.matchstate.get('t1', 'm1'), first)
+                self.assertEqual(self.loads.call_count, 1)
+                self.assertEqual(self.matchstate.stats()['backend'], 'shared' if shared else 'local')
+
+    def test_invalidate_reloads_the_next_get(self):
+        for shared in (False, True):
+            with self.subTest(shared=shared):
+                self.shared(shared)
+                self.match.winner_id = ''
+                self.matchstate.invalidate('t1', ['m1'])
+                self.assertEqual(self.matchstate.get('t1', 'm1')['winner_id'], '')
+                self.match.winner_id = 'p2'   # changed in MongoDB by a view
+                self.assertEqual(self.matchstate.get('t1', 'm1')['winner_id'], '')
+                self.matchstate.invalidate_tournament(self.tournament)
+                self.assertEqual(self.matchstate.get('t1', 'm1')['winner_id'], 'p2')
+
+    def test_put_replaces_the_cached_state(self):
+        self.shared()
+        state = self.matchstate.get('t1', 'm1')
+        self.matchstate.put('t1', 'm1', {**state, 'status': 'done', 'winner_id': 'p1'})
+        self.assertEqual(self.matchstate.get('t1', 'm1')['winner_id'], 'p1')
+        self.assertEqual(self.loads.call_count, 1)
+
+    def test_local_entries_expire(self):
+        self.shared(False)
+        self.matchstate.get('t1', 'm1')
+        with mock.patch.object(self.matchstate, 'LOCAL_TTL', 0):
+            self.matchstate.put('t1', 'm1', self.matchstate.get('t1', 'm1'))
+        self.matchstate.get('t1', 'm1')
+        self.assertEqual(self.loads.call_count, 2)
+
+    def test_cache_errors_fall_back_to_local_entries(self):
+        from django.core.cache import cache
+        self.shared()
+        with mock.patch.object(cache, 'get', side_effect=ConnectionError('redis down')), \
+                self.assertLogs('arena_api.judge', 'WARNING'):
+            state = self.matchstate.get('t1', 'm1')
+        self.assertEqual(state['status'], 'active')
+        self.assertEqual(self.matchstate.stats()['backend'], 'local')
+        self.assertEqual(self.matchstate.stats()['cache_errors'], 1)
+        self.matchstate.get('t1', 'm1')
+        self.assertEqual(self.loads.call_count, 1)
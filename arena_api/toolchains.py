@@ -0,0 +1,129 @@
+"""
+arena_api/toolchains.py
+Toolchain discovery and the language registry used by runner.py.
+
+Every toolchain is probed once per process (shutil.which plus its version
+command) and each language's command line is resolved from what is actually
+installed. The runner dispatches through languages() and reports a missing
+toolchain straight away instead of discovering it by exec'ing (and failing)
+once per test case. The same data is shown under judge in /api/admin/judge-metrics/.
+"""
+import shutil
+import sys
+import threading
+
+# Tool name → version command; argv[0] is what gets looked up on PATH
+TOOLS = {
+    'python':  (sys.executable, '--version'),
+    'node':    ('node', '--version'),
+    'ts-node': ('ts-node', '--version'),
+    'tsc':     ('tsc', '--version'),
+    'g++':     ('g++', '--version'),
+    'javac':   ('javac', '-version'),
+    'java':    ('java', '-version'),
+    'go':      ('go', 'version'),
+}
+
+# Language → (mode, tools it needs, message when they are missing).
+# mode: 'compiled' (built once, see runner._COMPILED), 'interpreted' (one
+# command per case) or 'builtin' (handled in-process, e.g. sqlite3).
+# TypeScript is resolved separately in _typescript().
+LANGUAGES = {
+    'python':     ('interpreted', ('python',),       'Python interpreter not found.'),
+    'javascript': ('interpreted', ('node',),         'Node.js not found on server.'),
+    'cpp':        ('compiled',    ('g++',),          'g++ compiler not found on server.'),
+    'java':       ('compiled',    ('javac', 'java'), 'Java (javac/java) not found on server.'),
+    'go':         ('compiled',    ('go',),           'Go runtime not found on server.'),
+    'sql':        ('builtin',     (),                ''),
+    'html':       ('builtin',     (),                ''),
+}
+TYPESCRIPT_MISSING = 'Node.js / ts-node not found on server.'
+
+_lock = threading.Lock()
+_tools = None
+_languages = None
+
+
+def _probe(cmd: tuple) -> dict:
+    from .build_cache import toolchain_version   # shares its per-process version cache
+    path = shutil.which(cmd[0])
+    version = toolchain_version(*cmd) if path else ''
+    return {'available': bool(path and version), 'path': path, 'version': version or None}
+
+
+def _node_strips_types(version: str) -> bool:
+    """Node 22.6+ can run .ts files itself by stripping the type annotations."""
+    try:
+        major, minor = (int(p) for p in version.lstrip('v').split('.')[:2])
+    except ValueError:
+        return False
+    return (major, minor) >= (22, 6)
+
+
+def _typescript(tools: dict) -> dict:
+    """tsc → transpile once; else ts-node, else node (type stripping, or plain JS)."""
+    if tools['tsc']['available'] and tools['node']['available']:
+        return {'mode': 'compiled', 'tools': ['tsc', 'node'], 'command': None}
+    if tools['ts-node']['available']:
+        return {'mode': 'interpreted', 'tools': ['ts-node'], 'command': ['ts-node', '{src}']}
+    if tools['node']['available']:
+        flags = ['--experimental-strip-types', '--no-warnings'] if _node_strips_types(tools['node']['version']) else []
+        return {'mode': 'interpreted', 'tools': ['node'], 'command': ['node', *flags, '{src}']}
+    return {'mode': 'interpreted', 'tools': ['ts-node', 'node'], 'command': None}
+
+
+def tools() -> dict:
+    """Probe results per tool: {'available', 'path', 'version'}; probed on first call."""
+    global _tools
+    with _lock:
+        if _tools is None:
+            _tools = {name: _probe(cmd) for name, cmd in TOOLS.items()}
+        return _tools
+
+
+def languages() -> dict:
+    """
+    Language key → {'mode', 'tools', 'available', 'command', 'missing'}.
+    `command` is the argv for interpreted languages, with '{src}' standing for
+    the source file.
+    """
+    global _languages
+    found = tools()
+    with _lock:
+        if _languages is None:
+            registry = {}
+            for lang, (mode, needed, missing) in LANGUAGES.items():
+                command = None
+                if lang == 'python':
+                    command = [found['python']['path'] or sys.executable, '{src}']
+                elif lang == 'javascript':
+                    command = ['node', '{src}']
+                registry[lang] = {
+                    'mode': mode, 'tools': list(needed), 'command': command, 'missing': missing,
+                    'available': all(found[t]['available'] for t in needed),
+                }
+            ts = _typescript(found)
+            registry['typescript'] = {**ts, 'missing': TYPESCRIPT_MISSING,
+                                      'available': ts['mode'] == 'compiled' or ts['command'] is not None}
+            _languages = registry
+        return _languages
+
+
+def language(lang_key: str):
+    """The registry entry for a normalised language key, or None if unsupported."""
+    return languages().get(lang_key)
+
+
+def command(lang_key: str, src: str) -> list:
+    return [src if part == '{src}' else part for part in languages()[lang_key]['command']]
+
+
+def refresh() -> None:
+    """Forget the probe results (e.g. after installing a toolchain)."""
+    global _tools, _languages
+    with _lock:
+        _tools = _languages = None
+
+
+def summary() -> dict:
+    return {'tools': tools(), 'languages': languages()}
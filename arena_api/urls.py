@@ -63,6 +63,7 @@ urlpatterns = [
     path('admin/announcements/',                  views.admin_announcements,    name='admin-announcements'),
     path('admin/announcements/<str:aid>/',        views.admin_announcement_action, name='admin-announcements-action'),
     path('admin/logs/',                           views.admin_logs,             name='admin-logs'),
+    path('admin/judge-metrics/',                  views.judge_metrics,          name='admin-judge-metrics'),
 
     # Public announcements (for students/teachers bell icon)
     path('announcements/',                        views.public_announcements,   name='public-announcements'),
@@ -73,6 +74,7 @@ urlpatterns = [
 
     # Manual grading
     path('tasks/<str:task_id>/grade/',            views.grade_submission,        name='grade-submission'),
+    path('tasks/<str:task_id>/regrade/',          views.task_regrade,            name='task-regrade'),
 
     # Per-user notifications (grading review, marks assigned)
     path('user-notifications/',                   views.user_notifications,          name='user-notifications'),
@@ -0,0 +1,150 @@
+"""
+arena_api/verdicts.py
+Short-lived server-side verdicts for judged code.
+
+run_code stores the runner result it just produced; record_submission looks
+it up instead of trusting the client's run_results, and re-judges on a miss.
+Keys cover everything that can change a verdict: the task, the exact set of
+test cases, the language, the code itself, the task's judge limits and the
+execution mode. A practice run only runs the visible cases and is stored as a
+'visible' verdict; a full run of the same code then only runs the hidden
+cases and merges the two.
+"""
+import contextlib
+import hashlib
+import json
+import os
+
+from django.core.cache import cache
+
+VERDICT_TTL = int(os.environ.get('JUDGE_VERDICT_TTL', 600))  # seconds
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def test_cases_hash(test_cases: list) -> str:
+    return _sha(json.dumps(
+        [[tc.get('input_data', ''), tc.get('output_data', ''), bool(tc.get('is_hidden', False))]
+         for tc in test_cases]
+    ))
+
+
+def verdict_key(task_id, test_cases: list, language: str, code: str, limits: dict = None,
+                mode: str = 'full') -> str:
+    lang = (language or 'python').strip().lower()
+    key = f'verdict:{task_id}:{test_cases_hash(test_cases)}:{lang}:{_sha(code)}'
+    if limits:
+        key += ':' + _sha(json.dumps(limits, sort_keys=True))
+    if mode != 'full':
+        key += ':' + mode
+    return key
+
+
+def remember(task_id, test_cases: list, language: str, code: str, result: dict, limits: dict = None) -> None:
+    """
+    Store a full or visible verdict under its mode; a fail_fast one may be
+    missing cases, and a judge error (judge_queue.error_result) is no verdict.
+    """
+    mode = result.get('mode', 'full')
+    if mode not in ('full', 'visible') or result.get('judge_error'):
+        return
+    try:
+        cache.set(verdict_key(task_id, test_cases, language, code, limits, mode), result, VERDICT_TTL)
+    except Exception:
+        pass  # the cache is an optimisation; judging still works without it
+
+
+def lookup(task_id, test_cases: list, language: str, code: str, limits: dict = None, mode: str = 'full'):
+    try:
+        return cache.get(verdict_key(task_id, test_cases, language, code, limits, mode))
+    except Exception:
+        return None
+
+
+def _complete(visible: dict, test_cases: list, run_rest) -> dict:
+    """
+    The full verdict from a visible one: run_rest(cases) judges the hidden
+    cases, whose results are merged in at their own indexes. Without hidden
+    cases the visible verdict already is the full one.
+    """
+    hidden = [i for i, tc in enumerate(test_cases) if tc.get('is_hidden', False)]
+    if not hidden:
+        return {**visible, 'mode': 'full'}
+    rest = run_rest([test_cases[i] for i in hidden])
+    results = visible['results'] + [
+        {**r, 'index': i + 1} for i, r in zip(hidden, rest['results'])
+    ]
+    results.sort(key=lambda r: r['index'])
+    result = {'all_passed': all(r['passed'] for r in results), 'results': results, 'mode': 'full'}
+    if rest.get('judge_error'):
+        result['judge_error'] = True   # so the merged result is not stored either
+    return result
+
+
+def run(task_id, test_cases: list, language: str, code: str, priority: str = 'practice',
+        user_id=None, classroom_id=None, mode: str = 'full', limits: dict = None) -> dict:
+    """
+    Judge the code in execution `mode` (see runner.MODES) and store the
+    verdict (see remember). A full run of code whose visible verdict is
+    stored only runs the hidden cases. `limits` are the task's judge limits,
+    as returned by limits.for_task. Identical requests from the same user that
+    are in flight at the same time share one execution (see singleflight.py).
+    With `user_id` the execution goes through admission control (may raise
+    admission.Rejected); may raise judge_queue.JudgeUnavailable.
+    """
+    from . import admission, judge_queue, singleflight
+
+    def judge_cases(cases, mode):
+        with admission.admit(user_id, classroom_id) if user_id else contextlib.nullcontext():
+            return judge_queue.judge(code, language, cases, priority=priority, mode=mode, **(limits or {}))
+
+    def execute():
+        visible = lookup(task_id, test_cases, language, code, limits, 'visible') if mode == 'full' else None
+        if visible is not None:
+            result = _complete(visible, test_cases, lambda cases: judge_cases(cases, 'full'))
+        else:
+            result = judge_cases(test_cases, mode)
+        remember(task_id, test_cases, language, code, result, limits)
+        return result
+
+    return singleflight.do(f'{user_id}:{mode}:{verdict_key(task_id, test_cases, language, code, limits)}',
+                           execute)
+
+
+def judge(task_id, test_cases: list, language: str, code: str, priority: str = 'submit',
+          user_id=None, classroom_id=None, limits: dict = None) -> dict:
+    """
+    Return the stored verdict for this exact submission, judging the code on a
+    miss through run(); a stored verdict never takes an admission lease.
+    """
+    result = lookup(task_id, test_cases, language, code, limits)
+    if result is None:
+        result = run(task_id, test_cases, language, code, priority, user_id, classroom_id, limits=limits)
+    return result
+
+
+def practice_summary(result: dict, test_cases: list) -> dict:
+    """
+    What a practice run shows the student: the visible results and the
+    counts. 'total' and 'passed_count' cover the cases that ran, which 'mode'
+    tells apart: only the visible ones ('visible'), or every case ('full').
+    """
+    return {
+        'all_passed':   result['all_passed'],
+        'results':      [r for r in result['results'] if not r.get('is_hidden', False)],
+        'mode':         result.get('mode', 'full'),
+        'total':        len(result['results']),
+        'passed_count': sum(1 for r in result['results'] if r['passed']),
+        'hidden_count': len(test_cases) - len(result['results']),   # not run; graded on /submit/
+    }
+
+
+def redact_hidden(results: list) -> list:
+    """Strip input/output details from hidden cases before results are stored or shown."""
+    return [
+        {'index': r.get('index'), 'is_hidden': True, 'passed': r.get('passed', False)}
+        if r.get('is_hidden') else r
+        for r in results
+    ]
@@ -18,8 +18,9 @@ from .models import (
     Submission, Classroom, Announcement, Ticket, ActionLog,
     GlobalAnnouncement, UserNotification, FriendRequest,
     Tournament, TournamentQuestion, TournamentMatch, gen_code,
-    ReattemptRequest, Exam, ExamSet, ExamViolation, ExamSubmission,
+    ReattemptRequest, RegradeJob, Exam, ExamSet, ExamViolation, ExamSubmission,
 )
+from . import tasks
 from .serializers import (
     CodingTaskSerializer,
     CoderProfileSerializer,
@@ -447,6 +448,8 @@ def classroom_detail(request, classroom_id):
                         'remarks':        s.remarks,
                         'review_status':  getattr(s, 'review_status', 'graded'),
                         'is_active':      getattr(s, 'is_active', True),
+                        'performance':        getattr(s, 'performance', None),
+                        'performance_status': getattr(s, 'performance_status', ''),
                         'created_at':     s.created_at.isoformat() if getattr(s, 'created_at', None) else None,
                     }
                     if is_teacher or matches_user:
@@ -788,6 +791,12 @@ def scout_match(request):
 
 # â”€â”€ Run Code (test without saving) â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 
+def _judge_busy(rejected):
+    """429 for a request turned away by admission control."""
+    return Response({'error': str(rejected), 'retry_after': rejected.retry_after},
+                    status=429, headers={'Retry-After': str(rejected.retry_after)})
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def run_code(request, task_id):
@@ -804,24 +813,25 @@ def run_code(request, task_id):
     code     = request.data.get('code', '')
     language = request.data.get('language', task.tech_stack or 'Python')
 
-    test_cases = [
-        {'input_data': tc.input_data, 'output_data': tc.output_data, 'is_hidden': tc.is_hidden}
-        for tc in (task.test_cases or [])
-    ]
+    test_cases = tasks.test_cases(task)
 
     if not test_cases:
         return Response({'error': 'No test cases defined for this task'}, status=400)
 
-    from .runner import run_test_cases
-    result = run_test_cases(code, language, test_cases)
+    from . import admission, judge_queue, limits, verdicts
+    priority = tasks.judge_priority(str(request.user.id), task_id, 'practice')
+    try:
+        # Practice runs only need the visible cases (all of them if none is visible).
+        # The verdict is kept, so /submit/ only runs the cases this run skipped
+        result = verdicts.run(task_id, test_cases, language, code, priority=priority,
+                              user_id=str(request.user.id), classroom_id=task.classroom_id,
+                              mode='visible', limits=limits.for_task(task, language))
+    except admission.Rejected as e:
+        return _judge_busy(e)
+    except judge_queue.JudgeUnavailable as e:
+        return Response({'error': str(e)}, status=503)
 
-    visible = [r for r in result['results'] if not r.get('is_hidden', False)]
-    return Response({
-        'all_passed':   result['all_passed'],
-        'results':      visible,
-        'total':        len(result['results']),
-        'passed_count': sum(1 for r in result['results'] if r['passed']),
-    })
+    return Response(verdicts.practice_summary(result, test_cases))
 
 
 # â”€â”€ Record Submission (versioned) â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -831,8 +841,10 @@ def run_code(request, task_id):
 def record_submission(request, task_id):
     """
     POST /api/tasks/<id>/submit/
-    Body: { "code": "...", "language": "Python", "run_results": [...] }
+    Body: { "code": "...", "language": "Python" }
     Deactivates previous submission from this user, saves new active one.
+    The score comes from the server's own verdict for this exact code (cached
+    by /run/, re-judged on a miss); client-sent run_results are ignored.
     """
     try:
         task = CodingTask.objects.get(id=task_id)
@@ -843,37 +855,51 @@ def record_submission(request, task_id):
     user_id     = str(request.user.id)
     code        = request.data.get('code', '')
     language    = request.data.get('language', task.tech_stack or 'Python')
-    run_results = request.data.get('run_results', [])
+
+    test_cases = tasks.test_cases(task)
+    if test_cases:
+        from . import admission, judge_queue, limits, verdicts
+        priority = tasks.judge_priority(user_id, task_id, 'submit')
+        try:
+            verdict = verdicts.judge(task_id, test_cases, language, code, priority=priority,
+                                     user_id=user_id, classroom_id=task.classroom_id,
+                                     limits=limits.for_task(task, language))
+        except admission.Rejected as e:
+            return _judge_busy(e)
+        except judge_queue.JudgeUnavailable as e:
+            return Response({'error': str(e)}, status=503)
+        run_results = verdicts.redact_hidden(verdict['results'])
+    else:
+        run_results = []
 
     all_passed = all(r.get('passed', False) for r in run_results) if run_results else False
-    total      = max(len(run_results), 1)
-    n_passed   = sum(1 for r in run_results if r.get('passed', False))
-    score      = round(n_passed / total * 100, 1)   # pyre-ignore
+
+    # Performance tasks: a correct solution is scored on its speed against the
+    # reference. Timing it takes many judge runs, so it happens in the background
+    # (regrade.grade_performance) once the verdict below is recorded
+    performance_pending = all_passed and getattr(task, 'grading_type', 'auto') == 'performance'
 
     # Apply late submission penalty: -0.5 per day late, floor at 0
-    late_days = float(request.data.get('late_days', 0) or 0)
-    if late_days > 0:
-        penalty = late_days * 0.5
-        score   = max(0.0, round(score - penalty, 1))  # pyre-ignore
+    late_days    = float(request.data.get('late_days', 0) or 0)
+    late_penalty = late_days * 0.5 if late_days > 0 else 0.0
 
     # â”€â”€ Grading config â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-    grading_mode  = getattr(task, 'grading_mode', 'Percentage') or 'Percentage'
-    grading_type  = getattr(task, 'grading_type', 'auto') or 'auto'
-    max_marks     = float(getattr(task, 'max_marks', 100) or 100)
-    is_final      = getattr(task, 'is_final', False)
-
-    if grading_type == 'manual':
-        marks_obtained = 0.0
-        grade          = ''
-        passed         = False
-        review_status  = 'pending'
-        remarks        = 'Submitted for teacher review. Marks will be assigned by your teacher.'
-    else:
-        marks_obtained = round(score / 100 * max_marks, 1)  # pyre-ignore
-        grade          = task.compute_grade(score) if hasattr(task, 'compute_grade') else ''
-        passed         = True if is_final else all_passed
-        review_status  = 'graded'
-        remarks        = f'Final assessment submitted. Score: {score}%' if is_final else ('All test cases passed.' if all_passed else f'{n_passed}/{total} test cases passed.')
+    # Shared with the regrade job, so a regraded submission is graded the same way
+    from . import regrade
+    graded = regrade.grading_fields(task, run_results, None, late_penalty)
+    grading_mode   = getattr(task, 'grading_mode', 'Percentage') or 'Percentage'
+    grading_type   = getattr(task, 'grading_type', 'auto') or 'auto'
+    n_passed       = graded['n_passed']
+    total          = graded['total']
+    score          = graded['score']
+    max_marks      = graded['max_marks']
+    marks_obtained = graded['marks_obtained']
+    grade          = graded['grade']
+    passed         = graded['passed']
+    review_status  = graded['review_status']
+    remarks        = graded['remarks']
+    if performance_pending:
+        remarks += ' Performance grading in progress.'
 
     now = datetime.utcnow()
 
@@ -901,11 +927,16 @@ def record_submission(request, task_id):
         is_active      = True,
         status         = 'Submitted',
         run_results    = run_results,
+        test_cases_hash = regrade.test_cases_hash(task),
+        late_penalty   = late_penalty,
+        performance_status = 'pending' if performance_pending else '',
         last_edited_at = now,
         created_at     = now,
     )
     task.submissions.append(new_sub)
     task.save()
+    if performance_pending:
+        regrade.grade_performance_later(task.id, user_id)
 
     # ── Notify student if manual grading ────────────────────────────────────
     if grading_type == 'manual':
@@ -984,14 +1015,14 @@ def record_submission(request, task_id):
 
     # ── Gemini AI feedback (only when test cases fail) ─────────────────────────
     ai_feedback = None
-    if not all_passed and grading_type == 'auto':
+    if not all_passed and grading_type in ('auto', 'performance'):
         try:
             gemini_key = os.environ.get('GEMINI_API_KEY', '')
             if gemini_key:
                 import urllib.request, json as _json
                 tc_summary = '\n'.join(
                     f'TC{j+1}: input={tc.input_data!r}, expected={tc.output_data!r}, '
-                    f'got={run_results[j].get("actual_output", "?") if j < len(run_results) else "?"}'
+                    f'got={run_results[j].get("actual", "?") if j < len(run_results) else "?"}'
                     f' [{"PASS" if (j < len(run_results) and run_results[j].get("passed")) else "FAIL"}]'
                     for j, tc in enumerate(task.test_cases or [])
                 )
@@ -1037,6 +1068,8 @@ def record_submission(request, task_id):
         'passed': all_passed,
         'xp_earned': xp_earned,
         'ai_feedback': ai_feedback,
+        'performance': None,   # timed in the background; see performance_status
+        'performance_status': new_sub.performance_status,
     })
 
 # â”€â”€ Unsubmit â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -1135,6 +1168,33 @@ def grade_submission(request, task_id):
     })
 
 
+@api_view(['GET', 'POST'])
+@permission_classes([IsTeacher])
+def task_regrade(request, task_id):
+    """
+    GET  /api/tasks/<id>/regrade/ — progress of the task's latest regrade (taken
+         over here if the process running it died)
+    POST /api/tasks/<id>/regrade/ — regrade the active submissions not graded
+         against the current test cases (e.g. ones a previous regrade could not judge)
+    Test-case edits start a regrade on their own; see regrade.py.
+    """
+    from . import regrade
+    try:
+        task = CodingTask.objects.get(id=task_id)
+    except Exception:
+        return Response({'error': 'Task not found'}, status=404)
+
+    if request.method == 'POST':
+        job = regrade.start(task, requested_by=str(request.user.id), requested_by_name=request.user.username)
+        if job is None:
+            return Response({'status': 'up_to_date', 'job': None})
+        return Response({'status': 'started', 'job': regrade.job_dict(job)}, status=202)
+
+    regrade.resume(task_id)
+    job = RegradeJob.objects(task_id=task_id).order_by('-created_at').first()
+    return Response({'job': regrade.job_dict(job) if job else None})
+
+
 # -- User Notifications -------------------------------------------------------
 
 @api_view(['GET'])
@@ -1673,6 +1733,29 @@ def admin_logs(request):
         })
     return Response(result)
 
+# ── ADMIN: Judge Metrics ─────────────────────────────────────────────────────
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([permissions.IsAuthenticated])
+def judge_metrics(request):
+    """
+    Per-language runner phase histograms for this process, or for the judge
+    daemon when code runs there; DELETE resets them. 'judge' holds the state
+    of the judge components (toolchains, caches, admission, daemon, ...).
+    """
+    if not _is_admin(request):
+        return Response({'error': 'Forbidden'}, status=403)
+    from . import judged, metrics
+    from .health import judge_status
+    snapshot = None
+    if judged.SOCKET:
+        snapshot = judged.metrics(reset=request.method == 'DELETE')
+    if snapshot is None:
+        if request.method == 'DELETE':
+            metrics.reset()
+        snapshot = metrics.snapshot()
+    return Response({**snapshot, 'judge': judge_status()})
+
 # ── ADMIN: Global Announcements ──────────────────────────────────────────────
 
 @api_view(['GET', 'POST'])
@@ -2134,7 +2217,10 @@ def create_tournament(request):
                 title=pq.get('title', 'Untitled Question'),
                 description=pq.get('description', ''),
                 difficulty=pq.get('difficulty', 'Easy'),
-                test_cases=tcs
+                test_cases=tcs,
+                time_limit_ms=int(pq.get('timeLimitMs', 0) or 0),
+                memory_limit_mb=int(pq.get('memoryLimitMb', 0) or 0),
+                language_limits=pq.get('languageLimits') or {},
             ))
     else:
         # Generate placeholders if no questions provided
@@ -2234,6 +2320,8 @@ def _try_auto_start_tournament(t):
         starting_q_index=0
     )
     t.save()
+    from . import matchstate
+    matchstate.invalidate_tournament(t)
     return True
 
 @api_view(['GET', 'DELETE'])
@@ -2260,6 +2348,8 @@ def tournament_detail(request, tournament_id):
     if request.method == 'DELETE':
         if t.teacher_id != str(request.user.id) and not request.user.is_superuser:
             return Response({'error': 'Forbidden'}, status=403)
+        from . import matchstate
+        matchstate.invalidate_tournament(t)
         t.delete()
         return Response({'status': 'deleted'})
 
@@ -2295,6 +2385,9 @@ def add_tournament_question(request, tournament_id):
         description=description,
         difficulty=difficulty,
         test_cases=test_cases,
+        time_limit_ms=int(request.data.get('timeLimitMs', 0) or 0),
+        memory_limit_mb=int(request.data.get('memoryLimitMb', 0) or 0),
+        language_limits=request.data.get('languageLimits') or {},
     )
     
     # If valid index provided, update that question
@@ -2305,6 +2398,8 @@ def add_tournament_question(request, tournament_id):
         t.questions.append(q_data)
 
     t.save()
+    from . import matchstate
+    matchstate.invalidate_tournament(t)
     return Response(_tournament_data(t))
 
 
@@ -2326,6 +2421,8 @@ def remove_tournament_question(request, tournament_id, q_idx):
         return Response({'error': 'Invalid index'}, status=400)
 
     t.save()
+    from . import matchstate
+    matchstate.invalidate_tournament(t)
     return Response(_tournament_data(t))
 
 
@@ -2418,6 +2515,8 @@ def start_tournament(request, tournament_id):
         starting_q_index=0
     )
     t.save()
+    from . import matchstate
+    matchstate.invalidate_tournament(t)
     return Response(_tournament_data(t))
 
 
@@ -2451,6 +2550,8 @@ def advance_tournament(request, tournament_id):
         t.winner_id = winners[0]
         t.winner_username = dict(t.participant_usernames).get(winners[0], '')
         t.save()
+        from . import matchstate
+        matchstate.invalidate_tournament(t)
 
         # Award XP to top 3 finishers
         try:
@@ -2522,6 +2623,8 @@ def advance_tournament(request, tournament_id):
     t.matches = list(t.matches) + new_matches
     t.current_round = next_round
     t.save()
+    from . import matchstate
+    matchstate.invalidate_tournament(t)
     return Response(_tournament_data(t))
 
 
@@ -2555,6 +2658,8 @@ def decide_match_winner(request, tournament_id, match_id):
         return Response({'error': 'Match not found'}, status=404)
 
     t.save()
+    from . import matchstate
+    matchstate.invalidate(str(t.id), [match_id])
     return Response(_tournament_data(t))
 
 
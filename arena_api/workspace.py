@@ -0,0 +1,148 @@
+"""
+arena_api/workspace.py
+RAM-backed scratch space for the runner.
+
+Source files, uncached build outputs and harness inputs go into per-job
+subdirectories of one workspace root, on tmpfs (/dev/shm) when it is available
+and roomy enough, on the regular temp dir otherwise. Job directories are
+emptied and reused rather than created and deleted for every run, and each
+process gets its own root, so directories left behind by a dead worker are
+removed in one sweep when the next one starts.
+"""
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+SHM_DIR  = '/dev/shm'
+# Explicit workspace parent; defaults to /dev/shm, falling back to the temp dir
+ROOT_DIR = os.environ.get('JUDGE_WORKSPACE_DIR', '')
+# tmpfs with less free space than this is not used
+MIN_FREE = int(os.environ.get('JUDGE_WORKSPACE_MIN_FREE_MB', 64)) * 1024 * 1024
+MAX_IDLE = 64   # empty job directories kept around for reuse
+
+logger = logging.getLogger('arena_api.judge')
+
+_lock = threading.Lock()
+_root = None
+_pid  = None
+_idle = []
+
+
+def _usable(path: str) -> bool:
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return False
+    return os.access(path, os.W_OK | os.X_OK) and st.f_bavail * st.f_frsize >= MIN_FREE
+
+
+def _parent() -> str:
+    if ROOT_DIR:
+        return ROOT_DIR
+    if os.path.isdir(SHM_DIR) and _usable(SHM_DIR):
+        return SHM_DIR
+    return tempfile.gettempdir()
+
+
+def _sweep(base: str) -> None:
+    """Remove the roots of processes that no longer exist."""
+    for entry in os.scandir(base):
+        try:
+            pid = int(entry.name)
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(entry.path, ignore_errors=True)
+        except PermissionError:
+            pass   # alive, owned by someone else
+
+
+def _base() -> str:
+    """
+    The judge user's directory holding every process's root. Its name is
+    predictable, so it must be a private directory of ours (see
+    build_cache.private_dir); if another user got there first, a fresh
+    directory is used instead, where roots of dead workers are not swept.
+    """
+    from .build_cache import Untrusted, private_dir
+    name = f'bytebit-judge-{os.geteuid()}'
+    for parent in (_parent(), tempfile.gettempdir()):
+        try:
+            return private_dir(os.path.join(parent, name))
+        except Untrusted as e:
+            logger.warning('%s; trying another workspace directory', e)
+    return tempfile.mkdtemp(prefix=name + '-')
+
+
+def root() -> str:
+    """This process's workspace root, created on first use."""
+    global _root, _pid
+    with _lock:
+        # Re-created after a fork, so forked workers never share job directories
+        if _root is None or _pid != os.getpid() or not os.path.isdir(_root):
+            base = _base()
+            _sweep(base)
+            _pid  = os.getpid()
+            _root = os.path.join(base, str(_pid))
+            os.makedirs(_root, mode=0o700, exist_ok=True)
+            _idle.clear()
+        return _root
+
+
+def on_tmpfs() -> bool:
+    return root().startswith(SHM_DIR + os.sep)
+
+
+def acquire() -> str:
+    """An empty directory for one job; hand it back with release()."""
+    current = root()
+    with _lock:
+        if _idle:
+            return _idle.pop()
+    return tempfile.mkdtemp(prefix='job-', dir=current)
+
+
+def _clear(path: str) -> None:
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.unlink(entry.path)
+
+
+def release(path: str) -> None:
+    """Empty a job directory and keep it for the next job."""
+    try:
+        _clear(path)
+    except OSError:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    with _lock:
+        if len(_idle) < MAX_IDLE and os.path.dirname(path) == _root:
+            _idle.append(path)
+            return
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def job_dir():
+    path = acquire()
+    try:
+        yield path
+    finally:
+        release(path)
+
+
+def write_source(job: str, filename: str, code: str) -> str:
+    path = os.path.join(job, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(code)
+    return path
+
+
+def stats() -> dict:
+    return {'root': root(), 'tmpfs': on_tmpfs(), 'idle_dirs': len(_idle)}
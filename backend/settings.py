@@ -82,6 +82,20 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared cache (judge verdicts etc.) — Redis when available so every Daphne
+# worker sees the same entries, per-process memory otherwise.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+        'KEY_PREFIX': 'bytebit',
+    },
+} if os.environ.get('REDIS_URL') else {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -230,3 +244,19 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+
+# Logging
+# https://docs.djangoproject.com/en/6.0/topics/logging/
+# Django's defaults, plus the periodic judge metrics summary (arena_api/metrics.py)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'arena_api.judge': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}